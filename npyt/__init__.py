@@ -1,3 +1,3 @@
 from npyt._version import __version__
-from npyt.core import NPYT
+from npyt.core import NPYT, NPYT_RB
 from npyt.endless import NPY8
@@ -0,0 +1,240 @@
+"""
+libc中numpy和标准库没有直接提供的内存映射函数，用ctypes调用
+
+只支持POSIX系统
+"""
+import ctypes
+import errno
+import mmap
+import os
+import platform
+import weakref
+
+import numpy as np
+
+PAGESIZE: int = mmap.PAGESIZE
+
+PROT_READ: int = mmap.PROT_READ
+PROT_WRITE: int = mmap.PROT_WRITE
+MAP_SHARED: int = mmap.MAP_SHARED
+MAP_FIXED: int = 0x10
+MAP_FAILED: int = ctypes.c_void_p(-1).value
+FALLOC_FL_KEEP_SIZE: int = 0x01
+FALLOC_FL_PUNCH_HOLE: int = 0x02
+FUTEX_WAIT: int = 0
+FUTEX_WAKE: int = 1
+# futex只能用syscall调用，编号与架构有关
+_SYS_FUTEX_ = {"x86_64": 202, "amd64": 202, "aarch64": 98, "arm64": 98}.get(platform.machine().lower())
+
+if os.name == "posix":
+    _libc = ctypes.CDLL(None, use_errno=True)
+    _libc.mmap.restype = ctypes.c_void_p
+    _libc.mmap.argtypes = [ctypes.c_void_p, ctypes.c_size_t, ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_int64]
+    _libc.munmap.restype = ctypes.c_int
+    _libc.munmap.argtypes = [ctypes.c_void_p, ctypes.c_size_t]
+    _libc.madvise.restype = ctypes.c_int
+    _libc.madvise.argtypes = [ctypes.c_void_p, ctypes.c_size_t, ctypes.c_int]
+    _libc.mlock.restype = ctypes.c_int
+    _libc.mlock.argtypes = [ctypes.c_void_p, ctypes.c_size_t]
+    _libc.munlock.restype = ctypes.c_int
+    _libc.munlock.argtypes = [ctypes.c_void_p, ctypes.c_size_t]
+    _libc.mincore.restype = ctypes.c_int
+    _libc.mincore.argtypes = [ctypes.c_void_p, ctypes.c_size_t, ctypes.c_void_p]
+    if hasattr(_libc, "fallocate"):
+        _libc.fallocate.restype = ctypes.c_int
+        _libc.fallocate.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_int64, ctypes.c_int64]
+    _libc.syscall.restype = ctypes.c_long
+else:
+    _libc = None
+
+
+class _timespec(ctypes.Structure):
+    _fields_ = [("tv_sec", ctypes.c_long), ("tv_nsec", ctypes.c_long)]
+
+
+def _check_libc() -> None:
+    if _libc is None:
+        raise NotImplementedError(f"only POSIX systems are supported, not {os.name}")
+
+
+def _errno(ret: int, name: str) -> None:
+    if ret == -1:
+        err = ctypes.get_errno()
+        raise OSError(err, f"{name}: {os.strerror(err)}")
+
+
+def page_ceil(nbytes: int) -> int:
+    """向上取整到页大小"""
+    return (nbytes + PAGESIZE - 1) // PAGESIZE * PAGESIZE
+
+
+def mmap_fd(fd: int, length: int, writable: bool, addr: int = 0, offset: int = 0) -> int:
+    """映射文件。可以超出文件大小，超出部分在文件扩充后才能访问，否则SIGBUS
+
+    Returns
+    -------
+    int
+        映射的起始地址
+
+    """
+    _check_libc()
+    prot = PROT_READ | PROT_WRITE if writable else PROT_READ
+    flags = MAP_SHARED | MAP_FIXED if addr else MAP_SHARED
+    ret = _libc.mmap(addr or None, length, prot, flags, fd, offset)
+    if ret is None or ret == MAP_FAILED:
+        _errno(-1, "mmap")
+    return ret
+
+
+def munmap(addr: int, length: int) -> None:
+    _errno(_libc.munmap(addr, length), "munmap")
+
+
+def page_range(addr: int, length: int):
+    """扩大到整页。返回页对齐的起始地址与长度"""
+    start = addr // PAGESIZE * PAGESIZE
+    return start, page_ceil(addr + length - start)
+
+
+def madvise(addr: int, length: int, advice: int) -> None:
+    """对[addr, addr+length)所在的页调用madvise"""
+    _check_libc()
+    if length <= 0:
+        return
+    _errno(_libc.madvise(*page_range(addr, length), advice), "madvise")
+
+
+def mlock(addr: int, length: int) -> None:
+    """锁定[addr, addr+length)所在的页，不会被换出。受`RLIMIT_MEMLOCK`限制"""
+    _check_libc()
+    if length <= 0:
+        return
+    _errno(_libc.mlock(*page_range(addr, length)), "mlock")
+
+
+def munlock(addr: int, length: int) -> None:
+    """解锁[addr, addr+length)所在的页"""
+    _check_libc()
+    if length <= 0:
+        return
+    _errno(_libc.munlock(*page_range(addr, length)), "munlock")
+
+
+def mincore(addr: int, length: int) -> np.ndarray:
+    """[addr, addr+length)所在的页是否在内存中。文件映射查的是页缓存，本进程没访问过的页也算
+
+    Returns
+    -------
+    np.ndarray
+        每页一个bool
+    """
+    _check_libc()
+    if length <= 0:
+        return np.empty(0, dtype=bool)
+    start, length = page_range(addr, length)
+    vec = np.empty(length // PAGESIZE, dtype=np.uint8)
+    _errno(_libc.mincore(start, length, vec.ctypes.data), "mincore")
+    return (vec & 1).astype(bool)
+
+
+def punch_hole(filename, offset: int, length: int) -> int:
+    """释放文件中[offset, offset+length)内整页的磁盘空间，文件大小不变，读出来都是0
+
+    Returns
+    -------
+    int
+        实际释放的字节数
+
+    """
+    if _libc is None or not hasattr(_libc, "fallocate"):
+        raise NotImplementedError("fallocate(PUNCH_HOLE) is only supported on Linux")
+    start = page_ceil(offset)
+    length = (offset + length) // PAGESIZE * PAGESIZE - start
+    if length <= 0:
+        return 0
+    fd = os.open(filename, os.O_RDWR)
+    try:
+        _errno(_libc.fallocate(fd, FALLOC_FL_PUNCH_HOLE | FALLOC_FL_KEEP_SIZE, start, length), "fallocate")
+    finally:
+        os.close(fd)
+    return length
+
+
+def region(addr: int, length: int, writable: bool):
+    """把映射的地址包装成支持buffer协议的对象，可直接给np.ndarray(buffer=)使用
+
+    所有引用它的numpy视图都释放后，自动munmap
+    """
+    buf = (ctypes.c_ubyte * length).from_address(addr)
+    buf.writable = writable
+    weakref.finalize(buf, munmap, addr, length)
+    return buf
+
+
+def map_file(filename, length: int, writable: bool):
+    """映射文件到一段长度为length的虚拟地址空间。文件可以比length小"""
+    fd = os.open(filename, os.O_RDWR if writable else os.O_RDONLY)
+    try:
+        length = page_ceil(length)
+        return region(mmap_fd(fd, length, writable), length, writable)
+    finally:
+        os.close(fd)
+
+
+def map_mirror(filename, offset: int, length: int, writable: bool):
+    """文件中[offset, offset+length)区域连续映射两次。offset与length都要是页大小的整数倍
+
+    后一半与前一半是同一块物理内存，跨越末尾的窗口也是连续的
+    """
+    fd = os.open(filename, os.O_RDWR if writable else os.O_RDONLY)
+    try:
+        # 先占好两倍的地址空间，再把后一半替换成同一段文件
+        addr = mmap_fd(fd, length * 2, writable, offset=offset)
+        try:
+            mmap_fd(fd, length, writable, addr=addr + length, offset=offset)
+        except OSError:
+            munmap(addr, length * 2)
+            raise
+        return region(addr, length * 2, writable)
+    finally:
+        os.close(fd)
+
+
+def has_futex() -> bool:
+    """是否支持futex。只支持Linux的x86_64与aarch64"""
+    return _libc is not None and _SYS_FUTEX_ is not None and os.uname().sysname == "Linux"
+
+
+def futex_wait(addr: int, expected: int, timeout: float) -> bool:
+    """addr处的uint32等于expected时睡眠，直到被唤醒或超时。共享映射的地址可以跨进程
+
+    Returns
+    -------
+    bool
+        被唤醒或值已变化返回True，超时返回False
+
+    """
+    ts = _timespec(int(timeout), int((timeout % 1) * 1e9))
+    ret = _libc.syscall(_SYS_FUTEX_, ctypes.c_void_p(addr), FUTEX_WAIT, ctypes.c_uint32(expected),
+                        ctypes.byref(ts), None, 0)
+    if ret == -1:
+        err = ctypes.get_errno()
+        if err == errno.ETIMEDOUT:
+            return False
+        if err not in (errno.EAGAIN, errno.EINTR):
+            raise OSError(err, f"futex: {os.strerror(err)}")
+    return True
+
+
+def futex_wake(addr: int, n: int = 0x7fffffff) -> int:
+    """唤醒在addr上等待的进程
+
+    Returns
+    -------
+    int
+        唤醒的数量
+
+    """
+    ret = _libc.syscall(_SYS_FUTEX_, ctypes.c_void_p(addr), FUTEX_WAKE, n, None, None, 0)
+    _errno(ret, "futex")
+    return ret
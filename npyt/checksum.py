@@ -0,0 +1,185 @@
+"""
+分块校验
+
+每块固定行数，用`zlib.crc32`计算校验值，保存在`.npy.crc`旁路文件中。
+旁路文件是连续的记录，每条记录为块的结束行号与校验值，块的开始行号为上一条记录的结束行号。
+
+- append时增量计算，未写满的最后一块也有校验值
+- 非正常退出后，并行校验所有块，找到最后一个有效块，修正尾巴中的end
+- 重新打开时，最后一条记录之后的行没有校验，可能是写了一半的，不补算，要先`recover`
+
+`zlib.crc32`在数据较大时释放GIL，多线程就能并行
+"""
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+from loguru import logger
+from typing_extensions import Self
+
+from npyt.format import as_bytes
+
+_ENTRY_DTYPE_ = np.dtype([("end", np.uint64), ("crc", np.uint32)], align=True)
+
+
+def crc_path(filename: Path) -> Path:
+    """旁路文件名。不以`.npy`结尾，不会被`NPY8`当成数据文件"""
+    return Path(f"{filename}.crc")
+
+
+class Checksum:
+
+    def __init__(self, nt, block_size: int = 4096):
+        """分块校验
+
+        Parameters
+        ----------
+        nt:NPYT
+            需要校验的文件，要先load
+        block_size:int
+            每块行数
+
+        """
+        self._nt = nt
+        self._block_size: int = max(int(block_size), 1)
+        self._filename: Path = crc_path(nt.filename())
+        self._fp = None
+        # 最后一块的状态
+        self._count: int = 0
+        self._block_start: int = 0
+        self._end: int = 0
+        self._crc: int = 0
+        # 旁路文件落后于尾巴。之后的行没有校验过，recover前不计入校验
+        self._lagging: bool = False
+
+    def lagging(self) -> bool:
+        """旁路文件是否落后于尾巴，需要`recover`"""
+        return self._lagging
+
+    def entries(self) -> np.ndarray:
+        """所有块的记录"""
+        if not self._filename.exists():
+            return np.empty(0, dtype=_ENTRY_DTYPE_)
+        data = self._filename.read_bytes()
+        # 写了一半的记录丢弃
+        count = len(data) // _ENTRY_DTYPE_.itemsize
+        return np.frombuffer(data, dtype=_ENTRY_DTYPE_, count=count)
+
+    def load(self) -> Self:
+        """打开旁路文件。第一次开启时计算已有数据的校验
+
+        旁路文件已存在而尾巴的end更大时，说明非正常退出时旁路文件没写完，之后的行可能是写坏的。
+        这些行不补算校验，否则`verify`就发现不了，要先`recover`
+        """
+        self.close()
+        exists = self._filename.exists()
+        entries = self.entries()
+        self._fp = open(self._filename, "r+b" if exists else "w+b")
+        self._fp.truncate(len(entries) * _ENTRY_DTYPE_.itemsize)
+        self._count = len(entries)
+        self._end = int(entries["end"][-1]) if self._count else 0
+        self._block_start = int(entries["end"][-2]) if self._count > 1 else 0
+        self._crc = int(entries["crc"][-1]) if self._count else 0
+        self._lagging = False
+        if self._end > self._nt.end():
+            logger.warning("{} checksum is ahead of data, recover first", self._filename)
+            return self
+        if exists and self._end < self._nt.end():
+            logger.warning("{} rows [{}, {}) are not checksummed, recover first",
+                           self._nt.filename(), self._end, self._nt.end())
+            self._lagging = True
+            return self
+        return self.update()
+
+    def close(self) -> None:
+        if self._fp is not None:
+            self._fp.close()
+            self._fp = None
+
+    def reset(self) -> Self:
+        """清空所有校验。数据被清空时使用"""
+        self._fp.truncate(0)
+        self._count = 0
+        self._block_start = 0
+        self._end = 0
+        self._crc = 0
+        self._lagging = False
+        return self
+
+    def update(self) -> Self:
+        """把新写入的行计入校验。append后调用。旁路文件落后时不计算，等`recover`"""
+        if self._lagging:
+            return self
+        a = self._nt._raw()
+        end = self._nt.end()
+        while self._end < end:
+            if self._count == 0 or self._end - self._block_start >= self._block_size:
+                # 新开一块
+                self._count += 1
+                self._block_start = self._end
+                self._crc = 0
+            upto = min(end, self._block_start + self._block_size)
+            self._crc = zlib.crc32(as_bytes(a[self._end:upto]), self._crc)
+            self._end = upto
+            self._fp.seek((self._count - 1) * _ENTRY_DTYPE_.itemsize, 0)
+            self._fp.write(np.array([(upto, self._crc)], dtype=_ENTRY_DTYPE_).tobytes())
+        self._fp.flush()
+        return self
+
+    def verify(self, max_workers: Optional[int] = None) -> int:
+        """并行校验所有块
+
+        Parameters
+        ----------
+        max_workers:int
+            线程数。None为默认
+
+        Returns
+        -------
+        int
+            从头开始连续有效的最后一行。`trim`丢弃的块不校验，当作有效。最后一条记录之后的行没有校验，不算有效
+
+        """
+        a = self._nt._raw()
+        start, end = self._nt.start(), self._nt.end()
+        entries = self.entries()
+        ends = entries["end"].astype(np.int64)
+        starts = np.concatenate([[0], ends[:-1]])
+
+        def check(k: int) -> bool:
+            if starts[k] < start:
+                return True
+            if ends[k] > end or ends[k] <= starts[k]:
+                return False
+            return zlib.crc32(as_bytes(a[starts[k]:ends[k]])) == entries["crc"][k]
+
+        with ThreadPoolExecutor(max_workers) as executor:
+            oks = list(executor.map(check, range(len(entries))))
+
+        valid = 0
+        for k, ok in enumerate(oks):
+            if not ok:
+                logger.warning("{} block {} [{}, {}) is broken", self._nt.filename(), k, starts[k], ends[k])
+                break
+            valid = int(ends[k])
+        return valid
+
+    def recover(self, max_workers: Optional[int] = None) -> int:
+        """找到最后一个有效块，修正尾巴中的end，丢弃之后的数据与校验。没有校验的行也丢弃
+
+        Returns
+        -------
+        int
+            修正后的end
+
+        """
+        valid = self.verify(max_workers)
+        if valid < self._nt.end():
+            logger.warning("recover {} end from {} to {}", self._nt.filename(), self._nt.end(), valid)
+            self._nt._t[1] = valid
+        count = int(np.searchsorted(self.entries()["end"], valid, side="right"))
+        self._fp.truncate(count * _ENTRY_DTYPE_.itemsize)
+        self.load()
+        return self._end
@@ -3,14 +3,20 @@
 import os
 import shutil
 from pathlib import Path
-from typing import Optional, Union
+from typing import Dict, Iterable, List, Optional, Tuple, Union
 
 import numpy as np
 from loguru import logger
 from typing_extensions import Literal  # 3.8+
 from typing_extensions import Self  # 3.11+
 
-from npyt.format import get_file_ctx, save, load, resize
+from npyt._libc import PAGESIZE, madvise, mincore, mlock, munlock, page_range, punch_hole
+from npyt.checksum import Checksum, crc_path
+from npyt.sequence import Sequence
+from npyt.format import columns_length, to_columns, to_frame
+from npyt.format import backup, check, get_file_ctx, save, save_stream, load, load_mirror, load_reserved, resize, get_ring_capacity, \
+    _MAGIC_NUMBER_
+from npyt.zonemap import Condition, ZoneMap, match_rows, zone_path
 
 
 class NPYT:
@@ -44,6 +50,31 @@ class NPYT:
         self._capacity: int = 0
         self._tell: int = 0
         self._dtype: Optional[np.dtype] = dtype
+        # 加载时的映射模式与文件大小，refresh时用来判断是否需要重新映射
+        self._mmap_mode: Optional[str] = None
+        self._nbytes: int = 0
+        # 预留模式。预留的行数与映射区域
+        self._reserve: int = 0
+        self._region = None
+        # 数据区的字节视图，append_bytes时才创建
+        self._mv: Optional[memoryview] = None
+        # 分块校验。None表示不校验
+        self._checksum = None
+        # 分块最小最大值。None表示不统计
+        self._zonemap = None
+        # 就绪通知板与槽位。None表示不通知
+        self._board = None
+        self._slot: int = 0
+        # 锁定在内存中的尾部行数，与已锁定的地址范围[lo, hi)
+        self._hot_rows: int = 0
+        self._locked: Tuple[int, int] = (0, 0)
+        # 按序号去重。None表示不去重
+        self._sequence: Optional[Sequence] = None
+        # 最新值快照表，与已更新到的行。None表示不更新
+        self._snapshot = None
+        self._snapshot_end: int = 0
+        # 读进程上次从尾巴中取得的start、end。文件被截断时旧尾巴不能访问，用它来读已确认的数据
+        self._seen: Tuple[int, int] = (0, 0)
 
     def filename(self) -> Path:
         return self._filename
@@ -61,6 +92,27 @@ class NPYT:
         """测试用。获取原始数组长度"""
         return self._a.shape[0]
 
+    def _slice(self, start: int, end: int) -> np.ndarray:
+        """行号对应的视图"""
+        return self._a[start:end]
+
+    def arrays(self) -> Tuple[np.ndarray, np.ndarray]:
+        """取原始数组与尾巴。传给`npyt.kernels`中的numba函数使用
+
+        Notes
+        -----
+        kernels直接改尾巴，不经过`_appended`，校验、统计、快照、通知、锁定与去重都不会更新。
+        所以写进程开启了这些功能时不能取，取了之后也不要再开启。`NPYT_RB`会回绕，不支持
+
+        """
+        assert not isinstance(self, NPYT_RB), "kernels are not supported by NPYT_RB"
+        if self._mmap_mode != "r":
+            hooks = {"checksum": self._checksum, "zonemap": self._zonemap, "snapshot": self._snapshot,
+                     "board": self._board, "hot_rows": self._hot_rows, "sequence": self._sequence}
+            enabled = [k for k, v in hooks.items() if v]
+            assert not enabled, f"kernels bypass {enabled}"
+        return self._a, self._t
+
     def info(self):
         """获取头信息"""
         """获取尾巴关键信息"""
@@ -75,15 +127,194 @@ class NPYT:
     def clear(self) -> Self:
         """重置位置指针，相当于清空了数据"""
         self._t[0:2] = 0
+        if self._checksum:
+            self._checksum.reset()
+        if self._zonemap:
+            self._zonemap.reset()
+        if self._sequence:
+            self._sequence.reset()
+        return self
+
+    def sequence(self, field: Optional[str]) -> Sequence:
+        """开启按序号去重。`append`、`expend`、`append_columns`只写入序号比已写入的都大的行
+
+        Parameters
+        ----------
+        field:str
+            单调递增的整数序号字段。非结构体数组为None
+
+        Returns
+        -------
+        Sequence
+            用`gaps`取得写入时发现的序号缺口
+
+        Notes
+        -----
+        1. 已写入的最大序号取自最后一行，重新load后开启即可恢复
+        2. `append_bytes`、`append_into`不检查序号，混用时要自己保证有序
+
+        """
+        self._sequence = Sequence(field).load(self.tail(1))
+        return self._sequence
+
+    def checksum(self, block_size: int = 4096) -> Checksum:
+        """开启分块校验。append时增量计算，保存在`.npy.crc`旁路文件中
+
+        Parameters
+        ----------
+        block_size:int
+            每块行数
+
+        Returns
+        -------
+        Checksum
+            用`verify`校验，`recover`修复非正常退出后的文件
+
+        Notes
+        -----
+        1. 已有数据会先全部计算一次。环形缓冲区的数据会被覆盖，不支持
+        2. 旁路文件落后于尾巴时，之后的行不补算，`recover`会把它们丢弃
+
+        """
+        assert not isinstance(self, NPYT_RB), "checksum is not supported by NPYT_RB"
+        self._checksum = Checksum(self, block_size).load()
+        return self._checksum
+
+    def zonemap(self, fields: Optional[List[Optional[str]]] = None, block_size: int = 4096) -> ZoneMap:
+        """开启分块最小最大值统计。append时增量计算，保存在`.npy.zone`旁路文件中，`filter`用来跳过块
+
+        Parameters
+        ----------
+        fields:list
+            统计的字段。None为全部字段
+        block_size:int
+            每块行数
+
+        Notes
+        -----
+        已有数据会先全部统计一次。环形缓冲区的数据会被覆盖，不支持
+
+        """
+        assert not isinstance(self, NPYT_RB), "zonemap is not supported by NPYT_RB"
+        self._zonemap = ZoneMap(self, fields, block_size).load()
+        return self._zonemap
+
+    def filter(self, conditions: List[Condition]) -> np.ndarray:
+        """按条件过滤。有`.npy.zone`旁路文件时跳过不可能满足的块，读进程也能用
+
+        Parameters
+        ----------
+        conditions:list
+            (字段, 比较符, 值)的列表，条件之间是且的关系。比较符为`>`、`>=`、`<`、`<=`、`==`。非结构体数组的字段为None
+
+        Returns
+        -------
+        np.ndarray
+            满足条件的行，是复制的
+
+        Examples
+        --------
+        >>> nt.filter([("price", ">", 10.5), ("volume", ">=", 100)])
+
+        """
+        self._bounds()
+        zonemap = self._zonemap
+        if zonemap is None and zone_path(self._filename).exists():
+            zonemap = ZoneMap(self)
+        if zonemap is not None:
+            ranges = zonemap.blocks(conditions)
+        else:
+            start, end = self._range()
+            ranges = [(start, end)] if start < end else []
+
+        outputs = []
+        for start, end in ranges:
+            chunk = self._slice(start, end)
+            outputs.append(chunk[match_rows(chunk, conditions)])
+        if len(outputs) == 0:
+            return np.empty(0, dtype=self._a.dtype)
+        return np.concatenate(outputs)
+
+    def notify_to(self, board, key: Union[str, Path, None] = None) -> Self:
+        """写进程append后在通知板上通知，`npyt.selector.Selector`的消费者就能及时发现
+
+        Parameters
+        ----------
+        board:Board
+            通知板，要先load
+        key:str
+            槽位名。默认为文件名
+
+        """
+        self._board = board
+        self._slot = board.slot(self._filename if key is None else key)
         return self
 
+    def snapshot_to(self, snapshot) -> Self:
+        """写进程append后把每个键的最后一行更新到最新值快照表
+
+        Parameters
+        ----------
+        snapshot:Snapshot
+            `npyt.snapshot.Snapshot`，要先用`r+`打开
+
+        """
+        self._snapshot = snapshot
+        self._snapshot_end = self.end()
+        return self
+
+    def _appended(self) -> None:
+        """append后更新旁路统计并通知"""
+        if self._checksum:
+            self._checksum.update()
+        if self._zonemap:
+            self._zonemap.update()
+        if self._snapshot is not None:
+            end = self.end()
+            # clear后从头开始
+            start = self._snapshot_end if self._snapshot_end <= end else self.start()
+            self._snapshot.update(self._slice(start, end))
+            self._snapshot_end = end
+        if self._board is not None:
+            self._board.notify(self._slot)
+        if self._hot_rows:
+            self._slide()
+
     def start(self) -> int:
-        """获取缓冲区开始位置"""
-        # return int(self._t[0])
-        return 0
+        """获取缓冲区开始位置。`trim`后才会大于0。读进程先确认映射有效"""
+        return self._range()[0]
+
+    def trim(self, start: int) -> int:
+        """丢弃start之前的数据，并释放对应的磁盘空间。不移动数据，行号不变
+
+        Parameters
+        ----------
+        start:int
+            新的开始位置。只能前进，不能超过end。常用`trim(tell())`丢弃已消费的数据
+
+        Returns
+        -------
+        int
+            释放的字节数。不支持打洞的系统只移动start，返回0
+
+        Notes
+        -----
+        只释放整页，边界上不足一页的部分保留。被释放的行读出来都是0
+
+        """
+        start = min(max(start, self.start()), self.end())
+        self._t[0] = start
+        try:
+            # 每次都从头打洞，已经是空洞的部分开销很小
+            return punch_hole(self._filename, int(self._t[2]), start * self._a.strides[0])
+        except (NotImplementedError, OSError) as e:
+            logger.warning("trim {} without releasing disk space:{}", self._filename, e)
+            return 0
 
     def end(self) -> int:
-        """获取缓冲区结束位置"""
+        """获取缓冲区结束位置。读进程先确认映射有效"""
+        if self._mmap_mode == "r":
+            return self._bounds()[1]
         return int(self._t[1])
 
     def empty(self) -> bool:
@@ -91,12 +322,12 @@ class NPYT:
         return self.start() == self.end()
 
     def full(self) -> bool:
-        """查询缓冲区是否已满"""
-        return (self.end() + 1) % (self._capacity + 1) == self.start()
+        """查询缓冲区是否已满。数据不移动，`trim`后前面的空间也不能再用"""
+        return self.end() >= self._capacity
 
     def size(self) -> int:
         """当前缓冲区中元素个数"""
-        start, end = self.start(), self.end()
+        start, end = self._range()
         if end >= start:
             return end - start
         else:
@@ -106,7 +337,7 @@ class NPYT:
         """缓冲区容量大小（最大可容纳元素数）"""
         return self._capacity
 
-    def load(self, mmap_mode: Literal["r", "r+"]) -> Self:
+    def load(self, mmap_mode: Literal["r", "r+"], reserve: int = 0) -> Self:
         """加载文件。为以后操作做准备
 
         Parameters
@@ -116,16 +347,103 @@ class NPYT:
 
             r: 只读
             r+: 读写
+        reserve:int
+            预留虚拟地址空间的行数。>0时开启预留模式，只支持POSIX系统
+
+            一次性映射比文件大的地址空间，容量在预留范围内变化时基地址不变。
+            `expend`只需扩充文件和修改头尾，已取得的视图(如传给numba的数组)一直有效
 
         """
-        self._a, self._t = load(self._filename, mmap_mode=mmap_mode)
+        self._reserve = max(reserve, self._reserve)
+        self._unlock()
+        if self._reserve > 0:
+            self._a, self._t, self._region = load_reserved(self._filename, mmap_mode, self._reserve, self._region)
+        else:
+            self._a, self._t = load(self._filename, mmap_mode=mmap_mode)
+        self._mv = None
         self._capacity = self._a.shape[0]
+        self._mmap_mode = mmap_mode
+        self._nbytes = os.path.getsize(self._filename)
         if self._dtype is None:
             self._dtype = self._a.dtype
         else:
             assert self._dtype == self._a.dtype, f"dtype mismatch {self._dtype} != {self._a.dtype}"
+        if self._hot_rows:
+            self._slide()
+        if self._t is not None:
+            self._seen = self._footer()
         return self
 
+    def refresh(self) -> bool:
+        """写进程resize或expend后，重新映射文件。文件大小没变时不做任何操作
+
+        Returns
+        -------
+        bool
+            是否重新映射了
+
+        Notes
+        -----
+        只用了一次`stat`，开销很小。写进程截断文件后，旧映射访问超出文件的部分会SIGBUS，
+        只读映射的`start`、`end`、`data`等访问数据前都会自动调用。`at`、`arrays`不调用
+
+        """
+        if self._mmap_mode is None:
+            return False
+        try:
+            nbytes = os.path.getsize(self._filename)
+        except FileNotFoundError:
+            return False
+        if nbytes == self._nbytes:
+            return False
+        if check(self._filename) is not None:
+            # 写进程正在resize，头尾还没写完，下次再试
+            return False
+        logger.trace("refresh {} from {} to {}", self._filename, self._nbytes, nbytes)
+        self.load(self._mmap_mode)
+        return True
+
+    def _moved(self) -> bool:
+        """旧尾巴被写进程标记了，说明文件已经resize。只读内存，不调用系统函数"""
+        return self._t is not None and self._t[3] != _MAGIC_NUMBER_
+
+    def _sync(self) -> bool:
+        """访问尾巴前确认映射有效
+
+        写进程截断文件后，旧尾巴所在的页已不在文件中，读进程访问会SIGBUS。
+        所以只读映射先用一次`stat`比较文件大小，变了就重新映射，不碰旧尾巴
+
+        Returns
+        -------
+        bool
+            尾巴能否访问。写进程正在resize时为False
+
+        """
+        if self._mmap_mode != "r":
+            if self._moved():
+                self.refresh()
+            return True
+        try:
+            nbytes = os.path.getsize(self._filename)
+        except FileNotFoundError:
+            return False
+        return nbytes == self._nbytes or self.refresh()
+
+    def _footer(self) -> Tuple[int, int]:
+        """直接从尾巴取start、end。旧版环形缓冲区的文件可能start>end，start当作0处理"""
+        start, end = int(self._t[0]), int(self._t[1])
+        return (start if start <= end else 0), end
+
+    def _bounds(self) -> Tuple[int, int]:
+        """安全地取start、end。尾巴不能访问时用上次的值，这部分数据截断后仍在文件中"""
+        if self._sync():
+            self._seen = self._footer()
+        return self._seen
+
+    def _range(self) -> Tuple[int, int]:
+        """取start、end。读进程用`_bounds`，写进程自己修改文件，直接读尾巴"""
+        return self._bounds() if self._mmap_mode == "r" else self._footer()
+
     def save(self,
              array: Optional[np.ndarray] = None,
              capacity: int = 0,
@@ -159,6 +477,40 @@ class NPYT:
 
         return self
 
+    def save_stream(self,
+                    chunks: Iterable[np.ndarray],
+                    dtype: Optional[np.dtype] = None,
+                    capacity_hint: int = 0,
+                    skip_if_exists: bool = True) -> Self:
+        """流式创建文件。数据块顺序写入，不用先拼接成大数组，适合转换比内存大的历史数据
+
+        Parameters
+        ----------
+        chunks:
+            数据块迭代器，如分块读取的CSV、数据库查询结果
+        dtype:np.dtype
+            数据类型。None时使用初始化时的dtype
+        capacity_hint:int
+            预估容量。写完后不足时以实际行数为准
+        skip_if_exists:bool
+            如果文件已经存在了就跳过。反之新建
+
+        """
+        if skip_if_exists and self._filename.exists():
+            return self
+
+        if dtype is None:
+            dtype = self._dtype
+        elif self._dtype is None:
+            self._dtype = dtype = np.dtype(dtype)
+        else:
+            assert self._dtype == dtype, f"dtype mismatch {self._dtype} != {dtype}"
+        assert dtype is not None, "dtype is required"
+        end = save_stream(get_file_ctx(self._filename, mode="wb+"), chunks, dtype, capacity_hint)
+        logger.trace("save_stream {} rows to {}", end, self._filename)
+
+        return self
+
     def resize(self, capacity: Optional[int] = None) -> bool:
         """文件截断或扩充。不能丢失有效数据
 
@@ -175,7 +527,7 @@ class NPYT:
 
         """
         # 一些基本信息
-        start, end = self.start(), self.end()
+        start, end = self._range()
 
         # 数据环形，文件不能动了
         if end < start:
@@ -188,40 +540,181 @@ class NPYT:
 
         # 一定要copy,因为后面要释放文件
         arr = self._a[:1].copy()
-        # 释放文件占用
+        # 释放文件占用。预留模式的映射区域保留，基地址不变
+        self._unlock()
         self._a = None
         self._t = None
+        self._mv = None
         # 释放后就可以动文件了
         return resize(self._filename, arr, start, end, capacity)
 
-    def backup(self, to_path: Union[str, Path]) -> None:
+    def backup(self, to_path: Union[str, Path], incremental: bool = False) -> int:
         """备份
 
         Parameters
         ----------
         to_path:str
             备份路径
+        incremental:bool
+            增量备份。只复制上次备份后新增的行与尾巴，未使用的容量保持稀疏
+
+        Returns
+        -------
+        int
+            增量备份时复制的行数。全量备份时为有效数据长度
+
+        Notes
+        -----
+        分块校验、分块最小最大值的旁路文件很小，每次都整个复制。在数据之后复制，可能比数据新，
+        恢复后开启校验时会提示先`recover`
 
         """
         path = Path(to_path)
         path.mkdir(parents=True, exist_ok=True)
 
-        shutil.copy2(self._filename, path)
-        logger.info("backup {} to {}", self._filename, path)
+        if incremental:
+            rows = backup(self._filename, path / self._filename.name, self.start(), self.end())
+            logger.info("backup {} rows of {} to {}", rows, self._filename, path)
+        else:
+            shutil.copy2(self._filename, path)
+            rows = self.size()
+            logger.info("backup {} to {}", self._filename, path)
+        for sidecar in (crc_path(self._filename), zone_path(self._filename)):
+            if sidecar.exists():
+                shutil.copy2(sidecar, path)
+        return rows
+
+    def persist(self, to_file: Union[str, Path], capacity: int = 0) -> None:
+        """保存快照。常用于共享内存中的文件，收盘后保存到磁盘
+
+        Parameters
+        ----------
+        to_file:str
+            快照文件名
+        capacity:int
+            快照的容量。不足end时，截断到end
+
+        Notes
+        -----
+        行号不变，`trim`丢弃的行在快照中是稀疏的空洞，按行号记录的游标仍然有效
+
+        """
+        to_file = Path(to_file)
+        start, end = self._range()
+        # 不从旧快照继续，整个重新复制
+        to_file.unlink(missing_ok=True)
+        backup(self._filename, to_file, start, end)
+        resize(to_file, self._a[:1].copy(), start, end, max(capacity, end))
+        logger.info("persist {} to {}", self._filename, to_file)
+
+    def madvise(self, advice: int) -> Self:
+        """对数据区调用madvise。重新映射后需再次调用
+
+        Parameters
+        ----------
+        advice:int
+            如`mmap.MADV_HUGEPAGE`，共享内存中的文件可以用透明大页
+
+        """
+        madvise(self._a.ctypes.data, self._a.nbytes, advice)
+        return self
+
+    def mlock_tail(self, rows: int) -> Self:
+        """把最后rows行所在的页锁定在内存中，随着end前进滑动，内存紧张时也不会被换出
+
+        Parameters
+        ----------
+        rows:int
+            锁定的行数。0表示解锁
+
+        Notes
+        -----
+        1. 写进程锁定后，页缓存中的页对所有读进程都有效
+        2. 只在跨页时调用系统函数。超出`RLIMIT_MEMLOCK`时放弃锁定，只记录警告
+
+        """
+        self._unlock()
+        self._hot_rows = max(int(rows), 0)
+        if self._hot_rows:
+            self._slide()
+        return self
+
+    def _unlock(self) -> None:
+        lo, hi = self._locked
+        self._locked = (0, 0)
+        if hi > lo and self._a is not None:
+            munlock(lo, hi - lo)
+
+    def _slide(self) -> None:
+        """锁定范围移动到最新的行。新进入的页锁定，离开的页解锁"""
+        end = self.end()
+        arr = self._slice(max(self.start(), end - self._hot_rows), end)
+        lo, length = page_range(arr.ctypes.data, arr.nbytes) if arr.nbytes else (0, 0)
+        hi = lo + length
+        old_lo, old_hi = self._locked
+        if (lo, hi) == (old_lo, old_hi):
+            return
+        try:
+            if old_lo <= lo < old_hi:
+                munlock(old_lo, lo - old_lo)
+                if hi > old_hi:
+                    mlock(old_hi, hi - old_hi)
+                else:
+                    munlock(hi, old_hi - hi)
+            else:
+                self._unlock()
+                mlock(lo, hi - lo)
+        except OSError as e:
+            logger.warning("mlock {} failed, tail is not locked:{}", self._filename, e)
+            self._hot_rows = 0
+            self._locked = (old_lo, old_hi)
+            self._unlock()
+            return
+        self._locked = (lo, hi)
+
+    def residency(self) -> Tuple[int, int]:
+        """有效数据所在的页有多少在页缓存中
+
+        Returns
+        -------
+        int
+            在内存中的字节数
+        int
+            总字节数。按整页计算
+
+        """
+        arr = self._slice(*self._range())
+        pages = mincore(arr.ctypes.data, arr.nbytes)
+        return int(pages.sum()) * PAGESIZE, len(pages) * PAGESIZE
 
     def data(self) -> np.ndarray:
         """取数据区。环形数据会拼接起来不可修改"""
-        start, end = self.start(), self.end()
+        start, end = self._range()
         return self._a[start:end]
 
     def head(self, n: int = 5) -> np.ndarray:
         """取头部数据"""
-        start, end = self.start(), self.end()
+        start, end = self._range()
         return self._a[start:min(start + n, end)]
 
+    def to_columns(self) -> Dict[str, np.ndarray]:
+        """有效数据区按字段拆成列。每列都是内存映射上的跨步视图，不复制"""
+        return to_columns(self.data())
+
+    def to_frame(self, copy: bool = False):
+        """有效数据区转DataFrame。数值列直接引用内存映射，加载大文件分析时内存不翻倍
+
+        Parameters
+        ----------
+        copy:bool
+            是否复制。只读映射的数据不复制时，DataFrame也不能修改
+
+        """
+        return to_frame(self.data(), copy=copy)
+
     def tail(self, n: int = 5) -> np.ndarray:
-        """取尾部数据"""
-        start, end = self.start(), self.end()
+        """取尾部数据。文件已被resize时自动重新映射"""
+        start, end = self._bounds()
         return self._a[max(start, end - n):end]
 
     def at(self, index) -> np.ndarray:
@@ -260,7 +753,11 @@ class NPYT:
         3. a[10:20] = b[0:1] 不报错，也没保存
             (0, 3)  (1, 3)
 
+        4. 开启`sequence`后，重复的行先被去掉，剩余行数也是去重后的
+
         """
+        if self._sequence is not None:
+            array = self._sequence.new_rows(array)
         remaining = array.shape[0]
         # 空内容，没必要
         if remaining == 0:
@@ -274,6 +771,109 @@ class NPYT:
 
         self._a[end:_end] = array
         self._t[1] = _end
+        self._appended()
+        if self._sequence is not None:
+            self._sequence.advance(array)
+
+        return 0
+
+    def _bytes(self) -> memoryview:
+        """数据区的字节视图。切片赋值就是memcpy，不创建ndarray"""
+        if self._mv is None:
+            self._mv = memoryview(self._a.reshape(-1).view(np.uint8))
+        return self._mv
+
+    def append_bytes(self, buffer) -> int:
+        """插入原始字节。字节排列必须与文件的dtype完全一致，直接复制到映射区，不构造ndarray
+
+        Parameters
+        ----------
+        buffer:
+            bytes、bytearray、ndarray等C连续的缓冲区，字节数需为行大小的整数倍
+
+        Returns
+        -------
+        int
+            剩余未插入的行数
+
+        """
+        # 按字节计算。非uint8的memoryview、ndarray的len是元素个数
+        buffer = memoryview(buffer).cast("B")
+        row_nbytes = self._a.strides[0]
+        remaining, mod = divmod(buffer.nbytes, row_nbytes)
+        assert mod == 0, f"buffer size {buffer.nbytes} is not a multiple of row size {row_nbytes}"
+        if remaining == 0:
+            return remaining
+
+        end = self.end()
+        _end = end + remaining
+        if _end > self._raw_len():
+            return remaining
+
+        self._bytes()[end * row_nbytes:_end * row_nbytes] = buffer
+        self._t[1] = _end
+        self._appended()
+
+        return 0
+
+    def append_into(self, n: int = 1) -> Optional[np.ndarray]:
+        """取出后面n行的可写视图，由调用者直接填充，再用`commit`提交。空间不够返回None
+
+        Examples
+        --------
+        >>> slot = nt.append_into(1)
+        >>> decode(message, out=slot)
+        >>> nt.commit(1)
+
+        """
+        end = self.end()
+        if end + n > self._raw_len():
+            return None
+        return self._a[end:end + n]
+
+    def commit(self, n: int = 1) -> Self:
+        """提交`append_into`填充好的n行，只修改一次尾巴"""
+        # 尾巴出错所有读进程都会读错，先检查n在剩余空间内
+        assert n > 0 and self.append_into(n) is not None, f"commit {n} rows out of space, end={self.end()}"
+        self._t[1] = self.end() + n
+        self._appended()
+        return self
+
+    def append_columns(self, columns: Dict[str, np.ndarray]) -> int:
+        """按列插入。每列直接写入映射区中对应的字段，不用先`df.to_records()`构造结构体数组
+
+        Parameters
+        ----------
+        columns:dict
+            {字段名: 数组}。字段要齐全，长度相同，dtype能安全转换。
+            pandas的object、category列不能安全转换，要先按字段的dtype转成numpy数组
+
+        Returns
+        -------
+        int
+            剩余未插入的行数。空间不够时不插入
+
+        Examples
+        --------
+        >>> nt.append_columns({"price": prices, "volume": volumes})
+        >>> dtype = nt.dtype()
+        >>> nt.append_columns({name: df[name].to_numpy(dtype[name]) for name in dtype.names})
+
+        """
+        if self._sequence is not None:
+            columns = self._sequence.new_columns(columns)
+        n = columns_length(self._a.dtype, columns)
+        if n == 0:
+            return n
+
+        slot = self.append_into(n)
+        if slot is None:
+            return n
+        for name, values in columns.items():
+            slot[name] = values
+        self.commit(n)
+        if self._sequence is not None:
+            self._sequence.advance(columns)
 
         return 0
 
@@ -295,6 +895,8 @@ class NPYT:
         append: 空间不够直接返回剩余行数
 
         """
+        if self._sequence is not None:
+            array = self._sequence.new_rows(array)
         remaining = array.shape[0]
         # 空内容，没必要
         if remaining == 0:
@@ -313,13 +915,22 @@ class NPYT:
 
         self._a[end:_end] = array
         self._t[1] = _end
+        self._appended()
+        if self._sequence is not None:
+            self._sequence.advance(array)
 
         return True
 
     def remove(self) -> bool:
-        """删除文件"""
+        """删除文件。分块校验、分块最小最大值的旁路文件一起删除，没有开启也删除"""
+        self._close_sidecars()
+        crc_path(self._filename).unlink(missing_ok=True)
+        zone_path(self._filename).unlink(missing_ok=True)
         self._a = None
         self._t = None
+        self._region = None
+        self._mv = None
+        self._locked = (0, 0)
         try:
             os.remove(self._filename)
             logger.trace("remove {}", self._filename.resolve())
@@ -335,16 +946,41 @@ class NPYT:
         return False
 
     def rename(self, name) -> bool:
-        """重命名。如果文件已经存在了会被覆盖"""
+        """重命名。如果文件已经存在了会被覆盖。分块校验、分块最小最大值的旁路文件一起改名，要重新开启"""
+        self._close_sidecars()
         self._a = None
         self._t = None
+        self._region = None
+        self._mv = None
+        self._locked = (0, 0)
         shutil.move(self._filename, name)
+        for sidecar in (crc_path, zone_path):
+            if sidecar(self._filename).exists():
+                shutil.move(sidecar(self._filename), sidecar(Path(name)))
+            else:
+                # 目标的旧旁路文件已经不对应了
+                sidecar(Path(name)).unlink(missing_ok=True)
         self._filename = Path(name)
         return True
 
+    def _close_sidecars(self) -> None:
+        if self._checksum:
+            self._checksum.close()
+            self._checksum = None
+        if self._zonemap:
+            self._zonemap.close()
+            self._zonemap = None
+
     def tell(self) -> int:
         return self._tell
 
+    def ready(self) -> bool:
+        """tell之后是否有新数据。读到结尾时与`read`一样检查是否需要重新映射"""
+        if self._mmap_mode == "r" and self._tell < self._seen[1]:
+            return True
+        start, end = self._bounds()
+        return max(self._tell, start) < end
+
     def rewind(self) -> Self:
         """重置当前指针到数据的起始位置
 
@@ -368,7 +1004,7 @@ class NPYT:
             0,1,2
 
         """
-        start, end = self.start(), self.end()
+        start, end = self._range()
         if whence == os.SEEK_SET:
             _curr = start
         elif whence == os.SEEK_CUR:
@@ -396,12 +1032,217 @@ class NPYT:
         np.ndarray
             读取的数据
 
+        Notes
+        -----
+        已读到上次看到的结尾时，检查文件是否被写进程resize了，是则自动重新映射，可以继续读到扩容后的数据。
+        截断文件也不会SIGBUS
+
         """
-        start, end = self.start(), self.end()
+        start, end = self._seen
+        if self._mmap_mode != "r" or self._tell + n > end:
+            start, end = self._bounds()
 
         _start = max(self._tell - prefetch, start)
-        self._tell = min(self._tell + n, end)
+        self._tell = min(max(self._tell, start) + n, end)
 
         arr = self._a[_start:self._tell]
 
         return arr
+
+
+class NPYT_RB(NPYT):
+    """RingBuffer版。数据区在虚拟内存中连续映射两次，环绕的数据也是一个连续视图，零拷贝
+
+    - start: 消费者指针。已消费的总行数，只增不减
+    - end: 生产者指针。已写入的总行数，只增不减
+
+    行号对容量取模就是数据区中的位置。容量会向上取整，让数据区大小为页大小的整数倍。
+    文件依然可以用`np.load`打开，只是数据区的顺序是环形的
+
+    Notes
+    -----
+    1. 只支持POSIX系统
+    2. 一写一读。消费者`pop`取到的是视图，指针移动后空间可能被生产者覆盖，需要时用`copy=True`
+
+    """
+
+    def _footer(self) -> Tuple[int, int]:
+        """消费者指针与生产者指针"""
+        return int(self._t[0]), int(self._t[1])
+
+    def full(self) -> bool:
+        return self.size() >= self._capacity
+
+    def size(self) -> int:
+        return self.end() - self.start()
+
+    def _raw_len(self) -> int:
+        """数据区长度。映射了两次，只算一次"""
+        return self._capacity
+
+    def _slice(self, start: int, end: int) -> np.ndarray:
+        """取[start, end)的行。映射了两次，不超过容量的窗口都是连续的"""
+        i = start % self._capacity
+        return self._a[i:i + end - start]
+
+    def load(self, mmap_mode: Literal["r", "r+"], reserve: int = 0) -> Self:
+        """加载文件。数据区映射两次，不支持预留模式"""
+        assert reserve == 0, "NPYT_RB does not support reserve"
+        self._unlock()
+        self._a, self._t, self._region = load_mirror(self._filename, mmap_mode)
+        self._mv = None
+        self._capacity = self._a.shape[0] // 2
+        self._mmap_mode = mmap_mode
+        self._nbytes = os.path.getsize(self._filename)
+        if self._dtype is None:
+            self._dtype = self._a.dtype
+        else:
+            assert self._dtype == self._a.dtype, f"dtype mismatch {self._dtype} != {self._a.dtype}"
+        if self._hot_rows:
+            self._slide()
+        self._seen = self._footer()
+        return self
+
+    def save(self,
+             array: Optional[np.ndarray] = None,
+             capacity: int = 0,
+             end: Optional[int] = None,
+             skip_if_exists: bool = True) -> Self:
+        """创建环形缓冲区文件。数据区开始位置对齐到页，容量向上取整到页大小的整数倍"""
+        if skip_if_exists and self._filename.exists():
+            return self
+
+        if array is None:
+            array = np.empty((1,), dtype=self._dtype)
+            end = 0
+        elif self._dtype is None:
+            self._dtype = array.dtype
+        else:
+            assert self._dtype == array.dtype, f"dtype mismatch {self._dtype} != {array.dtype}"
+        capacity = get_ring_capacity(array.dtype, array.shape, max(capacity, array.shape[0]))
+        save(get_file_ctx(self._filename, mode="wb+"), array, capacity, end, align=PAGESIZE)
+
+        return self
+
+    def resize(self, capacity: Optional[int] = None) -> bool:
+        """环形缓冲区容量固定，不能修改"""
+        return False
+
+    def persist(self, to_file: Union[str, Path], capacity: int = 0) -> None:
+        """保存快照为普通的`NPYT`文件。环绕的数据拼接起来，行号从0重新开始"""
+        array = self.data()
+        end = array.shape[0]
+        if end == 0:
+            array = None
+        NPYT(to_file, dtype=self._dtype).save(array, capacity=max(capacity, end), skip_if_exists=False)
+        logger.info("persist {} to {}", self._filename, to_file)
+
+    def trim(self, start: int) -> int:
+        """只移动start。环形缓冲区的空间会被生产者重复使用，不能释放"""
+        self._t[0] = min(max(start, self.start()), self.end())
+        return 0
+
+    def data(self) -> np.ndarray:
+        """取数据区。环绕的数据也是连续视图，可以修改"""
+        return self._slice(*self._range())
+
+    def head(self, n: int = 5) -> np.ndarray:
+        start, end = self._range()
+        return self._slice(start, min(start + n, end))
+
+    def tail(self, n: int = 5) -> np.ndarray:
+        start, end = self._range()
+        return self._slice(max(start, end - n), end)
+
+    def at(self, index) -> np.ndarray:
+        """取某一行数据
+
+        Parameters
+        ----------
+        index:int
+            行号，与start、end同一体系
+
+        """
+        return self._a[index % self._capacity]
+
+    def append(self, array: np.ndarray) -> int:
+        """生产者插入数据。剩余空间不够时不插入，返回剩余未插入的行数"""
+        if self._sequence is not None:
+            array = self._sequence.new_rows(array)
+        remaining = array.shape[0]
+        if remaining == 0:
+            return remaining
+
+        end = self.end()
+        _end = end + remaining
+        if _end - self.start() > self._capacity:
+            return remaining
+
+        self._slice(end, _end)[:] = array
+        self._t[1] = _end
+        self._appended()
+        if self._sequence is not None:
+            self._sequence.advance(array)
+
+        return 0
+
+    def append_bytes(self, buffer) -> int:
+        """插入原始字节。剩余空间不够时不插入，返回剩余未插入的行数"""
+        # 按字节计算。非uint8的memoryview、ndarray的len是元素个数
+        buffer = memoryview(buffer).cast("B")
+        row_nbytes = self._a.strides[0]
+        remaining, mod = divmod(buffer.nbytes, row_nbytes)
+        assert mod == 0, f"buffer size {buffer.nbytes} is not a multiple of row size {row_nbytes}"
+        if remaining == 0:
+            return remaining
+
+        end = self.end()
+        if end + remaining - self.start() > self._capacity:
+            return remaining
+
+        i = end % self._capacity
+        self._bytes()[i * row_nbytes:(i + remaining) * row_nbytes] = buffer
+        self._t[1] = end + remaining
+        self._appended()
+
+        return 0
+
+    def append_into(self, n: int = 1) -> Optional[np.ndarray]:
+        """取出后面n行的可写视图，跨越末尾也是连续的。剩余空间不够返回None"""
+        end = self.end()
+        if end + n - self.start() > self._capacity:
+            return None
+        return self._slice(end, end + n)
+
+    def expend(self, array: np.ndarray) -> bool:
+        """容量固定，不扩充文件。等同于append"""
+        return self.append(array) == 0
+
+    def pop(self, n: int = 1024, copy: bool = False) -> np.ndarray:
+        """消费者取数据，并移动start指针
+
+        Parameters
+        ----------
+        n:int
+            最多取的行数
+        copy:bool
+            是否复制。不复制时，返回的视图可能被生产者覆盖
+
+        """
+        start, end = self._range()
+        _start = min(start + n, end)
+        arr = self._slice(start, _start)
+        if copy:
+            arr = arr.copy()
+        self._t[0] = _start
+
+        return arr
+
+    def read(self, n: int = 1024, prefetch: int = 0) -> np.ndarray:
+        """读取n行数据。不移动start指针，而是移动tell指针。tell落后于start时从start开始读"""
+        start, end = self._range()
+
+        _start = max(self._tell - prefetch, start)
+        self._tell = min(max(self._tell, start) + n, end)
+
+        return self._slice(_start, self._tell)
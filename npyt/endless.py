@@ -1,7 +1,7 @@
 import shutil
 import time
 from pathlib import Path
-from typing import List, Optional, Union
+from typing import Dict, Iterable, List, Optional, Tuple, Union
 
 import more_itertools
 import numpy as np
@@ -9,6 +9,10 @@ from loguru import logger
 from typing_extensions import Self
 
 from npyt import NPYT
+from npyt.checksum import crc_path
+from npyt.format import check, from_columns
+from npyt.sequence import Sequence
+from npyt.zonemap import Condition, zone_path
 
 
 class NPY8:
@@ -34,17 +38,45 @@ class NPY8:
         self._path: Path = Path(self._name)
         self._path.mkdir(parents=True, exist_ok=True)
         self._path_lock = self._path / '.lock'
+        # 创建过的所有文件名时间戳，只追加。用来修复lock，不用遍历目录
+        self._path_manifest = self._path / '.manifest'
         # lock文件，维护了多个时间戳文件名
         self._lock: Optional[np.ndarray] = None
         self._writer: Optional[NPYT] = None
         self._reader: Optional[NPYT] = None
         # 正在读的文件名时间戳
         self._reader_ts: int = -1
+        # 写文件的madvise参数，0表示不调用
+        self._advice: int = 0
+        # 消费者游标。文件名时间戳与行位置，持久化在`.cursor_组名`中
+        self._cursor: Optional[np.ndarray] = None
+        self._commit_interval: float = 0
+        self._commit_at: float = 0
+        # 就绪通知板。所有文件共用目录名对应的槽位
+        self._board = None
+        # 写文件的分块最小最大值参数，None表示不统计
+        self._zonemap: Optional[tuple] = None
+        # 写文件锁定在内存中的尾部行数
+        self._hot_rows: int = 0
+        # 按序号去重。None表示不去重
+        self._sequence: Optional[Sequence] = None
+        # load时发现lock不一致，第一次写入时修复
+        self._repair_pending: bool = False
+        # 最新值快照表。None表示不更新
+        self._snapshot = None
 
     def capacity(self) -> int:
         """总容量。只是队列中的文件容量之和。与NPYT的接口保持相同"""
         return self._capacity_per_file * self._size
 
+    def path(self) -> Path:
+        """目录"""
+        return self._path
+
+    def files(self) -> List[Path]:
+        """队列中的文件，从旧到新。最新的文件可能还没创建"""
+        return [self._path / f'{t}.npy' for t in self._lock.tolist() if t > 0]
+
     def remove(self):
         """删除文件"""
         self._lock = None
@@ -56,7 +88,10 @@ class NPY8:
         logger.info("remove {} ", self._path.resolve())
 
     def load(self) -> Self:
-        """初始化并加载"""
+        """初始化并加载
+
+        lock与文件不一致时只记录警告，第一次写入时才用`repair`修复。读进程不会修改写进程正在用的lock
+        """
         self._lock = None
         self._writer = None
         self._reader = None
@@ -67,17 +102,176 @@ class NPY8:
         else:
             self._lock = np.memmap(self._path_lock, dtype=np.uint64, mode="w+", shape=(self._size,))
 
-        # 没有数据，初始化
-        t = self._lock[0]
-        filename = self._path / f'{t}.npy'
-        if not filename.exists():
-            files = sorted(self._path.glob('*.npy'))[-self._size:]
-            self._lock[:] = 0
-            for i, f in enumerate(files):
-                self._lock[i] = int(f.stem)
+        # lock与文件不一致时，等到第一次写入再修复。读进程不修改lock
+        problems = self.check()
+        self._repair_pending = bool(problems)
+        if problems:
+            logger.warning("{} is inconsistent: {}", self._path_lock.resolve(), problems)
+
+        if self._cursor is not None:
+            self._restore()
+
+        return self
+
+    def check(self) -> List[str]:
+        """检查lock是否与文件一致。只检查队列中的文件头尾，文件数量多时也很快
+
+        1. 队列中非0的时间戳在前，且递增
+        2. 除了最新的文件(可能刚写入lock还没创建或还没写完)，都存在且头尾一致
+        3. manifest存在，没有写了一半的记录，且其中最新的文件不比lock中的新
+
+        Returns
+        -------
+        List[str]
+            问题描述。空列表表示正常
+
+        """
+        problems = []
+        lock = self._lock.tolist()
+        ts = [t for t in lock if t > 0]
+        if lock[:len(ts)] != ts:
+            problems.append(f"zero in the middle of lock {lock}")
+        if ts != sorted(set(ts)):
+            problems.append(f"lock is not increasing {lock}")
+
+        for i, t in enumerate(ts):
+            filename = self._path / f'{t}.npy'
+            if not filename.exists():
+                if i < len(ts) - 1:
+                    problems.append(f"{filename.name} is missing")
+                continue
+            problem = check(filename)
+            if problem and i < len(ts) - 1:
+                problems.append(f"{filename.name} {problem}")
+
+        if ts and not self._path_manifest.exists():
+            problems.append("manifest is missing")
+        if self._path_manifest.exists() and self._path_manifest.stat().st_size % 8:
+            problems.append("manifest has a partial record")
+        latest = self._manifest_latest()
+        if latest > max(ts, default=0):
+            problems.append(f"{latest}.npy is newer than lock")
+
+        return problems
+
+    def repair(self) -> Self:
+        """用manifest重建lock。取最新的几个存在的文件，没有manifest时遍历目录并生成manifest"""
+        if self._path_manifest.exists() and self._path_manifest.stat().st_size % 8:
+            # 写了一半的记录丢弃，防止之后追加的记录错位
+            with open(self._path_manifest, "r+b") as fp:
+                fp.truncate(self._path_manifest.stat().st_size // 8 * 8)
+        if not self._path_manifest.exists():
+            files = sorted(int(f.stem) for f in self._path.glob('*.npy'))
+            np.array(files, dtype=np.uint64).tofile(self._path_manifest)
+            logger.info("create {} from {} files", self._path_manifest.resolve(), len(files))
+
+        files = []
+        manifest = self._manifest()
+        # 从尾部往前找，只需看最后几个
+        for t in manifest[::-1].tolist():
+            filename = self._path / f'{t}.npy'
+            if t in files or not filename.exists() or check(filename):
+                continue
+            files.insert(0, t)
+            if len(files) >= self._size:
+                break
+
+        self._lock[:] = 0
+        self._lock[:len(files)] = sorted(files)
+        self._lock.flush()
+        self._repair_pending = False
+        logger.info("repair {} to {}", self._path_lock.resolve(), self._lock.tolist())
+        return self
+
+    def _manifest(self) -> np.ndarray:
+        """manifest中的所有时间戳。没有时返回空"""
+        if not self._path_manifest.exists() or self._path_manifest.stat().st_size < 8:
+            return np.empty(0, dtype=np.uint64)
+        return np.memmap(self._path_manifest, dtype=np.uint64, mode="r",
+                         shape=(self._path_manifest.stat().st_size // 8,))
+
+    def _manifest_latest(self) -> int:
+        """manifest中最新的且存在的文件时间戳。没有时返回0"""
+        for t in self._manifest()[::-1].tolist():
+            if (self._path / f'{t}.npy').exists():
+                return t
+        return 0
+
+    def subscribe(self, group: str, commit_interval: float = 0) -> Self:
+        """绑定命名的消费者游标，从上次提交的位置继续读
+
+        游标保存在`.lock`旁边的`.cursor_组名`文件中，多个消费者组可以各自读同一个目录
+
+        Parameters
+        ----------
+        group:str
+            消费者组名
+        commit_interval:float
+            自动提交间隔秒数。0表示只能手动`commit`。
+            自动提交在`read`开始时进行，提交的是上一次`read`后的位置，即再次调用`read`表示上次的数据已处理完
+
+        """
+        path_cursor = self._path / f'.cursor_{group}'
+        mode = "r+" if path_cursor.exists() else "w+"
+        self._cursor = np.memmap(path_cursor, dtype=np.uint64, mode=mode, shape=(2,))
+        self._commit_interval = commit_interval
+        self._commit_at = time.monotonic() + commit_interval
+        self._restore()
+        return self
+
+    def _restore(self) -> None:
+        """从游标恢复读指针"""
+        self._reader = None
+        self._reader_ts = -1
+        t, tell = int(self._cursor[0]), int(self._cursor[1])
+        if t == 0:
+            return
 
+        # 文件不存在也没关系，read时会切换到下一个文件
+        self._reader_ts = t
+        filename = self._path / f'{t}.npy'
+        if filename.exists():
+            self._reader = NPYT(filename).load(mmap_mode="r").seek(tell, 0)
+        logger.trace("restore {} at {}", filename.resolve(), tell)
+
+    def commit(self) -> Self:
+        """提交当前读位置到游标文件"""
+        if self._cursor is None:
+            return self
+        t = max(int(self._reader_ts), 0)
+        tell = self._reader.tell() if self._reader else 0
+        self._cursor[:] = (t, tell)
+        self._cursor.flush()
+        self._commit_at = time.monotonic() + self._commit_interval
         return self
 
+    def sequence(self, field: Optional[str]) -> Sequence:
+        """开启按序号去重。参数同`NPYT.sequence`，已写入的最大序号取自最新文件的最后一行"""
+        tail = self.tail(1)
+        self._sequence = Sequence(field).load(tail[-1] if tail else np.empty(0, dtype=self._dtype))
+        return self._sequence
+
+    def append_columns(self, columns: Dict[str, np.ndarray]) -> int:
+        """按列插入。参数同`NPYT.append_columns`
+
+        Notes
+        -----
+        写文件放得下时直接写入映射区。要新建文件的那一批才构造结构体数组。
+        刚`load`时还没打开写文件，先打开已有的最新文件，不会因此新建文件
+
+        """
+        if self._sequence is not None:
+            columns = self._sequence.new_columns(columns)
+        if self._writer is None:
+            self.end()
+        if self._writer and self._writer.append_columns(columns) == 0:
+            if self._sequence is not None:
+                self._sequence.advance(columns)
+            return 0
+        dtype = self._writer.dtype() if self._writer else self._dtype
+        assert dtype is not None, "dtype is required to append columns"
+        return self.append(from_columns(columns, dtype))
+
     def append(self, data: np.ndarray) -> int:
         """添加数据，遇到文件空间不足时会新增文件
 
@@ -91,7 +285,24 @@ class NPY8:
         int
             成功返回0，失败返回剩余行数。由于会一直新增文件，理论上一直返回0
 
+        Notes
+        -----
+        开启`sequence`后，重复的行先被去掉
+
         """
+        if self._sequence is None:
+            return self._append(data)
+        data = self._sequence.new_rows(data)
+        if len(data) == 0:
+            return 0
+        remaining = self._append(data)
+        if remaining == 0:
+            self._sequence.advance(data)
+        return remaining
+
+    def _append(self, data: np.ndarray) -> int:
+        if self._repair_pending:
+            self.repair()
         if self._writer:
             remaining = self._writer.append(data)
             if remaining == 0:
@@ -121,16 +332,229 @@ class NPY8:
         # 找到最大编号文件。但不知道文件是否满了
         t = self._lock[np.argmax(self._lock)]
         filename = self._path / f'{t}.npy'
-        if filename.exists():
+        exists = filename.exists()
+        if exists and check(filename) is None:
             # 加载已有文件
-            self._writer = NPYT(filename, dtype=self._dtype).load(mmap_mode="r+")
-            return self.append(data)
+            self._set_writer(NPYT(filename, dtype=self._dtype).load(mmap_mode="r+"))
+            return self._append(data)
         else:
-            logger.trace("create {}", filename.resolve())
+            if exists:
+                # 上一个写进程创建到一半就退出了，或尾巴写坏了。文件中可能已有数据，移到一边再重新创建
+                broken = Path(f'{filename}.broken')
+                logger.warning("{} is not finished, move to {} and recreate", filename.resolve(), broken.name)
+                filename.replace(broken)
+            else:
+                logger.trace("create {}", filename.resolve())
+                # 先记录到manifest，再创建文件
+                with open(self._path_manifest, "ab") as fp:
+                    fp.write(np.array([t], dtype=np.uint64).tobytes())
             # 可以一次性保存大文件
-            self._writer = NPYT(filename, dtype=self._dtype).save(array=data, capacity=self._capacity_per_file).load(mmap_mode="r+")
+            self._set_writer(NPYT(filename, dtype=self._dtype).save(array=data, capacity=self._capacity_per_file,
+                                                                   skip_if_exists=False).load(mmap_mode="r+"))
+            if self._snapshot is not None:
+                self._snapshot.update(data)
+            if self._board is not None:
+                self._board.notify(self._board.slot(self._path))
             return 0
 
+    def _set_writer(self, writer: NPYT) -> None:
+        self._writer = writer
+        if self._advice:
+            self._writer.madvise(self._advice)
+        if self._board is not None:
+            self._writer.notify_to(self._board, self._path)
+        if self._zonemap is not None:
+            self._writer.zonemap(*self._zonemap)
+        if self._hot_rows:
+            self._writer.mlock_tail(self._hot_rows)
+        if self._snapshot is not None:
+            self._writer.snapshot_to(self._snapshot)
+
+    def mlock_tail(self, rows: int) -> Self:
+        """写文件最后rows行所在的页锁定在内存中，新建的文件也会锁定。参数同`NPYT.mlock_tail`
+
+        Notes
+        -----
+        只锁定当前写文件。刚切换文件时，锁定的行数少于rows
+
+        """
+        self._hot_rows = rows
+        if self._writer:
+            self._writer.mlock_tail(rows)
+        return self
+
+    def residency(self) -> Tuple[int, int]:
+        """队列中所有文件的有效数据有多少在页缓存中
+
+        Returns
+        -------
+        int
+            在内存中的字节数
+        int
+            总字节数。按整页计算
+
+        """
+        resident, total = 0, 0
+        for filename in self.files():
+            if filename.exists():
+                r, t = NPYT(filename).load(mmap_mode="r").residency()
+                resident += r
+                total += t
+        return resident, total
+
+    def zonemap(self, fields: Optional[List[Optional[str]]] = None, block_size: int = 4096) -> Self:
+        """写文件开启分块最小最大值统计，新建的文件也会开启。参数同`NPYT.zonemap`"""
+        self._zonemap = (fields, block_size)
+        if self._writer:
+            self._writer.zonemap(fields, block_size)
+        return self
+
+    def filter(self, conditions: List[Condition]) -> List[np.ndarray]:
+        """按条件过滤队列中的所有文件。没有可能满足条件的块时，整个文件都不会被读取
+
+        Parameters
+        ----------
+        conditions:list
+            条件，同`NPYT.filter`
+
+        Returns
+        -------
+        List[np.ndarray]
+            一个有结果的文件对应一个np.ndarray
+
+        """
+        outputs = []
+        for filename in self.files():
+            if filename.exists():
+                arr = NPYT(filename).load(mmap_mode="r").filter(conditions)
+                if len(arr) > 0:
+                    outputs.append(arr)
+        return outputs
+
+    def notify_to(self, board) -> Self:
+        """写进程append后在通知板上通知，新建的文件也会通知。槽位名为目录名
+
+        Parameters
+        ----------
+        board:Board
+            通知板，要先load
+
+        """
+        self._board = board
+        if self._writer:
+            self._writer.notify_to(board, self._path)
+        return self
+
+    def snapshot_to(self, snapshot) -> Self:
+        """写进程append后把每个键的最后一行更新到最新值快照表。参数同`NPYT.snapshot_to`"""
+        self._snapshot = snapshot
+        if self._writer:
+            self._writer.snapshot_to(snapshot)
+        return self
+
+    def ready(self) -> bool:
+        """读指针之后是否有新数据，包括还没切换过去的新文件"""
+        if self._reader and self._reader.ready():
+            return True
+        return bool(np.any(self._lock > max(int(self._reader_ts), 0)))
+
+    def madvise(self, advice: int) -> Self:
+        """写文件调用madvise，新建的文件也会调用
+
+        Parameters
+        ----------
+        advice:int
+            如`mmap.MADV_HUGEPAGE`，共享内存中的文件可以用透明大页
+
+        """
+        self._advice = advice
+        if self._writer:
+            self._writer.madvise(advice)
+        return self
+
+    def backup(self, to_path: Union[str, Path], incremental: bool = False) -> int:
+        """备份整个目录
+
+        Parameters
+        ----------
+        to_path:str
+            备份目录
+        incremental:bool
+            增量备份。`.npy`文件只复制新增的行，合并过的`.npy_`文件只复制新出现的或有变化的。
+            旁路文件与数据文件一起复制
+
+        Returns
+        -------
+        int
+            复制的`.npy`文件行数
+
+        """
+        path = Path(to_path)
+        path.mkdir(parents=True, exist_ok=True)
+
+        rows = 0
+        for f in sorted(self._path.glob('*.npy')):
+            rows += NPYT(f, dtype=self._dtype).load(mmap_mode="r").backup(path, incremental)
+        for f in sorted(self._path.glob('*.npy_')):
+            stat, target = f.stat(), path / f.name
+            if incremental and target.exists() and target.stat().st_size == stat.st_size \
+                    and target.stat().st_mtime == stat.st_mtime:
+                continue
+            shutil.copy2(f, path)
+            # 合并时旁路文件跟着改了名
+            for sidecar in (crc_path(f), zone_path(f)):
+                if sidecar.exists():
+                    shutil.copy2(sidecar, path)
+        # lock等小文件最后复制，保证其中的文件都已经存在
+        for f in sorted(self._path.glob('.*')):
+            shutil.copy2(f, path)
+        logger.info("backup {} to {}", self._path, path)
+        return rows
+
+    def persist(self, to_path: Union[str, Path]) -> None:
+        """保存快照到另一个目录。常用于共享内存中的数据，收盘后保存到磁盘
+
+        `.npy`文件截断到有效长度，合并过的`.npy_`文件直接复制。`.lock`、`.manifest`、消费者游标等最后复制
+
+        Parameters
+        ----------
+        to_path:str
+            快照目录
+
+        """
+        path = Path(to_path)
+        path.mkdir(parents=True, exist_ok=True)
+
+        for f in sorted(self._path.glob('*.npy')):
+            NPYT(f, dtype=self._dtype).load(mmap_mode="r").persist(path / f.name)
+        for f in sorted(self._path.glob('*.npy_')):
+            shutil.copy2(f, path)
+        # lock等小文件最后复制，保证其中的文件都已经存在
+        for f in sorted(self._path.glob('.*')):
+            shutil.copy2(f, path)
+        logger.info("persist {} to {}", self._path, path)
+
+    def save_stream(self, chunks: Iterable[np.ndarray]) -> Self:
+        """流式写入。数据块按子文件的剩余空间切分，子文件都写满，内存占用只与块大小有关
+
+        Parameters
+        ----------
+        chunks:
+            数据块迭代器，如分块读取的CSV、数据库查询结果
+
+        """
+        # 打开已有的最新文件
+        self.end()
+        for chunk in chunks:
+            while chunk.shape[0] > 0:
+                n = self._capacity_per_file
+                if self._writer:
+                    n = self._writer.capacity() - self._writer.end() or n
+                self.append(chunk[:n])
+                chunk = chunk[n:]
+
+        return self
+
     def read(self, n: int = 1024, prefetch: int = 0) -> np.ndarray:
         """读取数据
 
@@ -146,6 +570,9 @@ class NPY8:
         一次性取数限制在单个文件，当前文件读完后，再次读取自动切换成下一文件
 
         """
+        if self._commit_interval > 0 and time.monotonic() >= self._commit_at:
+            self.commit()
+
         if self._reader:
             arr = self._reader.read(n, prefetch)
             if len(arr) > 0:
@@ -166,14 +593,22 @@ class NPY8:
         # 找到大于指针位置的文件。0也没关系，反正文件不存在
         t = self._lock[max_idx]
         filename = self._path / f'{t}.npy'
-        self._reader_ts = t
-        if filename.exists():
+        try:
+            problem = check(filename)
             # 加载已有文件
-            self._reader = NPYT(filename).load(mmap_mode="r")
-            return self.read(n, prefetch)
-        else:
-            # 文件没了，返回空
+            reader = None if problem else NPYT(filename).load(mmap_mode="r")
+        except (OSError, ValueError, AssertionError) as e:
+            problem = str(e)
+        if problem:
+            # 最新的文件可能是写进程正在创建，下次再试。旧文件没了就跳过
+            if t != np.max(self._lock):
+                self._reader_ts = t
+                self._reader = None
+            logger.trace("skip {}:{}", filename.resolve(), problem)
             return np.empty(0, dtype=self._dtype)
+        self._reader_ts = t
+        self._reader = reader
+        return self.read(n, prefetch)
 
     def tail(self, n: int = 5) -> List[np.ndarray]:
         """取尾部数据
@@ -246,7 +681,7 @@ class NPY8:
             t = self._lock[i]
             filename = self._path / f'{t}.npy'
             if filename.exists():
-                self._writer = NPYT(filename, dtype=self._dtype).load(mmap_mode="r+")
+                self._set_writer(NPYT(filename, dtype=self._dtype).load(mmap_mode="r+"))
                 return self._writer.end()
 
         return 0
@@ -1,13 +1,21 @@
 import contextlib
+import io
+import itertools
+import math
 import os
+import struct
 from pathlib import Path
-from typing import Optional, Literal, Tuple
+from typing import Dict, Iterable, Optional, Literal, Tuple
 
 import numpy as np
 from loguru import logger
 from numpy.lib.format import GROWTH_AXIS_MAX_DIGITS  # noqa
+from numpy.lib.format import _read_array_header  # noqa
 from numpy.lib.format import _write_array_header  # noqa
 from numpy.lib.format import dtype_to_descr
+from numpy.lib.format import read_magic
+
+from npyt._libc import PAGESIZE, map_file, map_mirror
 
 """
 添加的小尾巴，欢迎提供更好的格式方案
@@ -20,6 +28,7 @@ from numpy.lib.format import dtype_to_descr
 _TAIL_SIZE_: int = 4
 _TAIL_ITEMSIZE_: int = np.dtype(np.uint64).itemsize * _TAIL_SIZE_
 _MAGIC_NUMBER_: int = 20250510_080000  # 2025年05月10日 东八区
+_MAGIC_MOVED_: int = 0  # resize后旧尾巴的魔术数，通知读进程重新映射
 
 # 记录原始函数
 _origin_descr_to_dtype = np.lib.format.descr_to_dtype
@@ -53,6 +62,62 @@ def dtype_to_column_dtypes(dtype):
     return {x: y for x, y in dtype.descr if x != ''}
 
 
+def as_bytes(array: np.ndarray) -> np.ndarray:
+    """按字节查看连续的数组"""
+    return array.reshape(-1).view(np.uint8)
+
+
+def to_columns(array: np.ndarray) -> Dict[str, np.ndarray]:
+    """结构体数组按字段拆成列。每列都是原数组上的跨步视图，不复制"""
+    return {name: np.asarray(array[name]) for name in array.dtype.names}
+
+
+def to_frame(array: np.ndarray, copy: bool = False):
+    """结构体数组转DataFrame
+
+    copy=False时数值列直接引用原数组，不复制。字符串等列pandas会转换，还是会复制
+
+    Parameters
+    ----------
+    array:np.ndarray
+        结构体数组
+    copy:bool
+        是否复制
+
+    """
+    import pandas as pd  # pandas可选
+
+    return pd.DataFrame(to_columns(array), copy=copy)
+
+
+def columns_length(dtype: np.dtype, columns: Dict[str, np.ndarray]) -> int:
+    """检查列与结构体dtype是否匹配，返回行数
+
+    每个字段都要有，长度都要相同，dtype要能安全转换
+    """
+    assert dtype.names is not None, f"dtype {dtype} is not structured"
+    missing = set(dtype.names) - set(columns)
+    assert not missing, f"missing columns {sorted(missing)}"
+    extra = set(columns) - set(dtype.names)
+    assert not extra, f"unknown columns {sorted(extra)}"
+
+    n = None
+    for name, values in columns.items():
+        _dtype = np.asarray(values).dtype
+        assert np.can_cast(_dtype, dtype[name], casting="safe"), f"column {name} dtype mismatch {_dtype} -> {dtype[name]}"
+        n = len(values) if n is None else n
+        assert len(values) == n, f"column {name} length mismatch {len(values)} != {n}"
+    return n or 0
+
+
+def from_columns(columns: Dict[str, np.ndarray], dtype: np.dtype) -> np.ndarray:
+    """按列构造结构体数组。会复制"""
+    array = np.empty(columns_length(dtype, columns), dtype=dtype)
+    for name, values in columns.items():
+        array[name] = values
+    return array
+
+
 class TuplePad(tuple):
 
     def __repr__(self):
@@ -110,8 +175,25 @@ def get_file_ctx(file, mode: str = "wb"):
     return file_ctx
 
 
-def write_header(fp, array: np.ndarray, shape: tuple) -> int:
-    """写入头"""
+def align_header(header: bytes, align: int) -> bytes:
+    """头信息末尾补空格，让数据区开始位置对齐到align的整数倍"""
+    padlen = -len(header) % align
+    if padlen == 0:
+        return header
+    fmt = '<H' if header[6] == 1 else '<I'
+    size = struct.calcsize(fmt)
+    hlen = struct.unpack(fmt, header[8:8 + size])[0] + padlen
+    return header[:8] + struct.pack(fmt, hlen) + header[8 + size:-1] + b' ' * padlen + b'\n'
+
+
+def write_header(fp, array: np.ndarray, shape: tuple, align: int = 0) -> int:
+    """写入头
+
+    Parameters
+    ----------
+    align:int
+        数据区开始位置对齐。0表示使用numpy默认的64字节对齐
+    """
 
     def header_data_from_array_1_0(array):
         d = {'shape': shape}
@@ -126,7 +208,13 @@ def write_header(fp, array: np.ndarray, shape: tuple) -> int:
         d['descr'] = dtype_to_descr(array.dtype)
         return d
 
-    _write_array_header(fp, header_data_from_array_1_0(array))
+    if align <= 0:
+        _write_array_header(fp, header_data_from_array_1_0(array))
+        return fp.tell()
+
+    buf = io.BytesIO()
+    _write_array_header(buf, header_data_from_array_1_0(array))
+    fp.write(align_header(buf.getvalue(), align))
     return fp.tell()
 
 
@@ -138,9 +226,30 @@ def write_footer(fp, dtype: np.dtype, shape: tuple, start: int, end: int, offset
     fp.write(np.array([int(start), int(end), offset, _MAGIC_NUMBER_], dtype=np.uint64).tobytes())
 
 
+def mark_moved(fp, size: int) -> None:
+    """旧尾巴的魔术数改成`_MAGIC_MOVED_`，还映射着旧尾巴的读进程可以发现文件已经resize
+
+    非`NPYT`格式文件不处理，防止改坏数据
+    """
+    if size < _TAIL_ITEMSIZE_:
+        return
+    fp.seek(size - 8, 0)
+    if np.frombuffer(fp.read(8), dtype=np.uint64)[0] == _MAGIC_NUMBER_:
+        fp.seek(size - 8, 0)
+        fp.write(np.array([_MAGIC_MOVED_], dtype=np.uint64).tobytes())
+
+
 def load(filename, mmap_mode: Literal["r", "r+", "w+"]) -> Tuple[np.ndarray, np.ndarray]:
     """加载带尾巴的NPY格式文件"""
     # dtype缺align，提前修改了函数np.lib.format.descr_to_dtype
+    tail = load_tail(filename, mmap_mode)
+    arr = np.load(filename, mmap_mode=mmap_mode)
+
+    return arr, tail
+
+
+def load_tail(filename, mmap_mode: Literal["r", "r+", "w+"]) -> Optional[np.ndarray]:
+    """加载尾巴。非`NPYT`格式文件返回None"""
     offset = os.path.getsize(filename)
     assert offset > _TAIL_ITEMSIZE_, f"文件大小不合法，非有效`NPYT`格式文件"
     tail = np.memmap(filename, shape=(_TAIL_SIZE_,), dtype=np.uint64, mode=mmap_mode,
@@ -149,19 +258,209 @@ def load(filename, mmap_mode: Literal["r", "r+", "w+"]) -> Tuple[np.ndarray, np.
         logger.warning(f"文件格式错误，不是`NPYT`格式文件，涉及到尾部信息的函数都不正确，谨慎使用")
         # 设置成None防止array被修改
         tail = None
-    arr = np.load(filename, mmap_mode=mmap_mode)
+    return tail
 
-    return arr, tail
 
+def check(filename) -> Optional[str]:
+    """检查文件头尾是否一致。只读头和尾巴，不映射文件
+
+    Returns
+    -------
+    str
+        问题描述。正常返回None
+
+    """
+    try:
+        dtype, shape, offset = read_header(filename)
+    except (OSError, ValueError) as e:
+        return f"bad header: {e}"
+    size = os.path.getsize(filename)
+    nbytes = get_nbytes(dtype, shape, offset)
+    if size != nbytes + _TAIL_ITEMSIZE_:
+        return f"file size {size} != {nbytes + _TAIL_ITEMSIZE_}"
+    start, end, _offset, magic = np.fromfile(filename, dtype=np.uint64, count=_TAIL_SIZE_, offset=nbytes).tolist()
+    if magic != _MAGIC_NUMBER_:
+        return f"bad magic {magic}"
+    if _offset != offset:
+        return f"footer offset {_offset} != {offset}"
+    if not start <= end <= shape[0]:
+        return f"bad range start={start} end={end} capacity={shape[0]}"
+    return None
+
+
+def copy_range(src: int, dst: int, offset: int, length: int) -> None:
+    """复制文件中的一段到另一文件的相同位置
+
+    优先用`copy_file_range`在内核中复制，文件系统支持时还能共享数据块。不支持时用pread/pwrite
+    """
+    end = offset + length
+    while offset < end:
+        n = 0
+        if hasattr(os, "copy_file_range"):
+            try:
+                n = os.copy_file_range(src, dst, end - offset, offset, offset)
+            except OSError:
+                n = 0
+        if n == 0:
+            n = os.pwrite(dst, os.pread(src, min(end - offset, 1 << 20), offset), offset)
+        if n == 0:
+            raise EOFError(f"copy_range stopped at {offset}")
+        offset += n
+
+
+def backup(src: Path, dst: Path, start: int, end: int) -> int:
+    """增量备份。只复制目标文件尾巴中end之后新增的行，未使用的容量在目标文件中保持稀疏
+
+    Parameters
+    ----------
+    src:Path
+        源文件
+    dst:Path
+        目标文件
+    start:int
+        源文件的开始位置
+    end:int
+        源文件的结束位置。只备份到这里，之后新写入的下次再备份
+
+    Returns
+    -------
+    int
+        复制的行数
+
+    Notes
+    -----
+    只适合追加写入的场景，已备份的行被修改了不会再复制
+
+    """
+    dtype, shape, offset = read_header(src)
+    nbytes = get_nbytes(dtype, shape, offset)
+    row_nbytes = get_nbytes(dtype, (1,) + tuple(shape[1:]), 0)
+
+    # 目标文件有效，且格式一样，从上次备份的位置继续
+    copied = None
+    if dst.exists() and check(dst) is None:
+        _dtype, _shape, _offset = read_header(dst)
+        _end = int(np.fromfile(dst, dtype=np.uint64, count=_TAIL_SIZE_,
+                               offset=get_nbytes(_dtype, _shape, _offset))[1])
+        if _dtype == dtype and _shape[1:] == shape[1:] and _offset == offset and _end <= end:
+            copied = max(_end, start)
+
+    with open(src, "rb") as fs, open(dst, "r+b" if copied is not None else "wb") as fd:
+        if copied is None:
+            copied = start
+        # 头信息中的shape可能变了，每次都复制
+        copy_range(fs.fileno(), fd.fileno(), 0, offset)
+        # 只改文件大小，新增的部分是稀疏的
+        fd.truncate(nbytes)
+        copy_range(fs.fileno(), fd.fileno(), offset + copied * row_nbytes, (end - copied) * row_nbytes)
+        fd.seek(nbytes, 0)
+        fd.write(np.array([start, end, offset, _MAGIC_NUMBER_], dtype=np.uint64).tobytes())
+        fd.truncate(nbytes + _TAIL_ITEMSIZE_)
+
+    return end - copied
+
+
+def get_ring_capacity(dtype: np.dtype, shape: tuple, capacity: int) -> int:
+    """环形缓冲区的容量向上取整，让数据区大小为页大小的整数倍"""
+    row_nbytes = get_nbytes(dtype, (1,) + tuple(shape[1:]), 0)
+    unit = PAGESIZE // math.gcd(row_nbytes, PAGESIZE)
+    return max(-(-int(capacity) // unit), 1) * unit
+
+
+def load_mirror(filename, mmap_mode: Literal["r", "r+"]) -> Tuple[np.ndarray, Optional[np.ndarray], object]:
+    """数据区连续映射两次，加载环形缓冲区文件
+
+    返回的数组长度为容量的两倍，后一半与前一半是同一块物理内存，
+    所以任何不超过容量的窗口都是一个连续的视图
+
+    Returns
+    -------
+    arr, tail, region
+
+    """
+    dtype, shape, offset = read_header(filename)
+    nbytes = get_nbytes(dtype, shape, 0)
+    if offset % PAGESIZE != 0 or nbytes % PAGESIZE != 0:
+        raise ValueError(f"{filename} is not a ring buffer file, data is not aligned to {PAGESIZE}")
 
-def save(file_ctx, array: np.ndarray, capacity: int, end: Optional[int] = None) -> None:
+    writable = mmap_mode != "r"
+    region = map_mirror(filename, offset, nbytes, writable)
+    arr = np.ndarray((shape[0] * 2,) + tuple(shape[1:]), dtype=dtype, buffer=region)
+    arr.flags.writeable = writable
+
+    return arr, load_tail(filename, mmap_mode), region
+
+
+def read_header(filename) -> Tuple[np.dtype, tuple, int]:
+    """读取头信息
+
+    Returns
+    -------
+    dtype, shape, offset
+
+    """
+    with open(filename, "rb") as fp:
+        version = read_magic(fp)
+        shape, fortran_order, dtype = _read_array_header(fp, version)
+        return dtype, shape, fp.tell()
+
+
+def load_reserved(filename, mmap_mode: Literal["r", "r+"], reserve: int,
+                  region=None) -> Tuple[np.ndarray, Optional[np.ndarray], object]:
+    """在预留的虚拟地址空间上加载带尾巴的NPY格式文件
+
+    容量在预留范围内变化时复用region，基地址不变，之前取得的视图一直有效
+
+    Parameters
+    ----------
+    filename:str
+        文件名
+    mmap_mode:str
+        内存文件映射模式
+    reserve:int
+        预留的行数
+    region:
+        上次映射的区域。None或不够大时重新映射
+
+    Returns
+    -------
+    arr, tail, region
+
+    """
+    dtype, shape, offset = read_header(filename)
+    nbytes = get_nbytes(dtype, shape, offset)
+    file_size = os.path.getsize(filename)
+    writable = mmap_mode != "r"
+
+    if region is None or len(region) < nbytes + _TAIL_ITEMSIZE_ or region.writable != writable:
+        if region is not None:
+            logger.warning("{} exceeds reserved space, remap. old views will not be updated", filename)
+        length = get_nbytes(dtype, get_shape(shape, reserve), offset) + _TAIL_ITEMSIZE_
+        region = map_file(filename, max(length, file_size), writable)
+
+    arr = np.ndarray(shape, dtype=dtype, buffer=region, offset=offset)
+    arr.flags.writeable = writable
+    tail = None
+    # 尾巴超出文件大小，访问会SIGBUS，所以先判断
+    if file_size >= nbytes + _TAIL_ITEMSIZE_:
+        tail = np.ndarray((_TAIL_SIZE_,), dtype=np.uint64, buffer=region, offset=nbytes)
+        tail.flags.writeable = writable
+        if tail[3] != _MAGIC_NUMBER_:
+            tail = None
+    if tail is None:
+        logger.warning(f"文件格式错误，不是`NPYT`格式文件，涉及到尾部信息的函数都不正确，谨慎使用")
+
+    return arr, tail, region
+
+
+def save(file_ctx, array: np.ndarray, capacity: int, end: Optional[int] = None, align: int = 0) -> None:
     """保存"""
     shape = get_shape(array.shape, capacity)
     end = get_end(array.shape[0], end)
 
     with file_ctx as fp:
         # 写入头信息
-        offset = write_header(fp, array, shape)
+        offset = write_header(fp, array, shape, align)
         if end > 0:
             # 写入数据
             array.tofile(fp)
@@ -170,6 +469,50 @@ def save(file_ctx, array: np.ndarray, capacity: int, end: Optional[int] = None)
         fp.flush()
 
 
+def save_stream(file_ctx, chunks: Iterable[np.ndarray], dtype: np.dtype, capacity: int = 0) -> int:
+    """流式保存。一块一块顺序写入，内存占用只与块大小有关
+
+    shape字符串长度固定，写完后回到文件头修改shape，不用移动数据
+
+    Parameters
+    ----------
+    chunks:
+        数据块迭代器。每块的dtype需与dtype一致，除第一维外的shape与第一块一致
+    dtype:np.dtype
+        数据类型
+    capacity:int
+        预估容量。不足时以实际行数为准
+
+    Returns
+    -------
+    int
+        写入的总行数
+
+    """
+    dtype = np.dtype(dtype)
+    chunks = iter(chunks)
+    # 行的shape取自第一块，如(n, 2)的块每行为(2,)
+    first = next(chunks, None)
+    row = np.empty((1,) if first is None else (1,) + first.shape[1:], dtype=dtype)
+    end = 0
+
+    with file_ctx as fp:
+        offset = write_header(fp, row, get_shape(row.shape, capacity))
+        for chunk in itertools.chain([] if first is None else [first], chunks):
+            assert chunk.dtype == dtype, f"dtype mismatch {dtype} != {chunk.dtype}"
+            assert chunk.shape[1:] == row.shape[1:], f"shape mismatch {row.shape[1:]} != {chunk.shape[1:]}"
+            np.ascontiguousarray(chunk).tofile(fp)
+            end += chunk.shape[0]
+        # 回到文件头，修改成真实的shape
+        shape = get_shape(row.shape, max(capacity, end))
+        fp.seek(0, 0)
+        assert write_header(fp, row, shape) == offset, "header size changed"
+        write_footer(fp, dtype, shape, 0, end, offset)
+        fp.flush()
+
+    return end
+
+
 def resize(filename: Path, row: np.ndarray, start: int, end: int, capacity: Optional[int] = None) -> bool:
     """文件截断或扩充
 
@@ -193,12 +536,15 @@ def resize(filename: Path, row: np.ndarray, start: int, end: int, capacity: Opti
     """
     # 其实是直接用的capacity生成shape
     shape = get_shape(row.shape, capacity)
+    # 数据区开始位置不能变
+    _, _, old_offset = read_header(filename)
 
     try:
         with get_file_ctx(filename, mode="r+b") as fp:
             old_size = fp.seek(0, 2)
+            mark_moved(fp, old_size)
             fp.seek(0, 0)
-            offset = write_header(fp, row, shape)
+            offset = write_header(fp, row, shape, old_offset)
             fp.seek(get_nbytes(row.dtype, shape, 0), 1)
             write_footer(fp, row.dtype, shape, start, end, offset)
             new_size = fp.tell()
@@ -0,0 +1,136 @@
+"""
+numba可调用的NPYT读写函数
+
+直接操作原始数组与尾巴，在`numba.njit`函数中使用，不用回到Python调用`NPYT`的方法
+
+>>> a, t = NPYT(file).load(mmap_mode="r+").arrays()
+>>> append(a, t, rows)
+
+Notes
+-----
+1. 尾巴是uint64，numba中与int64混合运算会变成float64，所以先转成int64
+2. 没有安装numba时，就是普通的Python函数
+3. 写入不经过`NPYT._appended`，所以`NPYT.arrays`拒绝开启了校验、统计、快照、通知、锁定或去重的写进程，也拒绝`NPYT_RB`
+"""
+import os
+
+import numpy as np
+
+try:
+    from numba import njit
+except ImportError:  # numba可选
+    def njit(*args, **kwargs):
+        if len(args) == 1 and callable(args[0]):
+            return args[0]
+        return lambda func: func
+
+SEEK_SET: int = os.SEEK_SET
+SEEK_CUR: int = os.SEEK_CUR
+SEEK_END: int = os.SEEK_END
+
+
+@njit
+def start(t: np.ndarray) -> int:
+    """获取缓冲区开始位置"""
+    _start = np.int64(t[0])
+    if _start > np.int64(t[1]):
+        return 0
+    return _start
+
+
+@njit
+def end(t: np.ndarray) -> int:
+    """获取缓冲区结束位置"""
+    return np.int64(t[1])
+
+
+@njit
+def append(a: np.ndarray, t: np.ndarray, array: np.ndarray) -> int:
+    """缓冲区插入函数。空间不够时不插入
+
+    Returns
+    -------
+    int
+        剩余未插入的行数
+
+    """
+    remaining = array.shape[0]
+    if remaining == 0:
+        return remaining
+
+    _end = end(t) + remaining
+    if _end > a.shape[0]:
+        return remaining
+
+    a[_end - remaining:_end] = array
+    t[1] = _end
+
+    return 0
+
+
+@njit
+def append_row(a: np.ndarray, t: np.ndarray, row) -> int:
+    """插入单行数据。row可以是结构体的一条记录
+
+    Returns
+    -------
+    int
+        剩余未插入的行数
+
+    """
+    _end = end(t)
+    if _end >= a.shape[0]:
+        return 1
+
+    a[_end] = row
+    t[1] = _end + 1
+
+    return 0
+
+
+@njit
+def tail(a: np.ndarray, t: np.ndarray, n: int = 5) -> np.ndarray:
+    """取尾部数据"""
+    _start, _end = start(t), end(t)
+    return a[max(_start, _end - n):_end]
+
+
+@njit
+def seek(t: np.ndarray, tell: int, offset: int, whence: int = SEEK_SET) -> int:
+    """在start:end范围内seek
+
+    Returns
+    -------
+    int
+        新的tell指针
+
+    """
+    _start, _end = start(t), end(t)
+    if whence == SEEK_SET:
+        _curr = _start
+    elif whence == SEEK_CUR:
+        _curr = tell
+    else:
+        _curr = _end
+
+    return max(min(_curr + offset, _end), _start)
+
+
+@njit
+def read(a: np.ndarray, t: np.ndarray, tell: int, n: int = 1024, prefetch: int = 0):
+    """读取n行数据。tell指针由调用者保存
+
+    Returns
+    -------
+    np.ndarray
+        读取的数据
+    int
+        新的tell指针
+
+    """
+    _start, _end = start(t), end(t)
+
+    _from = max(tell - prefetch, _start)
+    tell = min(max(tell, _start) + n, _end)
+
+    return a[_from:tell], tell
@@ -0,0 +1,234 @@
+"""
+行情回放压测
+
+把录制好的`NPYT`、`NPY8`，或合成的突发逐笔数据，按N倍实时速度回放写入M个`NPY8`，同时用多个读线程跟随，
+统计持续吞吐、文件切换次数、读落后行数与端到端延迟，用来确定`capacity_per_file`、`query_size`与硬件配置
+
+- 写入时把时间字段改成写入时刻，读线程用读到的时刻减去它就是延迟
+- 读线程用`Selector`等待新数据，与实际的多品种消费者一致
+
+>>> report = run(synthetic(1_000_000), shm_path("loadgen"), stores=100, speed=10, readers=4)
+
+命令行
+
+    python -m npyt.loadgen --rows 1000000 --stores 100 --speed 10 --readers 4 --path /dev/shm/loadgen
+"""
+import argparse
+import shutil
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Union
+
+import numpy as np
+from loguru import logger
+
+from npyt.core import NPYT
+from npyt.endless import NPY8
+from npyt.selector import Board, Selector
+
+TICK_DTYPE = np.dtype([("time", np.int64), ("price", np.float64), ("volume", np.int64)])
+
+
+def synthetic(rows: int, rate: float = 100_000, burst: float = 10.0, batch_size: int = 256,
+              seed: Optional[int] = None) -> Iterator[np.ndarray]:
+    """合成的突发逐笔数据。平静期与突发期交替，到达间隔为指数分布
+
+    Parameters
+    ----------
+    rows:int
+        总行数
+    rate:float
+        平静期每秒行数
+    burst:float
+        突发期速率是平静期的倍数
+    batch_size:int
+        每批行数
+    seed:int
+        随机种子
+
+    """
+    rng = np.random.default_rng(seed)
+    t, price, bursting = 0, 100.0, False
+    for start in range(0, rows, batch_size):
+        n = min(batch_size, rows - start)
+        # 每批切换一次状态，突发期较短
+        bursting = rng.random() < (0.8 if bursting else 0.05)
+        gaps = rng.exponential(1e9 / (rate * burst if bursting else rate), n)
+        batch = np.empty(n, dtype=TICK_DTYPE)
+        batch["time"] = t + np.cumsum(gaps).astype(np.int64)
+        batch["price"] = price + np.cumsum(rng.normal(0, 0.01, n))
+        batch["volume"] = rng.integers(1, 1000, n)
+        t, price = int(batch["time"][-1]), float(batch["price"][-1])
+        yield batch
+
+
+def replay(store: Union[NPYT, NPY8], batch_size: int = 256) -> Iterator[np.ndarray]:
+    """按批读出录制好的数据"""
+    arrays = [store.data()] if isinstance(store, NPYT) else \
+        [NPYT(f).load(mmap_mode="r").data() for f in store.files() if f.exists()]
+    for a in arrays:
+        for start in range(0, len(a), batch_size):
+            yield a[start:start + batch_size]
+
+
+def _percentiles(latencies: List[np.ndarray]) -> Dict[str, float]:
+    """延迟分位数，单位微秒"""
+    if len(latencies) == 0:
+        return {}
+    values = np.concatenate(latencies) / 1e3
+    p50, p99, p999 = np.percentile(values, [50, 99, 99.9])
+    return {"p50_us": float(p50), "p99_us": float(p99), "p999_us": float(p999), "max_us": float(values.max())}
+
+
+def run(source: Iterator[np.ndarray],
+        path: Union[str, Path],
+        stores: int = 1,
+        speed: float = 1.0,
+        readers: int = 1,
+        capacity_per_file: int = 1_000_000,
+        query_size: int = 8,
+        field: str = "time",
+        remove: bool = True) -> Dict[str, Any]:
+    """回放压测
+
+    Parameters
+    ----------
+    source:
+        数据块迭代器，如`synthetic`、`replay`。每块写入一个`NPY8`，依次轮换
+    path:str
+        压测目录。每个`NPY8`一个子目录
+    stores:int
+        `NPY8`个数
+    speed:float
+        相对实时的倍数。按field的时间间隔等待，0表示不等待，尽快写入
+    readers:int
+        读线程数。`NPY8`按序号分给各个线程
+    capacity_per_file:int
+        每个文件的容量
+    query_size:int
+        队列长度
+    field:str
+        纳秒时间字段。写入时被改成写入时刻
+    remove:bool
+        结束后删除压测目录
+
+    Returns
+    -------
+    dict
+        rows、seconds、rows_per_sec、mb_per_sec、rotations、max_lag_rows、lost_rows，以及延迟分位数p50_us、p99_us、p999_us、max_us
+
+    """
+    path = Path(path)
+    path.mkdir(parents=True, exist_ok=True)
+    board = Board(path / ".board").load()
+    writers: List[Optional[NPY8]] = [None] * stores
+    written = np.zeros(stores, dtype=np.int64)
+    consumed = np.zeros(stores, dtype=np.int64)
+    latencies: List[List[np.ndarray]] = [[] for _ in range(readers)]
+    stop = threading.Event()
+    ready = threading.Barrier(readers + 1)
+
+    def follow(r: int) -> None:
+        ids = list(range(r, stores, readers))
+        followers = {k: NPY8(path / str(k), capacity_per_file, query_size).load() for k in ids}
+        selector = Selector(board)
+        for k, ns in followers.items():
+            selector.register(ns)
+        index = {id(ns): k for k, ns in followers.items()}
+        ready.wait()
+        while True:
+            selected = selector.select(timeout=0.01)
+            # 写完后读到没有新数据为止。落后太多时文件已出队列，这部分算丢失
+            if not selected and stop.is_set():
+                break
+            for ns in selected:
+                arr = ns.read(65536)
+                if len(arr) == 0:
+                    continue
+                latencies[r].append(time.time_ns() - arr[field])
+                consumed[index[id(ns)]] += len(arr)
+
+    for k in range(stores):
+        NPY8(path / str(k), capacity_per_file, query_size).load()
+    threads = [threading.Thread(target=follow, args=(r,), daemon=True) for r in range(readers)]
+    for t in threads:
+        t.start()
+    ready.wait()
+
+    rotations, max_lag, nbytes = 0, 0, 0
+    t0, src0 = time.perf_counter(), None
+    for i, batch in enumerate(source):
+        k = i % stores
+        if speed > 0:
+            src0 = int(batch[field][0]) if src0 is None else src0
+            delay = t0 + (int(batch[field][0]) - src0) / 1e9 / speed - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+
+        batch = batch.copy()
+        batch[field] = time.time_ns()
+        ns = writers[k]
+        if ns is None:
+            ns = writers[k] = NPY8(path / str(k), capacity_per_file, query_size, dtype=batch.dtype).load().notify_to(board)
+        files = ns.files()
+        ns.append(batch)
+        if files and ns.files()[-1] != files[-1]:
+            rotations += 1
+        written[k] += len(batch)
+        nbytes += batch.nbytes
+        max_lag = max(max_lag, int(written[k] - consumed[k]))
+
+    stop.set()
+    for t in threads:
+        t.join()
+    seconds = time.perf_counter() - t0
+
+    rows = int(written.sum())
+    report = {
+        "rows": rows,
+        "seconds": seconds,
+        "rows_per_sec": rows / seconds if seconds else 0.0,
+        "mb_per_sec": nbytes / seconds / 1e6 if seconds else 0.0,
+        "rotations": rotations,
+        "max_lag_rows": max_lag,
+        "lost_rows": rows - int(consumed.sum()),
+    }
+    report.update(_percentiles([x for r in latencies for x in r]))
+    logger.info("loadgen {}", report)
+
+    if remove:
+        shutil.rmtree(path, ignore_errors=True)
+    return report
+
+
+def main(args=None) -> Dict[str, Any]:
+    parser = argparse.ArgumentParser(prog="python -m npyt.loadgen", description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--path", default="loadgen", help="压测目录，放在/dev/shm下可排除磁盘影响")
+    parser.add_argument("--replay", default=None, help="回放的`NPYT`文件或`NPY8`目录。不指定时用合成数据")
+    parser.add_argument("--rows", type=int, default=1_000_000, help="合成数据的行数")
+    parser.add_argument("--rate", type=float, default=100_000, help="合成数据平静期每秒行数")
+    parser.add_argument("--burst", type=float, default=10.0, help="合成数据突发期的速率倍数")
+    parser.add_argument("--batch-size", type=int, default=256)
+    parser.add_argument("--stores", type=int, default=1)
+    parser.add_argument("--speed", type=float, default=1.0, help="相对实时的倍数，0为尽快写入")
+    parser.add_argument("--readers", type=int, default=1)
+    parser.add_argument("--capacity-per-file", type=int, default=1_000_000)
+    parser.add_argument("--query-size", type=int, default=8)
+    parser.add_argument("--field", default="time")
+    ns = parser.parse_args(args)
+
+    if ns.replay is None:
+        source = synthetic(ns.rows, ns.rate, ns.burst, ns.batch_size)
+    elif ns.replay.endswith(".npy"):
+        source = replay(NPYT(ns.replay).load(mmap_mode="r"), ns.batch_size)
+    else:
+        source = replay(NPY8(ns.replay, query_size=ns.query_size).load(), ns.batch_size)
+    report = run(source, ns.path, ns.stores, ns.speed, ns.readers, ns.capacity_per_file, ns.query_size, ns.field)
+    for key, value in report.items():
+        print(f"{key:>14}: {value:,.2f}" if isinstance(value, float) else f"{key:>14}: {value:,}")
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,364 @@
+"""
+分块计算
+
+表达式、过滤、聚合按块在内存映射上计算，每块行数按缓存大小确定，中间结果写入复用的缓冲区，
+内存占用只与块大小有关，与文件大小无关。`NPY8`的多个文件不用先拼接
+
+>>> q = Query(NPY8("demo").load())
+>>> q.sum(col("price") * col("volume"), where=col("side") == 1)
+>>> q.aggregate({"n": ("count", None), "high": ("max", col("price"))}, where=col("volume") > 0)
+
+Notes
+-----
+1. numpy的ufunc在数组较大时释放GIL，聚合可以多线程并行
+2. 聚合的过滤用ufunc的where参数，不生成过滤后的临时数组
+"""
+import operator
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterator, Optional, Tuple, Union
+
+import numpy as np
+
+# 每块的字节数，接近L2缓存大小
+BLOCK_BYTES: int = 256 * 1024
+
+
+class Expr:
+    """列表达式。用运算符组合，`Query`按块求值"""
+
+    def _eval(self, chunk: np.ndarray, scratch: dict):
+        raise NotImplementedError
+
+    def __add__(self, other):
+        return BinOp(np.add, self, other)
+
+    def __radd__(self, other):
+        return BinOp(np.add, other, self)
+
+    def __sub__(self, other):
+        return BinOp(np.subtract, self, other)
+
+    def __rsub__(self, other):
+        return BinOp(np.subtract, other, self)
+
+    def __mul__(self, other):
+        return BinOp(np.multiply, self, other)
+
+    def __rmul__(self, other):
+        return BinOp(np.multiply, other, self)
+
+    def __truediv__(self, other):
+        return BinOp(np.true_divide, self, other)
+
+    def __rtruediv__(self, other):
+        return BinOp(np.true_divide, other, self)
+
+    def __gt__(self, other):
+        return BinOp(np.greater, self, other)
+
+    def __ge__(self, other):
+        return BinOp(np.greater_equal, self, other)
+
+    def __lt__(self, other):
+        return BinOp(np.less, self, other)
+
+    def __le__(self, other):
+        return BinOp(np.less_equal, self, other)
+
+    def __eq__(self, other):
+        return BinOp(np.equal, self, other)
+
+    def __ne__(self, other):
+        return BinOp(np.not_equal, self, other)
+
+    def __and__(self, other):
+        return BinOp(np.logical_and, self, other)
+
+    def __or__(self, other):
+        return BinOp(np.logical_or, self, other)
+
+    def __invert__(self):
+        return UnaryOp(np.logical_not, self)
+
+    def __neg__(self):
+        return UnaryOp(np.negative, self)
+
+    def __abs__(self):
+        return UnaryOp(np.absolute, self)
+
+    # 重载了__eq__，要显式保留哈希
+    __hash__ = object.__hash__
+
+
+class Col(Expr):
+
+    def __init__(self, name: Optional[str]):
+        self.name = name
+
+    def _eval(self, chunk: np.ndarray, scratch: dict):
+        # 结构体字段是跨步视图，不复制
+        return chunk if self.name is None else chunk[self.name]
+
+
+class Lit(Expr):
+
+    def __init__(self, value):
+        self.value = value
+
+    def _eval(self, chunk: np.ndarray, scratch: dict):
+        return self.value
+
+
+def _operand(value) -> Expr:
+    return value if isinstance(value, Expr) else Lit(value)
+
+
+def _apply(node: Expr, ufunc, n: int, scratch: dict, *args):
+    """结果写入节点自己的缓冲区。第一次按实际结果分配，之后复用"""
+    buf = scratch.get(id(node))
+    if buf is None or len(buf) < n:
+        buf = scratch[id(node)] = ufunc(*args)
+        return buf
+    return ufunc(*args, out=buf[:n])
+
+
+class BinOp(Expr):
+
+    def __init__(self, ufunc, left, right):
+        self.ufunc = ufunc
+        self.left = _operand(left)
+        self.right = _operand(right)
+
+    def _eval(self, chunk: np.ndarray, scratch: dict):
+        left = self.left._eval(chunk, scratch)
+        right = self.right._eval(chunk, scratch)
+        if np.ndim(left) == 0 and np.ndim(right) == 0:
+            return self.ufunc(left, right)
+        return _apply(self, self.ufunc, len(chunk), scratch, left, right)
+
+
+class UnaryOp(Expr):
+
+    def __init__(self, ufunc, operand):
+        self.ufunc = ufunc
+        self.operand = _operand(operand)
+
+    def _eval(self, chunk: np.ndarray, scratch: dict):
+        value = self.operand._eval(chunk, scratch)
+        if np.ndim(value) == 0:
+            return self.ufunc(value)
+        return _apply(self, self.ufunc, len(chunk), scratch, value)
+
+
+def col(name: Optional[str] = None) -> Col:
+    """列。非结构体数组用None表示数值本身"""
+    return Col(name)
+
+
+def lit(value) -> Lit:
+    """常量"""
+    return Lit(value)
+
+
+def iter_arrays(source) -> Iterator[np.ndarray]:
+    """数据源的有效数据。`NPY8`每个文件一个数组，读的时候才映射
+
+    Parameters
+    ----------
+    source:NPYT or NPY8 or np.ndarray
+        数据源。`NPYT`、`NPY8`要先load
+
+    """
+    if isinstance(source, np.ndarray):
+        yield source
+    elif hasattr(source, "files"):
+        from npyt.core import NPYT
+        for filename in source.files():
+            if filename.exists():
+                yield NPYT(filename).load(mmap_mode="r").data()
+    else:
+        yield source.data()
+
+
+def _identity(kind: str, dtype: np.dtype):
+    """min、max在过滤后没有数据时的初始值"""
+    if dtype.kind == "f":
+        return np.inf if kind == "min" else -np.inf
+    if dtype.kind in "iu":
+        info = np.iinfo(dtype)
+        return info.max if kind == "min" else info.min
+    if dtype.kind == "b":
+        return kind == "min"
+    raise TypeError(f"{kind} of {dtype} is not supported")
+
+
+def _reduce(kind: str, values, mask, n: int):
+    """一块的部分聚合结果"""
+    if kind == "count":
+        return n if mask is None else int(np.count_nonzero(mask))
+    values = np.broadcast_to(values, (n,))
+    if kind == "sum":
+        return np.add.reduce(values, where=True if mask is None else mask)
+    if kind == "mean":
+        return _reduce("sum", values, mask, n), _reduce("count", values, mask, n)
+    if kind in ("min", "max"):
+        ufunc = np.minimum if kind == "min" else np.maximum
+        if mask is None:
+            return ufunc.reduce(values) if n else None
+        return ufunc.reduce(values, where=mask, initial=_identity(kind, values.dtype)) if mask.any() else None
+    raise ValueError(f"unknown aggregation {kind}")
+
+
+def _combine(kind: str, a, b):
+    """合并两块的部分聚合结果"""
+    if a is None:
+        return b
+    if b is None:
+        return a
+    if kind == "mean":
+        return a[0] + b[0], a[1] + b[1]
+    if kind == "min":
+        return min(a, b)
+    if kind == "max":
+        return max(a, b)
+    return operator.add(a, b)
+
+
+def _bounded_map(executor, fn, items: Iterator, window: int) -> Iterator:
+    """与`executor.map`一样按顺序返回结果，但最多window个任务在途。
+    `executor.map`会一次提交整个迭代器，块数与结果都不受限制，`NPY8`的文件也会全部映射
+    """
+    pending = deque()
+    for item in items:
+        if len(pending) >= window:
+            yield pending.popleft().result()
+        pending.append(executor.submit(fn, item))
+    while pending:
+        yield pending.popleft().result()
+
+
+class Query:
+
+    def __init__(self, source, block_bytes: int = BLOCK_BYTES, max_workers: Optional[int] = None):
+        """分块计算
+
+        Parameters
+        ----------
+        source:NPYT or NPY8 or np.ndarray
+            数据源。`NPYT`、`NPY8`要先load
+        block_bytes:int
+            每块的字节数。行数为block_bytes除以行大小
+        max_workers:int
+            聚合的线程数。None或1为单线程
+
+        """
+        self._source = source
+        self._block_bytes: int = block_bytes
+        self._max_workers: Optional[int] = max_workers
+
+    def chunks(self) -> Iterator[np.ndarray]:
+        """按块取数据，都是内存映射上的视图"""
+        for a in iter_arrays(self._source):
+            rows = max(self._block_bytes // max(a.dtype.itemsize, 1), 1)
+            for start in range(0, len(a), rows):
+                yield a[start:start + rows]
+
+    def aggregate(self, aggs: Dict[str, Tuple[str, Optional[Expr]]], where: Optional[Expr] = None) -> Dict[str, Any]:
+        """聚合
+
+        Parameters
+        ----------
+        aggs:dict
+            {名字: (聚合方式, 表达式)}。聚合方式为`sum`、`count`、`min`、`max`、`mean`，`count`的表达式可以为None
+        where:Expr
+            过滤条件
+
+        Returns
+        -------
+        dict
+            {名字: 结果}。过滤后没有数据时，min、max、mean为None
+
+        """
+        local = threading.local()
+
+        def partial(chunk: np.ndarray) -> Dict[str, Any]:
+            # 每个线程有自己的缓冲区
+            scratch = getattr(local, "scratch", None)
+            if scratch is None:
+                scratch = local.scratch = {}
+            n = len(chunk)
+            mask = None if where is None else np.broadcast_to(where._eval(chunk, scratch), (n,))
+            return {name: _reduce(kind, None if expr is None else expr._eval(chunk, scratch), mask, n)
+                    for name, (kind, expr) in aggs.items()}
+
+        if self._max_workers is None or self._max_workers <= 1:
+            partials = map(partial, self.chunks())
+            results = self._merge(aggs, partials)
+        else:
+            with ThreadPoolExecutor(self._max_workers) as executor:
+                results = self._merge(aggs, _bounded_map(executor, partial, self.chunks(), 2 * self._max_workers))
+
+        for name, (kind, _) in aggs.items():
+            if kind == "mean" and results[name] is not None:
+                total, count = results[name]
+                results[name] = total / count if count else None
+            elif kind in ("sum", "count") and results[name] is None:
+                results[name] = 0
+        return results
+
+    @staticmethod
+    def _merge(aggs: dict, partials) -> Dict[str, Any]:
+        results = {name: None for name in aggs}
+        for p in partials:
+            for name, (kind, _) in aggs.items():
+                results[name] = _combine(kind, results[name], p[name])
+        return results
+
+    def sum(self, expr: Expr, where: Optional[Expr] = None):
+        return self.aggregate({"sum": ("sum", expr)}, where)["sum"]
+
+    def count(self, where: Optional[Expr] = None) -> int:
+        return self.aggregate({"count": ("count", None)}, where)["count"]
+
+    def min(self, expr: Expr, where: Optional[Expr] = None):
+        return self.aggregate({"min": ("min", expr)}, where)["min"]
+
+    def max(self, expr: Expr, where: Optional[Expr] = None):
+        return self.aggregate({"max": ("max", expr)}, where)["max"]
+
+    def mean(self, expr: Expr, where: Optional[Expr] = None):
+        return self.aggregate({"mean": ("mean", expr)}, where)["mean"]
+
+    def select(self, columns: Union[Dict[str, Expr], None] = None, where: Optional[Expr] = None) -> Iterator[np.ndarray]:
+        """按块过滤并计算新列，逐块返回结果
+
+        Parameters
+        ----------
+        columns:dict
+            {列名: 表达式}。None为原始行
+        where:Expr
+            过滤条件
+
+        Returns
+        -------
+        Iterator[np.ndarray]
+            每块一个结果，是复制的。没有满足条件的块跳过
+
+        """
+        scratch = {}
+        for chunk in self.chunks():
+            n = len(chunk)
+            mask = None if where is None else np.broadcast_to(where._eval(chunk, scratch), (n,))
+            if mask is not None and not mask.any():
+                continue
+            if columns is None:
+                yield chunk.copy() if mask is None else chunk[mask]
+                continue
+            values = {name: np.broadcast_to(expr._eval(chunk, scratch), (n,)) for name, expr in columns.items()}
+            count = n if mask is None else int(np.count_nonzero(mask))
+            out = np.empty(count, dtype=[(name, v.dtype) for name, v in values.items()])
+            for name, v in values.items():
+                out[name] = v if mask is None else v[mask]
+            yield out
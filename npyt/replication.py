@@ -0,0 +1,352 @@
+"""
+本地流式复制
+
+`Leader`跟随写进程的`end`与`NPY8`的文件切换，把新增的行通过管道或socket发给`Follower`，
+`Follower`写成一模一样的文件。连接时`Follower`先报告已有的位置，断线重连后从这里继续
+
+帧格式: kind(uint8), name长度(uint16), offset(uint64), payload长度(uint64), name, payload
+
+- HEADER: 文件头。新文件或容量变化时发送
+- ROWS: 从offset行开始的原始字节
+- TRIM: `trim`后的start。之前的行不再发送
+- LOCK: `NPY8`的`.lock`内容
+- POSITION: `Follower`报告文件的end
+- READY: `Follower`报告完毕
+
+>>> a, b = socket.socketpair()
+>>> Leader(NPY8("demo").load(), a.makefile("rwb")).handshake().run(stop=event)
+>>> Follower("backup/demo", b.makefile("rwb")).run()
+"""
+import re
+import struct
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple, Union
+
+import numpy as np
+from loguru import logger
+from typing_extensions import Self
+
+from npyt.core import NPYT
+from npyt.endless import NPY8
+from npyt.format import as_bytes, check, get_nbytes, mark_moved, read_header, write_footer, _TAIL_ITEMSIZE_
+
+_FRAME_ = struct.Struct('<BHQQ')
+
+HEADER: int = 1
+ROWS: int = 2
+LOCK: int = 3
+POSITION: int = 4
+READY: int = 5
+TRIM: int = 6
+
+# NPY8的文件名。名字来自对方，其他的都拒绝，防止写到目录外
+_SEGMENT_NAME_ = re.compile(r'\d+\.npy')
+
+
+def send_frame(stream, kind: int, name: str = '', offset: int = 0, payload=b'') -> None:
+    """发送一帧。payload可以是任意连续的缓冲区"""
+    _name = name.encode()
+    stream.write(_FRAME_.pack(kind, len(_name), offset, len(payload)))
+    stream.write(_name)
+    stream.write(payload)
+
+
+def _read_exact(stream, n: int) -> Optional[bytes]:
+    data = b''
+    while len(data) < n:
+        chunk = stream.read(n - len(data))
+        if not chunk:
+            return None
+        data += chunk
+    return data
+
+
+def recv_frame(stream) -> Optional[Tuple[int, str, int, bytes]]:
+    """接收一帧。连接断开返回None"""
+    head = _read_exact(stream, _FRAME_.size)
+    if head is None:
+        return None
+    kind, name_len, offset, size = _FRAME_.unpack(head)
+    name = _read_exact(stream, name_len)
+    payload = _read_exact(stream, size)
+    if name is None or payload is None:
+        return None
+    return kind, name.decode(), offset, payload
+
+
+def read_header_bytes(filename: Path) -> bytes:
+    """文件头的原始字节"""
+    _, _, offset = read_header(filename)
+    with open(filename, "rb") as fp:
+        return fp.read(offset)
+
+
+class Leader:
+
+    def __init__(self, store: Union[NPYT, NPY8], stream, batch_size: int = 65536):
+        """复制的发送端
+
+        Parameters
+        ----------
+        store:NPYT or NPY8
+            要复制的数据。只用来取文件名，另外以只读方式打开，不影响写进程
+        stream:
+            可读写的二进制流，如`socket.makefile("rwb")`。只发送不握手时可以只写
+        batch_size:int
+            每帧最多行数
+
+        """
+        if isinstance(store, NPY8):
+            self._store = NPY8(store.path(), store._capacity_per_file, store._size, store._dtype).load()
+        else:
+            self._store = NPYT(store.filename()).load(mmap_mode="r")
+        self._stream = stream
+        self._batch_size: int = batch_size
+        # 按文件名记录的状态。单个NPYT文件的文件名为空
+        self._files: Dict[str, NPYT] = {}
+        self._positions: Dict[str, int] = {}
+        self._starts: Dict[str, int] = {}
+        self._capacities: Dict[str, int] = {}
+        self._lock: bytes = b''
+
+    def handshake(self) -> Self:
+        """读取Follower已有的位置，从这里继续发送"""
+        while True:
+            frame = recv_frame(self._stream)
+            if frame is None or frame[0] == READY:
+                break
+            kind, name, offset, _ = frame
+            if kind == POSITION:
+                self._positions[name] = offset
+        logger.info("handshake positions {}", self._positions)
+        return self
+
+    def _targets(self) -> List[Tuple[str, Path]]:
+        if isinstance(self._store, NPY8):
+            return [(f.name, f) for f in self._store.files()]
+        return [('', self._store.filename())]
+
+    def _open(self, name: str, filename: Path) -> Optional[NPYT]:
+        if isinstance(self._store, NPYT):
+            return self._store
+        nt = self._files.get(name)
+        if nt is None and filename.exists():
+            nt = self._files[name] = NPYT(filename).load(mmap_mode="r")
+        return nt
+
+    def poll(self) -> int:
+        """发送新增的数据
+
+        Returns
+        -------
+        int
+            发送的行数
+
+        Notes
+        -----
+        1. 离开`NPY8`队列的文件不再跟随，Follower落后太多时会丢失这些文件最后的数据
+        2. 从start开始发送，`trim`丢弃的行不发送
+
+        """
+        rows = 0
+        targets = self._targets()
+        for name, filename in targets:
+            nt = self._open(name, filename)
+            if nt is None:
+                continue
+            # 只读映射，文件被resize时自动重新映射
+            start, end = nt.start(), nt.end()
+            if nt.capacity() != self._capacities.get(name):
+                send_frame(self._stream, HEADER, name, payload=read_header_bytes(filename))
+                self._capacities[name] = nt.capacity()
+            if start > self._starts.get(name, 0):
+                # trim丢弃的行是空洞，不发送
+                send_frame(self._stream, TRIM, name, start)
+                self._starts[name] = start
+
+            a, _ = nt.arrays()
+            pos = max(self._positions.get(name, 0), start)
+            while pos < end:
+                upto = min(end, pos + self._batch_size)
+                send_frame(self._stream, ROWS, name, pos, as_bytes(a[pos:upto]))
+                rows += upto - pos
+                pos = upto
+            self._positions[name] = pos
+
+        if isinstance(self._store, NPY8):
+            lock = (self._store.path() / '.lock').read_bytes()
+            if lock != self._lock:
+                send_frame(self._stream, LOCK, payload=lock)
+                self._lock = lock
+            # 离开队列的文件不再跟随
+            names = {name for name, _ in targets}
+            for name in list(self._files):
+                if name not in names:
+                    del self._files[name]
+
+        self._stream.flush()
+        return rows
+
+    def run(self, interval: float = 0.001, stop: Optional[threading.Event] = None) -> None:
+        """循环发送，直到stop被设置或连接断开
+
+        Parameters
+        ----------
+        interval:float
+            没有新数据时的等待秒数
+        stop:threading.Event
+            停止信号
+
+        """
+        try:
+            while stop is None or not stop.is_set():
+                if self.poll() == 0:
+                    time.sleep(interval)
+        except (BrokenPipeError, ConnectionResetError) as e:
+            logger.warning("leader stopped: {}", e)
+
+
+class Follower:
+
+    def __init__(self, path: Union[str, Path], stream):
+        """复制的接收端
+
+        Parameters
+        ----------
+        path:str
+            以`.npy`结尾时为单个`NPYT`文件，否则为`NPY8`目录
+        stream:
+            可读写的二进制流，如`socket.makefile("rwb")`
+
+        """
+        self._path: Path = Path(path)
+        self._single: bool = self._path.suffix == '.npy'
+        if not self._single:
+            self._path.mkdir(parents=True, exist_ok=True)
+        self._stream = stream
+        self._files: Dict[str, NPYT] = {}
+
+    def _filename(self, name: str) -> Path:
+        """文件名。单个文件时name为空，目录时只接受`数字.npy`"""
+        if self._single:
+            if name:
+                raise ValueError(f"unexpected name {name!r} for {self._path}")
+            return self._path
+        if not _SEGMENT_NAME_.fullmatch(name):
+            raise ValueError(f"bad segment name {name!r}")
+        return self._path / name
+
+    def positions(self) -> Dict[str, int]:
+        """已有文件的end"""
+        if self._single:
+            names = ['']
+        else:
+            path_lock = self._path / '.lock'
+            lock = np.fromfile(path_lock, dtype=np.uint64) if path_lock.exists() else []
+            names = [f'{t}.npy' for t in lock if t > 0]
+
+        positions = {}
+        for name in names:
+            filename = self._filename(name)
+            if filename.exists() and check(filename) is None:
+                positions[name] = NPYT(filename).load(mmap_mode="r").end()
+        return positions
+
+    def handshake(self) -> Self:
+        """报告已有的位置"""
+        for name, end in self.positions().items():
+            send_frame(self._stream, POSITION, name, end)
+        send_frame(self._stream, READY)
+        self._stream.flush()
+        return self
+
+    def _apply_header(self, name: str, header: bytes) -> None:
+        """新建文件或修改容量。保留已有的start与end"""
+        filename = self._filename(name)
+        nt = self._files.pop(name, None)
+        start, end = 0, 0
+        if nt is not None:
+            start, end = nt.start(), nt.end()
+            del nt
+        elif filename.exists() and check(filename) is None:
+            nt = NPYT(filename).load(mmap_mode="r")
+            start, end = nt.start(), nt.end()
+            del nt
+        elif not self._single:
+            with open(self._path / '.manifest', "ab") as fp:
+                fp.write(np.array([int(Path(name).stem)], dtype=np.uint64).tobytes())
+
+        with open(filename, "r+b" if filename.exists() else "w+b") as fp:
+            mark_moved(fp, fp.seek(0, 2))
+            fp.seek(0, 0)
+            fp.write(header)
+        dtype, shape, offset = read_header(filename)
+        nbytes = get_nbytes(dtype, shape, offset)
+        with open(filename, "r+b") as fp:
+            write_footer(fp, dtype, shape, start, min(end, shape[0]), offset)
+            fp.truncate(nbytes + _TAIL_ITEMSIZE_)
+        logger.trace("follow header {} capacity {}", filename, shape[0])
+
+    def _open(self, name: str) -> NPYT:
+        nt = self._files.get(name)
+        if nt is None:
+            nt = self._files[name] = NPYT(self._filename(name)).load(mmap_mode="r+")
+        return nt
+
+    def _apply_rows(self, name: str, offset: int, payload: bytes) -> None:
+        """追加行。已有的部分跳过，重连后重复发送也没关系"""
+        nt = self._open(name)
+        row_nbytes = nt.arrays()[0].strides[0]
+        skip = nt.end() - offset
+        if skip < 0:
+            raise ValueError(f"{name} has a gap, end={nt.end()} offset={offset}")
+        if skip * row_nbytes >= len(payload):
+            return
+        remaining = nt.append_bytes(memoryview(payload)[skip * row_nbytes:])
+        assert remaining == 0, f"{name} capacity {nt.capacity()} is not enough"
+
+    def _apply_trim(self, name: str, offset: int) -> None:
+        """同步start。没有收到的行直接跳过，成为空洞"""
+        nt = self._open(name)
+        if nt.end() < offset:
+            nt.commit(offset - nt.end())
+        nt.trim(offset)
+
+    def _apply_lock(self, payload: bytes) -> None:
+        path_lock = self._path / '.lock'
+        with open(path_lock, "r+b" if path_lock.exists() else "wb") as fp:
+            fp.write(payload)
+
+    def poll(self) -> bool:
+        """处理一帧
+
+        Returns
+        -------
+        bool
+            连接断开返回False
+
+        """
+        frame = recv_frame(self._stream)
+        if frame is None:
+            return False
+        kind, name, offset, payload = frame
+        if kind == HEADER:
+            self._apply_header(name, payload)
+        elif kind == ROWS:
+            self._apply_rows(name, offset, payload)
+        elif kind == TRIM:
+            self._apply_trim(name, offset)
+        elif kind == LOCK:
+            self._apply_lock(payload)
+        return True
+
+    def run(self, handshake: bool = True) -> None:
+        """一直接收，直到连接断开"""
+        if handshake:
+            self.handshake()
+        while self.poll():
+            pass
+        self._files.clear()
+        logger.info("follower {} disconnected", self._path)
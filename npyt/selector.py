@@ -0,0 +1,200 @@
+"""
+多个文件的就绪通知
+
+一个消费者跟随上千个文件时，逐个`read`大部分都是空读。写进程每次append后在共享的通知板上
+给自己的槽位计数加一，消费者只需比较一次计数数组，就知道哪些文件可能有新数据，没有新数据时睡眠在同一个futex上
+
+- 通知板是一个uint32的内存映射文件: [序号, 等待标记, 槽位1, 槽位2, ...]
+- 槽位由文件名的crc32决定，写进程与消费者不用事先约定。冲突只会让消费者多检查一个文件
+
+>>> board = Board(shm_path("board")).load()
+>>> nt.notify_to(board)  # 写进程
+>>> selector = Selector(board)
+>>> for nt in stores:
+...     selector.register(nt)
+>>> for nt in selector.select(timeout=1):
+...     nt.read()
+"""
+import time
+import zlib
+from pathlib import Path
+from typing import Optional, Union
+
+import numpy as np
+from typing_extensions import Self
+
+from npyt._libc import futex_wait, futex_wake, has_futex
+
+_SEQ_ = 0
+_WAITING_ = 1
+_SLOT_START_ = 2
+
+
+class Board:
+
+    def __init__(self, filename: Union[str, Path], slots: int = 65536):
+        """通知板
+
+        Parameters
+        ----------
+        filename:str
+            通知板文件。放在`/dev/shm`下最快
+        slots:int
+            槽位数。越多冲突越少
+
+        """
+        self._filename: Path = Path(filename)
+        self._slots: int = max(int(slots), 1)
+        self._a: Optional[np.ndarray] = None
+        self._addr: int = 0
+        self._futex: bool = has_futex()
+
+    def filename(self) -> Path:
+        return self._filename
+
+    def load(self) -> Self:
+        """打开通知板，不存在时创建。已存在时槽位数以文件为准"""
+        if self._filename.exists():
+            size = self._filename.stat().st_size // 4
+            self._slots = size - _SLOT_START_
+            self._a = np.memmap(self._filename, dtype=np.uint32, mode="r+", shape=(size,))
+        else:
+            self._a = np.memmap(self._filename, dtype=np.uint32, mode="w+", shape=(self._slots + _SLOT_START_,))
+        self._addr = self._a.ctypes.data
+        return self
+
+    def slot(self, key: Union[str, Path]) -> int:
+        """文件名对应的槽位"""
+        name = str(Path(key).resolve())
+        return zlib.crc32(name.encode()) % self._slots + _SLOT_START_
+
+    def seq(self) -> int:
+        """全局序号。任何槽位有通知都会变化"""
+        return int(self._a[_SEQ_])
+
+    def counters(self) -> np.ndarray:
+        """所有槽位的计数"""
+        return self._a
+
+    def notify(self, slot: int) -> None:
+        """写进程append后调用。有消费者在等待时才唤醒，平时没有系统调用"""
+        self._a[slot] += 1
+        self._a[_SEQ_] += 1
+        if self._a[_WAITING_]:
+            self._a[_WAITING_] = 0
+            if self._futex:
+                futex_wake(self._addr)
+
+    def wait(self, seq: int, timeout: float) -> bool:
+        """序号还是seq时睡眠，直到有通知或超时
+
+        Returns
+        -------
+        bool
+            超时返回False
+
+        """
+        if timeout <= 0:
+            return False
+        self._a[_WAITING_] = 1
+        if self.seq() != seq:
+            return True
+        if self._futex:
+            return futex_wait(self._addr, seq, timeout)
+        # 不支持futex时轮询序号
+        deadline = time.monotonic() + timeout
+        while self.seq() == seq:
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(0.0005)
+        return True
+
+
+class Selector:
+
+    def __init__(self, board: Board, max_wait: float = 0.05):
+        """等待多个`NPYT`或`NPY8`中的任何一个有新数据
+
+        Parameters
+        ----------
+        board:Board
+            通知板，要先load
+        max_wait:float
+            单次睡眠的最长秒数。写进程与消费者同时修改等待标记时，唤醒可能丢失，最多晚这么久发现
+
+        """
+        self._board = board
+        self._max_wait: float = max_wait
+        self._stores: list = []
+        self._slots: np.ndarray = np.empty(0, dtype=np.intp)
+        # 上次看到的槽位计数
+        self._seen: np.ndarray = np.empty(0, dtype=np.uint32)
+        # 上次返回的文件可能还没读完，下次继续检查
+        self._pending: set = set()
+
+    def register(self, store, key: Union[str, Path, None] = None) -> Self:
+        """注册文件
+
+        Parameters
+        ----------
+        store:NPYT or NPY8
+            读进程的对象，要先load
+        key:str
+            写进程`notify_to`时用的名字。默认为`NPYT`的文件名或`NPY8`的目录
+
+        """
+        if key is None:
+            key = store.path() if hasattr(store, "path") else store.filename()
+        self._stores.append(store)
+        self._slots = np.append(self._slots, self._board.slot(key))
+        # 新注册的先检查一次
+        self._seen = np.append(self._seen, np.uint32(0))
+        self._pending.add(len(self._stores) - 1)
+        return self
+
+    def unregister(self, store) -> Self:
+        """取消注册"""
+        i = next(k for k, s in enumerate(self._stores) if s is store)
+        del self._stores[i]
+        self._slots = np.delete(self._slots, i)
+        self._seen = np.delete(self._seen, i)
+        self._pending = {k if k < i else k - 1 for k in self._pending if k != i}
+        return self
+
+    def _ready(self, candidates) -> list:
+        ready = [k for k in sorted(candidates) if self._stores[k].ready()]
+        self._pending = set(ready)
+        return [self._stores[k] for k in ready]
+
+    def select(self, timeout: Optional[float] = None) -> list:
+        """等待直到有文件在读指针之后有新数据
+
+        Parameters
+        ----------
+        timeout:float
+            最长等待秒数。None为一直等待，0为不等待
+
+        Returns
+        -------
+        list
+            有新数据的文件。超时返回空列表
+
+        Notes
+        -----
+        超时前会把所有文件检查一遍，防止槽位冲突时丢失通知
+
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            seq = self._board.seq()
+            counters = self._board.counters()[self._slots]
+            changed = np.flatnonzero(counters != self._seen)
+            self._seen = counters
+            ready = self._ready(self._pending.union(changed.tolist()))
+            if ready:
+                return ready
+
+            remaining = self._max_wait if deadline is None else min(deadline - time.monotonic(), self._max_wait)
+            if remaining <= 0:
+                return self._ready(range(len(self._stores)))
+            self._board.wait(seq, remaining)
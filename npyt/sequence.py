@@ -0,0 +1,132 @@
+"""
+按序号去重
+
+行情断线重连后会重发最近的消息。按单调递增的序号字段，只保留比已写入的最大序号更大的行，
+重复的行在append前就用向量化的掩码去掉，不用事后重写整个文件去重。
+
+- 已写入的最大序号来自最后一行，重新load后也不会丢
+- 写入的序号不连续时，记录缺口并警告，可以据此向行情源请求补发
+
+>>> seq = nt.sequence("seq")
+>>> nt.append(batch)  # 重发的行被丢弃
+>>> seq.gaps()
+[(1001, 1005)]
+"""
+from typing import Dict, List, Optional, Tuple, Union
+
+import numpy as np
+from loguru import logger
+from typing_extensions import Self
+
+
+class Sequence:
+
+    def __init__(self, field: Optional[str]):
+        """按序号去重
+
+        Parameters
+        ----------
+        field:str
+            序号字段，整数类型。非结构体数组为None
+
+        """
+        self._field: Optional[str] = field
+        self._last: Optional[int] = None
+        # 还没取走的缺口，[(first, last), ...]，都是缺少的序号，包含两端
+        self._gaps: List[Tuple[int, int]] = []
+
+    def field(self) -> Optional[str]:
+        return self._field
+
+    def last(self) -> Optional[int]:
+        """已写入的最大序号。还没有数据时为None"""
+        return self._last
+
+    def load(self, tail: np.ndarray) -> Self:
+        """用已有数据的最后一行初始化"""
+        self._last = int(self._values(tail)[-1]) if len(tail) else None
+        return self
+
+    def reset(self) -> Self:
+        """清空记录。数据被清空时使用"""
+        self._last = None
+        self._gaps.clear()
+        return self
+
+    def _values(self, array: Union[np.ndarray, Dict[str, np.ndarray]]) -> np.ndarray:
+        """序号列。array可以是结构体数组，也可以是按列的字典"""
+        values = array if self._field is None else np.asarray(array[self._field])
+        assert values.dtype.kind in "iu", f"sequence field {self._field} must be integer, dtype {values.dtype}"
+        return values
+
+    def mask(self, values: np.ndarray) -> np.ndarray:
+        """每行是否比之前所有的序号都大。批次内的重复、乱序回退的行也去掉"""
+        prev = np.empty_like(values)
+        if len(values) > 1:
+            np.maximum.accumulate(values[:-1], out=prev[1:])
+        keep = np.empty(len(values), dtype=bool)
+        if self._last is None:
+            keep[1:] = values[1:] > prev[1:]
+            keep[:1] = True
+        else:
+            # 用Python整数比较，uint64的序号不会被转成浮点
+            last = self._last
+            keep[:1] = int(values[0]) > last if len(values) else False
+            keep[1:] = (values[1:] > prev[1:]) & (values[1:] > last)
+        return keep
+
+    def new_rows(self, array: np.ndarray) -> np.ndarray:
+        """只保留新行。全部是新行时原样返回，不复制"""
+        if len(array) == 0:
+            return array
+        keep = self.mask(self._values(array))
+        if keep.all():
+            return array
+        logger.debug("sequence {} drop {} duplicated rows", self._field, len(keep) - int(np.count_nonzero(keep)))
+        return array[keep]
+
+    def new_columns(self, columns: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+        """按列插入时只保留新行。全部是新行时原样返回"""
+        values = self._values(columns)
+        if len(values) == 0:
+            return columns
+        keep = self.mask(values)
+        if keep.all():
+            return columns
+        logger.debug("sequence {} drop {} duplicated rows", self._field, len(keep) - int(np.count_nonzero(keep)))
+        return {name: np.asarray(v)[keep] for name, v in columns.items()}
+
+    def advance(self, array: Union[np.ndarray, Dict[str, np.ndarray]]) -> Self:
+        """新行写入成功后，更新最大序号并记录缺口"""
+        values = self._values(array)
+        if len(values) == 0:
+            return self
+        diff = np.diff(values)
+        starts = np.flatnonzero(diff > 1)
+        gaps = [(int(values[k]) + 1, int(values[k + 1]) - 1) for k in starts.tolist()]
+        if self._last is not None and int(values[0]) > self._last + 1:
+            gaps.insert(0, (self._last + 1, int(values[0]) - 1))
+        if gaps:
+            logger.warning("sequence {} gaps {}", self._field, gaps)
+            self._gaps.extend(gaps)
+        self._last = int(values[-1])
+        return self
+
+    def gaps(self, clear: bool = True) -> List[Tuple[int, int]]:
+        """缺少的序号区间
+
+        Parameters
+        ----------
+        clear:bool
+            取走后清空
+
+        Returns
+        -------
+        list
+            [(first, last), ...]，包含两端
+
+        """
+        gaps = list(self._gaps)
+        if clear:
+            self._gaps.clear()
+        return gaps
@@ -0,0 +1,31 @@
+"""
+共享内存后端
+
+文件放在tmpfs(如`/dev/shm`)中，头尾格式不变，`NPYT`、`NPY8`直接使用。
+读写都在内存中，跨进程共享不经过块设备，没有回写磁盘的开销。
+重启机器后数据丢失，需要时用`persist`保存到磁盘
+
+>>> nt = NPYT(shm_path("tick.npy")).save(arr, capacity=100000).load(mmap_mode="r+")
+>>> nt.madvise(mmap.MADV_HUGEPAGE)
+>>> nt.persist("20250510/tick.npy")
+"""
+import os
+from pathlib import Path
+from typing import Optional, Union
+
+SHM_ROOT: Path = Path(os.environ.get("NPYT_SHM_ROOT", "/dev/shm"))
+
+
+def shm_path(name: Union[str, Path], root: Optional[Union[str, Path]] = None) -> Path:
+    """共享内存中的路径
+
+    Parameters
+    ----------
+    name:str
+        文件名或目录名。`NPYT`用文件名，`NPY8`用目录名
+    root:str
+        tmpfs挂载点。None时用环境变量`NPYT_SHM_ROOT`，默认`/dev/shm`
+
+    """
+    root = SHM_ROOT if root is None else Path(root)
+    return root / name
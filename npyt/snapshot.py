@@ -0,0 +1,171 @@
+"""
+最新值快照表
+
+每个键一行，原地更新的定长表，如每个品种的最新盘口。取全市场的最新值只需复制一次整表，
+不用对上千个`NPYT`、`NPY8`逐个`tail(1)`
+
+- 表本身是普通的`NPYT`文件，字段为 键、版本号、值字段，放在`/dev/shm`下可多进程共享
+- 每行有版本号，写进程更新前后各加一，奇数表示正在写。读进程复制后比较版本号，不一致的行重新复制
+- 同一个键只能有一个写进程。不同的写进程可以更新不同的键
+- 版本号与值的写入之间没有内存屏障，依赖x86的存储顺序(TSO)。ARM等弱内存序的平台上不能保证一致
+
+>>> snap = Snapshot(shm_path("last_quote.npy"), key="symbol").save(symbols, quote_dtype).load()
+>>> nt.snapshot_to(snap)  # 写进程append时同时更新
+>>> table = Snapshot(shm_path("last_quote.npy"), key="symbol").load("r").snapshot()
+"""
+import time
+from pathlib import Path
+from typing import Optional, Sequence, Union
+
+import numpy as np
+from loguru import logger
+from typing_extensions import Literal
+from typing_extensions import Self
+
+from npyt.core import NPYT
+
+VERSION = "version"
+
+
+def table_dtype(dtype: np.dtype, key: str) -> np.dtype:
+    """表的dtype。键，版本号，然后是其他字段。版本号在值之前，按地址顺序复制时先读到版本号"""
+    dtype = np.dtype(dtype)
+    assert dtype.names and key in dtype.names, f"key {key} is not a field of {dtype}"
+    assert VERSION not in dtype.names, f"field {VERSION} is reserved"
+    descr = [(key, dtype[key]), (VERSION, np.uint64)]
+    descr.extend((name, dtype[name]) for name in dtype.names if name != key)
+    return np.dtype(descr)
+
+
+class Snapshot:
+
+    def __init__(self, filename: Union[str, Path], key: str = "symbol"):
+        """最新值快照表
+
+        Parameters
+        ----------
+        filename:str
+            表文件
+        key:str
+            键字段
+
+        """
+        self._nt: NPYT = NPYT(filename)
+        self._key: str = key
+        self._a: Optional[np.ndarray] = None
+        # 排好序的键与对应的行号，向量化查找行号
+        self._sorted_keys: Optional[np.ndarray] = None
+        self._order: Optional[np.ndarray] = None
+
+    def filename(self) -> Path:
+        return self._nt.filename()
+
+    def save(self, keys: Sequence, dtype: np.dtype, skip_if_exists: bool = True) -> Self:
+        """创建表。每个键一行，版本号为0，值全为0
+
+        Parameters
+        ----------
+        keys:
+            所有的键。表的大小固定，以后不能增加
+        dtype:np.dtype
+            行的dtype，与写入`NPYT`、`NPY8`的相同，要包含键字段
+
+        """
+        dtype = table_dtype(dtype, self._key)
+        keys = np.asarray(keys, dtype=dtype[self._key])
+        assert len(np.unique(keys)) == len(keys), "keys must be unique"
+        array = np.zeros(len(keys), dtype=dtype)
+        array[self._key] = keys
+        self._nt.save(array=array, capacity=len(keys), skip_if_exists=skip_if_exists)
+        return self
+
+    def load(self, mmap_mode: Literal["r", "r+"] = "r+") -> Self:
+        """打开表。写进程用`r+`，读进程用`r`"""
+        self._nt.load(mmap_mode=mmap_mode)
+        self._a = self._nt.data()
+        keys = self._a[self._key]
+        self._order = np.argsort(keys, kind="stable")
+        self._sorted_keys = keys[self._order]
+        return self
+
+    def keys(self) -> np.ndarray:
+        return self._a[self._key]
+
+    def rows(self, keys: np.ndarray) -> np.ndarray:
+        """键对应的行号。不存在的键为-1"""
+        keys = np.asarray(keys, dtype=self._sorted_keys.dtype)
+        idx = np.searchsorted(self._sorted_keys, keys)
+        idx = np.minimum(idx, len(self._sorted_keys) - 1)
+        found = self._sorted_keys[idx] == keys
+        return np.where(found, self._order[idx], -1)
+
+    def update(self, array: np.ndarray) -> Self:
+        """写进程更新。每个键只取这一批中的最后一行
+
+        Parameters
+        ----------
+        array:np.ndarray
+            新行，dtype与save时相同。不在表中的键忽略
+
+        """
+        if len(array) == 0:
+            return self
+        rows = self.rows(array[self._key])
+        # 每个键最后一行
+        _, first = np.unique(rows[::-1], return_index=True)
+        take = len(rows) - 1 - first
+        take = take[rows[take] >= 0]
+        if len(take) < len(first):
+            logger.warning("{} unknown keys are ignored", self.filename())
+        rows, array = rows[take], array[take]
+
+        versions = self._a[VERSION]
+        # 置为奇数。上一个写进程更新到一半退出时版本号已经是奇数，写完后也能恢复为偶数
+        versions[rows] |= 1
+        for name in array.dtype.names:
+            if name != self._key:
+                self._a[name][rows] = array[name]
+        versions[rows] += 1
+        return self
+
+    def snapshot(self, keys: Optional[np.ndarray] = None, timeout: float = 1.0) -> np.ndarray:
+        """一致的快照。整表复制一次，只有正在写的行需要重新复制
+
+        Parameters
+        ----------
+        keys:
+            只取这些键。None为整表
+        timeout:float
+            正在写的行最多重试的秒数。写进程更新到一半退出时，这些行的版本号一直是奇数，不能一直等
+
+        Returns
+        -------
+        np.ndarray
+            复制的表，包含版本号。版本号为0的行还没写入过，为奇数的行超时后仍不一致，数据不可用
+
+        """
+        rows = None if keys is None else self.rows(keys)
+        assert rows is None or (rows >= 0).all(), "unknown keys"
+        versions = self._a[VERSION]
+        before = versions.copy() if rows is None else versions[rows]
+        out = self._a.copy() if rows is None else self._a[rows]
+        after = versions if rows is None else versions[rows]
+        bad = np.flatnonzero((before != after) | (before & 1).astype(bool) | (out[VERSION] != before))
+        deadline = time.monotonic() + timeout
+        while len(bad):
+            if time.monotonic() >= deadline:
+                logger.warning("{} {} rows are still being written after {}s", self.filename(), len(bad), timeout)
+                out[VERSION][bad] |= 1
+                break
+            # 写进程正在更新这些行，让出CPU后只复制这些行
+            time.sleep(0)
+            sub = bad if rows is None else rows[bad]
+            before = versions[sub]
+            out[bad] = self._a[sub]
+            after = versions[sub]
+            bad = bad[(before != after) | (before & 1).astype(bool) | (out[VERSION][bad] != before)]
+        return out
+
+    def get(self, key, timeout: float = 1.0) -> np.ndarray:
+        """一个键的最新值，一行"""
+        return self.snapshot(np.asarray([key]), timeout)
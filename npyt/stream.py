@@ -0,0 +1,415 @@
+"""
+多个数据源的流式处理
+
+各数据源按时间字段有序，按块读取内存映射上的视图，内存占用只与块大小、数据源个数有关
+
+- `merge_sorted`: 多路归并成一个按时间有序的流
+- `asof_join`: as-of连接，左边每行匹配右边时间最接近的一行，`asof_dtype`为输出的dtype
+- `ReorderBuffer`: 有界的重排窗口，乱序到达的行按时间顺序写入
+
+>>> for batch in merge_sorted([NPY8(f"data/{s}").load() for s in symbols], "time"):
+...     strategy.on_batch(batch)
+"""
+import heapq
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+from loguru import logger
+from typing_extensions import Literal
+
+from npyt.query import iter_arrays
+
+
+def iter_chunks(source, rows: int) -> Iterator[np.ndarray]:
+    """按行数分块取数据，都是视图"""
+    for a in iter_arrays(source):
+        for start in range(0, len(a), rows):
+            yield a[start:start + rows]
+
+
+def _merge_runs(a: np.ndarray, b: np.ndarray, field: str) -> np.ndarray:
+    """两个按field有序的段合并成一个有序段。时间相同时a在前，与对两段拼接后稳定排序的结果相同
+
+    只对b做二分查找，再一次插入，不用对整体排序
+    """
+    if len(a) == 0:
+        return b
+    if len(b) == 0:
+        return a
+    return np.insert(a, np.searchsorted(a[field], b[field], side="right"), b)
+
+
+def merge_sorted(sources: Sequence, field: str = "time", chunk_rows: int = 0, batch_size: int = 65536,
+                 with_source: bool = False) -> Iterator[Union[np.ndarray, Tuple[np.ndarray, np.ndarray]]]:
+    """多路归并。每个数据源按field有序，输出按field有序的批次
+
+    Parameters
+    ----------
+    sources:list
+        数据源，`NPYT`、`NPY8`或np.ndarray，要先load。dtype要相同
+    field:str
+        时间字段
+    chunk_rows:int
+        每个数据源每次读取的行数。0表示batch_size除以数据源个数，待输出的行数与batch_size相当
+    batch_size:int
+        每批最多行数
+    with_source:bool
+        同时返回每行来自哪个数据源
+
+    Returns
+    -------
+    Iterator
+        np.ndarray，或(np.ndarray, 数据源序号)
+
+    Notes
+    -----
+    1. 堆中只记录每个数据源已读到的最大时间，总是读取最落后的数据源。堆顶就是水位，
+       水位之前的行不会再有更早的数据，可以输出。待输出的行与新读的块拼接后整体稳定排序，不用逐行操作堆。
+       各段本身有序，`np.argsort(kind="stable")`的timsort会利用这些有序段
+    2. 时间相同的行，同一数据源内保持原顺序
+    3. 内存占用约为 数据源个数 * chunk_rows + batch_size 行
+
+    """
+    if chunk_rows <= 0:
+        chunk_rows = max(batch_size // max(len(sources), 1), 64)
+    chunks = [iter_chunks(s, chunk_rows) for s in sources]
+    heap: List[Tuple[Any, int]] = []
+    loaded, loaded_ids = [], []
+
+    def load(i: int) -> int:
+        chunk = next(chunks[i], None)
+        if chunk is None:
+            return 0
+        loaded.append(chunk)
+        loaded_ids.append(np.full(len(chunk), i, dtype=np.int32))
+        heapq.heappush(heap, (chunk[field][-1], i))
+        return len(chunk)
+
+    pending = sum(load(i) for i in range(len(sources)))
+    pool, pool_ids = None, None
+    target = batch_size + len(sources) * chunk_rows
+    while heap or pending:
+        # 待输出的行不够时，继续读最落后的数据源。读完的数据源不再限制水位
+        while heap and pending < target:
+            _, i = heapq.heappop(heap)
+            pending += load(i)
+
+        if loaded:
+            parts = loaded if pool is None else [pool] + loaded
+            pool = np.concatenate(parts)
+            pool_ids = np.concatenate(loaded_ids if pool_ids is None else [pool_ids] + loaded_ids)
+            loaded.clear()
+            loaded_ids.clear()
+            order = np.argsort(pool[field], kind="stable")
+            pool, pool_ids = pool[order], pool_ids[order]
+
+        cut = len(pool) if not heap else int(np.searchsorted(pool[field], heap[0][0], side="right"))
+        cut = min(cut, batch_size)
+        batch, ids = pool[:cut], pool_ids[:cut]
+        pool, pool_ids = pool[cut:], pool_ids[cut:]
+        pending -= cut
+        if with_source:
+            yield batch, ids
+        else:
+            yield batch
+
+
+def _asof_mapping(left: np.dtype, right: np.dtype, on: str, by: Optional[str]) -> List[Tuple[str, str]]:
+    """[(右边字段名, 输出字段名), ...]。重名的右边字段加`_right`后缀"""
+    return [(name, f"{name}_right" if name in left.names else name) for name in right.names if name not in (on, by)]
+
+
+def asof_dtype(left: np.dtype, right: np.dtype, on: str = "time", by: Optional[str] = None) -> np.dtype:
+    """`asof_join`输出的dtype。左边的全部字段，加上右边除on、by外的字段，重名的加`_right`后缀
+
+    写入文件时`save_stream`要先知道dtype
+    """
+    left, right = np.dtype(left), np.dtype(right)
+    descr = [(name, left[name]) for name in left.names]
+    descr.extend((target, right[name]) for name, target in _asof_mapping(left, right, on, by))
+    return np.dtype(descr)
+
+
+def _fill_value(dtype: np.dtype):
+    """没有匹配时的填充值。浮点为NaN，其他为0"""
+    return np.nan if dtype.kind in "fc" else 0
+
+
+def _asof_index(wt: np.ndarray, lt: np.ndarray, wk: Optional[np.ndarray], lk: Optional[np.ndarray],
+                direction: str) -> Tuple[np.ndarray, np.ndarray]:
+    """左边每行在右边窗口中匹配的行号。窗口不能为空
+
+    Returns
+    -------
+    np.ndarray
+        行号
+    np.ndarray
+        是否匹配上
+
+    """
+    if wk is None:
+        if direction == "backward":
+            idx = np.searchsorted(wt, lt, side="right") - 1
+            return np.maximum(idx, 0), idx >= 0
+        idx = np.searchsorted(wt, lt, side="left")
+        return np.minimum(idx, len(wt) - 1), idx < len(wt)
+
+    # 按(键, 时间)组合排序后二分查找。时间换成名次，组合值不会溢出
+    _, codes = np.unique(np.concatenate([wk, lk]), return_inverse=True)
+    _, ranks = np.unique(np.concatenate([wt, lt]), return_inverse=True)
+    scale = np.int64(ranks.max() + 1) if len(ranks) else np.int64(1)
+    comp = codes.astype(np.int64) * scale + ranks
+    wcomp, lcomp = comp[:len(wt)], comp[len(wt):]
+    wcodes, lcodes = codes[:len(wt)], codes[len(wt):]
+    perm = np.argsort(wcomp, kind="stable")
+    wsorted = wcomp[perm]
+    if direction == "backward":
+        j = np.searchsorted(wsorted, lcomp, side="right") - 1
+        ok = j >= 0
+    else:
+        j = np.searchsorted(wsorted, lcomp, side="left")
+        ok = j < len(wsorted)
+    idx = perm[np.clip(j, 0, len(wsorted) - 1)]
+    ok &= wcodes[idx] == lcodes
+    return idx, ok
+
+
+def asof_join(left, right, on: str = "time", by: Optional[str] = None, tolerance=None,
+              direction: Literal["backward", "forward", "nearest"] = "backward",
+              chunk_rows: int = 65536) -> Iterator[np.ndarray]:
+    """as-of连接。左边每行匹配右边时间最接近的一行，如成交匹配当时的盘口
+
+    Parameters
+    ----------
+    left:NPYT or NPY8 or np.ndarray
+        左边，按on有序
+    right:NPYT or NPY8 or np.ndarray
+        右边，按on有序
+    on:str
+        时间字段
+    by:str
+        键字段，如品种代码。只匹配键相同的行
+    tolerance:
+        时间差的上限，与on同类型。超过的不匹配
+    direction:str
+        backward: 不晚于左边的最后一行
+        forward: 不早于左边的第一行
+        nearest: 时间差最小的一行，相同时取backward
+    chunk_rows:int
+        左边每块行数
+
+    Returns
+    -------
+    Iterator[np.ndarray]
+        每块左边对应一批结果，dtype见`asof_dtype`。没匹配上的右边字段，浮点为NaN，其他为0
+
+    Notes
+    -----
+    1. 两边都按块读取内存映射上的视图。右边只保留与当前块相关的行，backward、nearest另外保留每个键最后一行
+    2. 有by时forward、nearest要指定tolerance，否则下一行可能在很远处，内存没有上限
+
+    Examples
+    --------
+    >>> dtype = asof_dtype(trades.dtype(), quotes.dtype(), "time", by="symbol")
+    >>> NPYT("joined.npy").save_stream(asof_join(trades, quotes, "time", by="symbol"), dtype)
+
+    """
+    assert direction in ("backward", "forward", "nearest"), f"unknown direction {direction}"
+    assert by is None or direction == "backward" or tolerance is not None, \
+        f"tolerance is required for {direction} join with by"
+
+    first = next(iter_arrays(right), None)
+    assert first is not None, "right has no data, dtype unknown"
+    right_chunks = iter_chunks(right, chunk_rows)
+    window = np.empty(0, dtype=first.dtype)
+    exhausted = False
+    out_dtype, mapping = None, []
+
+    for chunk in iter_chunks(left, chunk_rows):
+        lt = chunk[on]
+        lmax = lt[-1]
+        # 右边读到超过本块需要的时间为止
+        bound = lmax if tolerance is None or direction == "backward" else lmax + tolerance
+        while not exhausted and (len(window) == 0 or window[on][-1] <= bound):
+            part = next(right_chunks, None)
+            if part is None:
+                exhausted = True
+            else:
+                window = np.concatenate([window, part])
+        if out_dtype is None:
+            out_dtype = asof_dtype(chunk.dtype, window.dtype, on, by)
+            mapping = _asof_mapping(chunk.dtype, window.dtype, on, by)
+
+        wt = window[on]
+        wk, lk = (None, None) if by is None else (window[by], chunk[by])
+        # 时间差总是大减小，无符号的时间不会回绕。没匹配上的行的时间差无意义，会被ok排除
+        if len(window) == 0:
+            idx, ok = np.zeros(len(chunk), dtype=np.intp), np.zeros(len(chunk), dtype=bool)
+            gap = None
+        elif direction == "nearest":
+            bi, bok = _asof_index(wt, lt, wk, lk, "backward")
+            fi, fok = _asof_index(wt, lt, wk, lk, "forward")
+            back, ahead = lt - wt[bi], wt[fi] - lt
+            use_forward = fok & (~bok | (ahead < back))
+            idx, ok = np.where(use_forward, fi, bi), bok | fok
+            gap = np.where(use_forward, ahead, back)
+        else:
+            idx, ok = _asof_index(wt, lt, wk, lk, direction)
+            gap = lt - wt[idx] if direction == "backward" else wt[idx] - lt
+        if tolerance is not None and gap is not None:
+            ok &= gap <= tolerance
+
+        out = np.empty(len(chunk), dtype=out_dtype)
+        for name in chunk.dtype.names:
+            out[name] = chunk[name]
+        for name, target in mapping:
+            out[target] = _fill_value(out_dtype[target])
+            if len(window):
+                out[target][ok] = window[name][idx[ok]]
+        yield out
+
+        # 只保留以后还可能用到的右边行
+        keep = wt > lmax if direction != "forward" else wt >= lmax
+        if direction != "forward":
+            older = np.flatnonzero(~keep)
+            if len(older):
+                if by is None:
+                    last = older[-1:]
+                else:
+                    # 每个键最后一行
+                    _, first = np.unique(wk[older][::-1], return_index=True)
+                    last = older[len(older) - 1 - first]
+                keep[last] = True
+        # 无符号的时间减到0以下会回绕，这时没有行可以丢弃
+        if tolerance is not None and (wt.dtype.kind != "u" or lmax >= tolerance):
+            keep &= wt >= lmax - tolerance
+        window = window[keep]
+
+
+class ReorderBuffer:
+
+    def __init__(self, store, field: str = "time", window=None, max_rows: int = 0,
+                 late: Literal["drop", "side", "patch"] = "drop", side=None):
+        """有界的重排窗口。缓存乱序到达的行，按时间顺序写入store
+
+        Parameters
+        ----------
+        store:NPYT or NPY8
+            目标，要先load
+        field:str
+            时间字段
+        window:
+            时间窗口，与field同类型。比已到达的最大时间早window以上的行才写入
+        max_rows:int
+            最多缓存的行数。超过时最早的行提前写入。0表示不限制
+        late:str
+            比已写入的行还早的迟到行的处理方式
+            drop: 丢弃
+            side: 写入side
+            patch: 按时间插入store的尾部，只支持`NPYT`
+        side:NPYT or NPY8
+            迟到行写入的地方
+
+        Notes
+        -----
+        1. window与max_rows至少指定一个。窗口内的行延迟写入，读者看到的数据总是有序的
+        2. patch会移动插入点之后的行，已经读过这部分的读者看不到插入的行，分块校验、分块最小最大值也要重建。
+           只适合迟到行很少，并且插入点离尾部很近的情况
+
+        Examples
+        --------
+        >>> rb = ReorderBuffer(ns, "time", window=5_000_000, late="side", side=NPY8("late").load())
+        >>> for batch in feed:
+        ...     rb.push(batch)
+        >>> rb.flush()
+
+        """
+        assert window is not None or max_rows > 0, "window or max_rows is required"
+        assert late in ("drop", "side", "patch"), f"unknown late policy {late}"
+        assert late != "side" or side is not None, "side is required for late='side'"
+        assert late != "patch" or hasattr(store, "expend"), "late='patch' only supports NPYT"
+        self._store = store
+        self._field: str = field
+        self._window = window
+        self._max_rows: int = max_rows
+        self._late: str = late
+        self._side = side
+        # 已按时间排序的缓存
+        self._buffer: Optional[np.ndarray] = None
+        # 已到达的最大时间，已写入的最大时间
+        self._seen = None
+        self._released = None
+        self._counts: Dict[str, int] = {"released": 0, "late": 0}
+
+    def counts(self) -> Dict[str, int]:
+        """released: 按顺序写入的行数，late: 迟到的行数，buffered: 缓存中的行数"""
+        return {**self._counts, "buffered": 0 if self._buffer is None else len(self._buffer)}
+
+    def push(self, array: np.ndarray) -> int:
+        """加入一批行，把窗口外的行写入store
+
+        Returns
+        -------
+        int
+            本次写入store的行数
+
+        """
+        if len(array) == 0:
+            return 0
+        times = array[self._field]
+        if self._released is not None:
+            is_late = times < self._released
+            if is_late.any():
+                self._on_late(array[is_late])
+                array, times = array[~is_late], times[~is_late]
+                if len(array) == 0:
+                    return 0
+
+        # 新批次排序后，与缓存两个有序段合并
+        array = array[np.argsort(times, kind="stable")]
+        self._buffer = array if self._buffer is None else _merge_runs(self._buffer, array, self._field)
+        latest = array[self._field][-1]
+        self._seen = latest if self._seen is None else max(self._seen, latest)
+
+        buffered = self._buffer[self._field]
+        cut = 0
+        # 无符号的时间减到0以下会回绕，这时还没有行在窗口外
+        if self._window is not None and (buffered.dtype.kind != "u" or self._seen >= self._window):
+            cut = int(np.searchsorted(buffered, self._seen - self._window, side="right"))
+        if self._max_rows > 0:
+            cut = max(cut, len(buffered) - self._max_rows)
+        return self._release(cut)
+
+    def flush(self) -> int:
+        """写入缓存中的全部行。输入结束时调用"""
+        return 0 if self._buffer is None else self._release(len(self._buffer))
+
+    def _release(self, n: int) -> int:
+        if n <= 0:
+            return 0
+        rows = self._buffer[:n]
+        remaining = self._store.append(rows)
+        # 写入失败时行还在缓存中，不会丢
+        assert remaining == 0, f"store is full, {remaining} rows are not written"
+        self._buffer = self._buffer[n:]
+        self._released = rows[self._field][-1]
+        self._counts["released"] += n
+        return n
+
+    def _on_late(self, rows: np.ndarray) -> None:
+        self._counts["late"] += len(rows)
+        logger.debug("reorder {} late rows, policy {}", len(rows), self._late)
+        if self._late == "side":
+            remaining = self._side.append(rows)
+            assert remaining == 0, f"side is full, {remaining} rows are not written"
+        elif self._late == "patch":
+            self._patch(rows[np.argsort(rows[self._field], kind="stable")])
+
+    def _patch(self, rows: np.ndarray) -> None:
+        """插入到store尾部的有序位置。先追加最后几行，再改写插入点之后的行"""
+        data = self._store.data()
+        pos = int(np.searchsorted(data[self._field], rows[self._field][0], side="right"))
+        merged = _merge_runs(data[pos:], rows, self._field)
+        n = len(merged) - len(rows)
+        assert self._store.expend(merged[n:]), "store can not be expended"
+        self._store.data()[pos:pos + n] = merged[:n]
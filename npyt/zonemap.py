@@ -0,0 +1,231 @@
+"""
+分块最小最大值(zone map)
+
+每块固定行数，记录指定字段的最小值与最大值，保存在`.npy.zone`旁路文件中。
+旁路文件以npy的头信息开始，记录了条目的dtype，之后是连续的条目，每条为块的结束行号与各字段的最小最大值。
+
+- append时增量计算，未写满的最后一块也有最小最大值
+- 按条件过滤时，先用最小最大值排除不可能满足的块，只读剩下的块，大部分页不会被访问
+
+条件为(字段, 比较符, 值)的列表，条件之间是且的关系。非结构体数组的字段为None
+
+>>> nt.zonemap(["price", "volume"])
+>>> nt.filter([("price", ">", 10.5), ("volume", ">=", 100)])
+"""
+import operator
+from pathlib import Path
+from typing import Any, List, Optional, Sequence, Tuple
+
+import numpy as np
+from loguru import logger
+from typing_extensions import Self
+
+from npyt.format import read_header, write_header
+
+_OPS_ = {
+    ">": operator.gt,
+    ">=": operator.ge,
+    "<": operator.lt,
+    "<=": operator.le,
+    "==": operator.eq,
+}
+
+Condition = Tuple[Optional[str], str, Any]
+
+
+def zone_path(filename: Path) -> Path:
+    """旁路文件名。不以`.npy`结尾，不会被`NPY8`当成数据文件"""
+    return Path(f"{filename}.zone")
+
+
+def _columns(field: Optional[str]) -> Tuple[str, str]:
+    if field is None:
+        return "min", "max"
+    return f"{field}_min", f"{field}_max"
+
+
+def _values(array: np.ndarray, field: Optional[str]) -> np.ndarray:
+    return array if field is None else array[field]
+
+
+def entry_dtype(dtype: np.dtype, fields: Sequence[Optional[str]]) -> np.dtype:
+    """条目的dtype。结束行号，然后是每个字段的最小值与最大值"""
+    descr = [("end", np.uint64)]
+    for field in fields:
+        _dtype = dtype if field is None else dtype[field]
+        assert _dtype.kind in "biufmM", f"zone map of {field} is not supported, dtype {_dtype}"
+        descr.extend((name, _dtype) for name in _columns(field))
+    return np.dtype(descr)
+
+
+def match_rows(array: np.ndarray, conditions: Sequence[Condition]) -> np.ndarray:
+    """逐行判断是否满足所有条件"""
+    mask = np.ones(len(array), dtype=bool)
+    for field, op, value in conditions:
+        mask &= _OPS_[op](_values(array, field), value)
+    return mask
+
+
+def match_blocks(entries: np.ndarray, conditions: Sequence[Condition]) -> np.ndarray:
+    """逐块判断是否可能有满足所有条件的行。没有最小最大值的字段不能排除"""
+    mask = np.ones(len(entries), dtype=bool)
+    names = entries.dtype.names
+    for field, op, value in conditions:
+        col_min, col_max = _columns(field)
+        if col_min not in names:
+            continue
+        mn, mx = entries[col_min], entries[col_max]
+        if op in (">", ">="):
+            mask &= _OPS_[op](mx, value)
+        elif op in ("<", "<="):
+            mask &= _OPS_[op](mn, value)
+        elif op == "==":
+            mask &= (mn <= value) & (mx >= value)
+    return mask
+
+
+class ZoneMap:
+
+    def __init__(self, nt, fields: Optional[Sequence[Optional[str]]] = None, block_size: int = 4096):
+        """分块最小最大值
+
+        Parameters
+        ----------
+        nt:NPYT
+            需要统计的文件，要先load
+        fields:list
+            统计的字段。None时，结构体为全部字段，非结构体为数值本身；已有旁路文件时以文件为准
+        block_size:int
+            每块行数
+
+        """
+        self._nt = nt
+        self._fields = fields
+        self._block_size: int = max(int(block_size), 1)
+        self._filename: Path = zone_path(nt.filename())
+        self._fp = None
+        self._dtype: Optional[np.dtype] = None
+        self._offset: int = 0
+        # 最后一块的状态
+        self._count: int = 0
+        self._block_start: int = 0
+        self._end: int = 0
+        self._entry: Optional[np.ndarray] = None
+
+    def fields(self) -> List[Optional[str]]:
+        """统计的字段"""
+        names = self._dtype.names[1:]
+        return [None if name == "min" else name[:-4] for name in names[::2]]
+
+    def _read_dtype(self) -> bool:
+        if not self._filename.exists():
+            return False
+        self._dtype, _, self._offset = read_header(self._filename)
+        return True
+
+    def entries(self) -> np.ndarray:
+        """所有块的记录。读进程每次都重新读取"""
+        if self._dtype is None and not self._read_dtype():
+            return np.empty(0, dtype=np.dtype([("end", np.uint64)]))
+        count = (self._filename.stat().st_size - self._offset) // self._dtype.itemsize
+        # 写了一半的记录丢弃
+        return np.fromfile(self._filename, dtype=self._dtype, count=count, offset=self._offset)
+
+    def _create(self, fields: Sequence[Optional[str]]) -> None:
+        self._dtype = entry_dtype(self._nt._raw().dtype, fields)
+        with open(self._filename, "wb") as fp:
+            self._offset = write_header(fp, np.empty(0, dtype=self._dtype), (0,))
+
+    def load(self) -> Self:
+        """写进程打开旁路文件，并把还没统计的行补上。字段与已有文件不同时重建"""
+        self.close()
+        dtype = self._nt._raw().dtype
+        fields = self._fields
+        if fields is None:
+            fields = list(dtype.names) if dtype.names else [None]
+        if not self._read_dtype() or self.fields() != list(fields):
+            logger.trace("create zone map {} for {}", self._filename, fields)
+            self._create(fields)
+
+        entries = self.entries()
+        # 比数据还新的块丢弃，重新统计
+        count = int(np.searchsorted(entries["end"], self._nt.end(), side="right"))
+        self._fp = open(self._filename, "r+b")
+        self._fp.truncate(self._offset + count * self._dtype.itemsize)
+        self._count = count
+        self._end = int(entries["end"][count - 1]) if count else 0
+        self._block_start = int(entries["end"][count - 2]) if count > 1 else 0
+        self._entry = entries[count - 1:count].copy() if count else None
+        return self.update()
+
+    def close(self) -> None:
+        if self._fp is not None:
+            self._fp.close()
+            self._fp = None
+
+    def reset(self) -> Self:
+        """清空所有统计。数据被清空时使用"""
+        self._fp.truncate(self._offset)
+        self._count = 0
+        self._block_start = 0
+        self._end = 0
+        self._entry = None
+        return self
+
+    def update(self) -> Self:
+        """把新写入的行计入统计。append后调用"""
+        a = self._nt._raw()
+        end = self._nt.end()
+        fields = self.fields()
+        while self._end < end:
+            new = self._count == 0 or self._end - self._block_start >= self._block_size
+            if new:
+                self._count += 1
+                self._block_start = self._end
+                self._entry = np.zeros(1, dtype=self._dtype)
+            upto = min(end, self._block_start + self._block_size)
+            chunk = a[self._end:upto]
+            for field in fields:
+                col_min, col_max = _columns(field)
+                values = _values(chunk, field)
+                # fmin、fmax忽略NaN
+                mn, mx = np.fmin.reduce(values), np.fmax.reduce(values)
+                if not new:
+                    mn, mx = np.fmin(self._entry[col_min][0], mn), np.fmax(self._entry[col_max][0], mx)
+                self._entry[col_min], self._entry[col_max] = mn, mx
+            self._entry["end"] = upto
+            self._end = upto
+            self._fp.seek(self._offset + (self._count - 1) * self._dtype.itemsize, 0)
+            self._fp.write(self._entry.tobytes())
+        self._fp.flush()
+        return self
+
+    def blocks(self, conditions: Sequence[Condition]) -> List[Tuple[int, int]]:
+        """可能有满足条件的行的区间，相邻的已合并
+
+        Returns
+        -------
+        list
+            [(start, end), ...]。还没统计的尾部总是包含在内
+
+        """
+        start, end = self._nt.start(), self._nt.end()
+        entries = self.entries()
+        ends = entries["end"].astype(np.int64)
+        starts = np.concatenate([[0], ends[:-1]])
+        mask = match_blocks(entries, conditions) & (ends > start) & (starts < end)
+
+        ranges = []
+        for s, e in zip(np.maximum(starts[mask], start).tolist(), np.minimum(ends[mask], end).tolist()):
+            if ranges and ranges[-1][1] == s:
+                ranges[-1] = (ranges[-1][0], e)
+            else:
+                ranges.append((s, e))
+
+        zone_end = max(int(ends[-1]) if len(ends) else 0, start)
+        if zone_end < end:
+            if ranges and ranges[-1][1] == zone_end:
+                ranges[-1] = (ranges[-1][0], end)
+            else:
+                ranges.append((zone_end, end))
+        return ranges
@@ -0,0 +1,70 @@
+import os
+
+import numpy as np
+import pytest
+
+from npyt import NPYT, NPYT_RB
+
+file = "tmp_bytes.npy"
+dtype = np.dtype([("a", np.int32), ("b", np.float64)], align=True)
+
+
+@pytest.fixture
+def arr():
+    arr = np.zeros(4, dtype=dtype)
+    arr["a"] = np.arange(4)
+    arr["b"] = np.arange(4) * 0.5
+    yield arr
+    os.remove(file)
+
+
+def test_append_bytes(arr):
+    nt = NPYT(file, dtype=dtype).save(capacity=10, skip_if_exists=False).load(mmap_mode="r+")
+    assert nt.append_bytes(arr.tobytes()) == 0
+    assert nt.append_bytes(bytearray(arr[:2].tobytes())) == 0
+    np.testing.assert_array_equal(nt.data(), np.concatenate([arr, arr[:2]]))
+    assert nt.append_bytes(arr.tobytes() * 2) == 8
+    with pytest.raises(AssertionError):
+        nt.append_bytes(b"123")
+
+    slot = nt.append_into(2)
+    slot["a"] = [7, 8]
+    nt.commit(2)
+    np.testing.assert_array_equal(nt.tail(2)["a"], [7, 8])
+    assert nt.append_into(3) is None
+    # 超出剩余空间或不是正数，不修改尾巴
+    for n in (3, 0, -1):
+        with pytest.raises(AssertionError):
+            nt.commit(n)
+    assert nt.end() == 8
+
+    del nt, slot
+
+
+def test_append_bytes_array(arr):
+    nt = NPYT(file, dtype=np.uint64).save(capacity=10, skip_if_exists=False).load(mmap_mode="r+")
+    # 按字节数计算行数，不是按元素个数
+    assert nt.append_bytes(np.arange(4, dtype=np.int64)) == 0
+    assert nt.append_bytes(memoryview(np.arange(4, 6, dtype=np.uint64))) == 0
+    np.testing.assert_array_equal(nt.data(), np.arange(6))
+    assert nt.append_bytes(np.arange(5, dtype=np.int64)) == 5
+    assert nt.end() == 6
+
+    del nt
+
+
+def test_append_bytes_ring(arr):
+    rb = NPYT_RB(file, dtype=dtype).save(capacity=10, skip_if_exists=False).load(mmap_mode="r+")
+    n = rb.capacity() // 4
+    for i in range(n):
+        assert rb.append_bytes(arr.tobytes()) == 0
+    rb.pop(6)
+    # 跨越末尾
+    assert rb.append_bytes(arr.tobytes()) == 0
+    np.testing.assert_array_equal(rb.tail(4), arr)
+    slot = rb.append_into(2)
+    slot[:] = arr[:2]
+    rb.commit(2)
+    np.testing.assert_array_equal(rb.tail(2), arr[:2])
+
+    del rb, slot
@@ -0,0 +1,70 @@
+import shutil
+
+import numpy as np
+import pytest
+
+from npyt import NPYT, NPY8, NPYT_RB
+
+file = "tmp_append_columns.npy"
+dtype = np.dtype([("price", np.float64), ("volume", np.int64), ("side", np.int8)])
+columns = {
+    "price": np.arange(100) / 10,
+    "volume": np.arange(100, dtype=np.int32),
+    "side": np.arange(100, dtype=np.int8) % 2,
+}
+expected = np.empty(100, dtype=dtype)
+for name, values in columns.items():
+    expected[name] = values
+
+
+def test_append_columns():
+    nt = NPYT(file, dtype=dtype).save(capacity=150, skip_if_exists=False).load(mmap_mode="r+")
+    assert nt.append_columns(columns) == 0
+    np.testing.assert_array_equal(nt.data(), expected)
+    # 空间不够时不插入
+    assert nt.append_columns(columns) == 100
+    assert nt.end() == 100
+    assert nt.append_columns({k: v[:50] for k, v in columns.items()}) == 0
+    np.testing.assert_array_equal(nt.data()[100:], expected[:50])
+
+    with pytest.raises(AssertionError):
+        nt.append_columns({"price": columns["price"]})
+    with pytest.raises(AssertionError):
+        nt.append_columns({**columns, "side": columns["price"]})
+    with pytest.raises(AssertionError):
+        nt.append_columns({**columns, "side": columns["side"][:10]})
+
+    nt.remove()
+
+
+def test_append_columns_rb():
+    nt = NPYT_RB(file, dtype=dtype).save(capacity=150, skip_if_exists=False).load(mmap_mode="r+")
+    nt.append_columns(columns)
+    nt.pop(80)
+    assert nt.append_columns(columns) == 0
+    np.testing.assert_array_equal(nt.data(), np.concatenate([expected[80:], expected]))
+    nt.remove()
+
+
+def test_append_columns_npy8():
+    path = "tmp_append_columns_npy8"
+    ns = NPY8(path, 150, 4, dtype=dtype).load()
+    for _ in range(4):
+        assert ns.append_columns(columns) == 0
+    np.testing.assert_array_equal(np.concatenate(ns.tail(400)), np.concatenate([expected] * 4))
+    ns.remove()
+    shutil.rmtree(path, ignore_errors=True)
+
+
+def test_append_columns_npy8_reopen(monkeypatch):
+    path = "tmp_append_columns_npy8"
+    NPY8(path, 150, 4, dtype=dtype).load().append_columns({k: v[:50] for k, v in columns.items()})
+
+    # 重新打开后直接按列写入已有的文件，不构造结构体数组，也不新建文件
+    ns = NPY8(path, 150, 4, dtype=dtype).load()
+    monkeypatch.setattr("npyt.endless.from_columns", None)
+    assert ns.append_columns(columns) == 0
+    assert len(ns.files()) == 1
+    np.testing.assert_array_equal(np.concatenate(ns.tail(400)), np.concatenate([expected[:50], expected]))
+    ns.remove()
+    shutil.rmtree(path, ignore_errors=True)
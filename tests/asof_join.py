@@ -0,0 +1,94 @@
+import shutil
+
+import numpy as np
+import pandas as pd
+
+from npyt import NPYT, NPY8
+from npyt.stream import asof_dtype, asof_join
+
+trade_dtype = np.dtype([("time", np.int64), ("symbol", np.int32), ("price", np.float64)])
+quote_dtype = np.dtype([("time", np.int64), ("symbol", np.int32), ("price", np.float64), ("size", np.int64)])
+
+
+def make(dtype, n, seed):
+    rng = np.random.default_rng(seed)
+    arr = np.zeros(n, dtype=dtype)
+    arr["time"] = np.sort(rng.integers(0, 50000, n))
+    arr["symbol"] = rng.integers(0, 5, n)
+    arr["price"] = rng.random(n)
+    if "size" in dtype.names:
+        arr["size"] = rng.integers(1, 100, n)
+    return arr
+
+
+def expected(left, right, **kwargs):
+    df = pd.merge_asof(pd.DataFrame(left), pd.DataFrame(right), on="time", suffixes=("", "_right"), **kwargs)
+    return df
+
+
+def check(out, df):
+    np.testing.assert_array_equal(out["time"], df["time"])
+    np.testing.assert_allclose(out["price_right"], df["price_right"])
+    size = df["size"].fillna(0).to_numpy()
+    np.testing.assert_array_equal(out["size"], size)
+
+
+def test_asof_join():
+    trades, quotes = make(trade_dtype, 3000, 1), make(quote_dtype, 2000, 2)
+    for direction in ("backward", "forward", "nearest"):
+        for tolerance in (None, 50):
+            out = np.concatenate(list(asof_join(trades, quotes, direction=direction, tolerance=tolerance, chunk_rows=256)))
+            assert out.dtype.names == ("time", "symbol", "price", "symbol_right", "price_right", "size")
+            df = expected(trades, quotes, direction=direction, tolerance=tolerance)
+            check(out, df)
+            np.testing.assert_array_equal(out["symbol_right"], df["symbol_right"].fillna(0))
+
+
+def test_asof_join_by():
+    trades, quotes = make(trade_dtype, 3000, 3), make(quote_dtype, 1000, 4)
+    for direction, tolerance in (("backward", None), ("backward", 100), ("forward", 100), ("nearest", 100)):
+        out = np.concatenate(list(asof_join(trades, quotes, by="symbol", direction=direction, tolerance=tolerance,
+                                            chunk_rows=200)))
+        assert out.dtype.names == ("time", "symbol", "price", "price_right", "size")
+        check(out, expected(trades, quotes, by="symbol", direction=direction, tolerance=tolerance))
+
+
+def test_asof_join_stores():
+    trades, quotes = make(trade_dtype, 3000, 5), make(quote_dtype, 2000, 6)
+    nt = NPYT("tmp_asof_join.npy").save(trades, skip_if_exists=False).load(mmap_mode="r")
+    ns = NPY8("tmp_asof_join", 500, 8, dtype=quote_dtype).load()
+    for i in range(0, 2000, 300):
+        ns.append(quotes[i:i + 300])
+
+    out = NPYT("tmp_asof_join_out.npy")
+    out.save_stream(asof_join(nt, ns, by="symbol", chunk_rows=128), asof_dtype(trade_dtype, quote_dtype, by="symbol"))
+    out.load(mmap_mode="r")
+    check(out.data(), expected(trades, quotes, by="symbol"))
+
+    out.remove()
+    nt.remove()
+    ns.remove()
+    shutil.rmtree("tmp_asof_join", ignore_errors=True)
+
+
+def test_asof_join_unsigned():
+    dtype = np.dtype([("time", np.uint64), ("value", np.float64)])
+    left = np.array([(10, 0), (20, 0), (30, 0)], dtype=dtype)
+    right = np.array([(9, 1), (19, 2), (29, 3)], dtype=dtype)
+    out = np.concatenate(list(asof_join(left, right, tolerance=5)))
+    np.testing.assert_array_equal(out["value_right"], [1, 2, 3])
+    out = np.concatenate(list(asof_join(left, right, tolerance=10, direction="forward")))
+    np.testing.assert_array_equal(out["value_right"], [2, 3, np.nan])
+    out = np.concatenate(list(asof_join(left, right, tolerance=5, direction="nearest")))
+    np.testing.assert_array_equal(out["value_right"], [1, 2, 3])
+
+    # 与int64的结果相同，包括小于tolerance的时间
+    trades, quotes = make(trade_dtype, 3000, 7), make(quote_dtype, 2000, 8)
+    utrades = trades.astype([("time", np.uint64), ("symbol", np.int32), ("price", np.float64)])
+    uquotes = quotes.astype([("time", np.uint64), ("symbol", np.int32), ("price", np.float64), ("size", np.int64)])
+    for direction in ("backward", "forward", "nearest"):
+        for by in (None, "symbol"):
+            expect = np.concatenate(list(asof_join(trades, quotes, by=by, direction=direction, tolerance=50, chunk_rows=256)))
+            got = np.concatenate(list(asof_join(utrades, uquotes, by=by, direction=direction, tolerance=50, chunk_rows=256)))
+            np.testing.assert_array_equal(got["price_right"], expect["price_right"])
+            np.testing.assert_array_equal(got["size"], expect["size"])
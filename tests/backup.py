@@ -0,0 +1,72 @@
+import os
+import shutil
+
+import numpy as np
+
+from npyt import NPYT, NPY8
+
+file = "tmp_backup.npy"
+path = "tmp_backup"
+arr = np.arange(10000, dtype=np.uint64)
+
+
+def test_backup():
+    nt = NPYT(file).save(arr[:100], capacity=1000000, skip_if_exists=False).load(mmap_mode="r+")
+    assert nt.backup(path, incremental=True) == 100
+    target = os.path.join(path, file)
+    # 未使用的容量是稀疏的
+    assert os.stat(target).st_blocks * 512 < os.path.getsize(target) // 10
+
+    nt.append(arr)
+    assert nt.backup(path, incremental=True) == 10000
+    assert nt.backup(path, incremental=True) == 0
+    np.testing.assert_array_equal(NPYT(target).load(mmap_mode="r").data(), nt.data())
+    assert os.path.getsize(target) == os.path.getsize(file)
+
+    # 扩容后头信息变了
+    nt.expend(np.zeros(1000000, dtype=np.uint64))
+    assert nt.backup(path, incremental=True) == 1000000
+    np.testing.assert_array_equal(np.load(target), np.load(file))
+
+    nt.remove()
+    shutil.rmtree(path)
+
+
+def test_backup_npy8():
+    ns = NPY8("tmp_backup_src", 8, 4, dtype=np.uint64).load()
+    for i in range(3):
+        ns.append(arr[:6] + i)
+    assert ns.backup(path, incremental=True) == 18
+    ns.append(arr[:6])
+    assert ns.backup(path, incremental=True) == 6
+
+    ns2 = NPY8(path, 8, 4, dtype=np.uint64).load()
+    assert ns2.check() == []
+    np.testing.assert_array_equal(np.concatenate(ns2.tail(100)), np.concatenate(ns.tail(100)))
+
+    ns.remove()
+    shutil.rmtree(path)
+
+
+def test_backup_sidecar():
+    nt = NPYT(file).save(arr[:100], capacity=100000, skip_if_exists=False).load(mmap_mode="r+")
+    nt.checksum(block_size=64)
+    nt.zonemap()
+    nt.append(arr)
+    for incremental in (False, True):
+        nt.backup(path, incremental=incremental)
+        restored = NPYT(os.path.join(path, file)).load(mmap_mode="r+")
+        assert restored.checksum(block_size=64).verify() == nt.end()
+        np.testing.assert_array_equal(restored.filter([(None, ">=", 9990)]), arr[-10:])
+        restored.remove()
+    nt.remove()
+
+    ns = NPY8("tmp_backup_src", 8, 4, dtype=np.uint64).load().zonemap()
+    for i in range(3):
+        ns.append(arr[:6] + i)
+    ns.backup(path, incremental=True)
+    for f in ns.files():
+        assert os.path.exists(os.path.join(path, f.name + ".zone"))
+
+    ns.remove()
+    shutil.rmtree(path)
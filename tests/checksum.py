@@ -0,0 +1,78 @@
+import os
+from pathlib import Path
+
+import numpy as np
+
+from npyt import NPYT
+
+file = "tmp_crc.npy"
+arr = np.arange(1000, dtype=np.uint64)
+
+
+def test_checksum():
+    nt = NPYT(file).save(arr[:10], capacity=100, skip_if_exists=False).load(mmap_mode="r+")
+    crc = nt.checksum(block_size=64)
+    for i in range(10):
+        nt.append(arr[i * 7:i * 7 + 7])
+    nt.expend(arr)
+    assert crc.verify() == nt.end() == 1080
+    assert len(crc.entries()) == 17
+
+    # 重新打开，增量继续
+    del crc
+    nt = NPYT(file).load(mmap_mode="r+")
+    crc = nt.checksum(block_size=64)
+    assert crc.recover() == 1080
+
+    # 模拟非正常退出：尾巴已修改，数据没写完整
+    nt.expend(arr[:100])
+    nt._raw()[1150] = 0
+    assert crc.verify(max_workers=4) == 1152 - 64
+    assert crc.recover() == 1088
+    assert nt.end() == 1088
+    nt.append(arr[:10])
+    assert crc.verify() == 1098
+
+    nt.remove()
+    assert not os.path.exists(file + ".crc")
+
+
+def test_checksum_sidecar():
+    from npyt.checksum import crc_path
+    from npyt.zonemap import zone_path
+
+    nt = NPYT(file).save(arr, capacity=2000, skip_if_exists=False).load(mmap_mode="r+")
+    nt.checksum(block_size=64)
+    nt.zonemap()
+    # 改名时旁路文件一起改名
+    assert nt.rename("tmp_crc2.npy")
+    assert not crc_path(Path(file)).exists() and not zone_path(Path(file)).exists()
+    nt.load(mmap_mode="r+")
+    assert nt.checksum(block_size=64).verify() == 1000
+
+    # 没有开启校验的对象也会删除旁路文件
+    NPYT("tmp_crc2.npy").load(mmap_mode="r").remove()
+    assert not crc_path(Path("tmp_crc2.npy")).exists()
+    assert not zone_path(Path("tmp_crc2.npy")).exists()
+
+
+def test_checksum_lagging():
+    nt = NPYT(file).save(arr[:100], capacity=1000, skip_if_exists=False).load(mmap_mode="r+")
+    crc = nt.checksum(block_size=64)
+    crc.close()
+
+    # 模拟非正常退出：尾巴已修改，旁路文件没跟上，最后的行是写坏的
+    nt = NPYT(file).load(mmap_mode="r+")
+    nt.append(arr[100:200])
+    nt._raw()[150] = 0
+    nt = NPYT(file).load(mmap_mode="r+")
+    crc = nt.checksum(block_size=64)
+    assert crc.lagging()
+    assert crc.entries()["end"][-1] == 100
+    assert crc.verify() == 100
+    assert crc.recover() == 100
+    assert nt.end() == 100 and not crc.lagging()
+    nt.append(arr[100:110])
+    assert crc.verify() == 110
+
+    nt.remove()
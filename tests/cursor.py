@@ -0,0 +1,32 @@
+import numpy as np
+
+from npyt import NPY8
+
+path = "tmp_cursor"
+arr = np.array([1, 2, 3, 4, 5, 6], dtype=np.uint64)
+
+
+def test_cursor():
+    ns = NPY8(path, 8, 4, dtype=np.uint64).load()
+    for i in range(3):
+        ns.append(arr + i * 10)
+
+    # 两个消费者组各读各的
+    c1 = NPY8(path, 8, 4, dtype=np.uint64).load().subscribe("a")
+    c2 = NPY8(path, 8, 4, dtype=np.uint64).load().subscribe("b")
+    np.testing.assert_array_equal(c1.read(5), [1, 2, 3, 4, 5])
+    np.testing.assert_array_equal(c1.read(5), [6])
+    np.testing.assert_array_equal(c1.read(5), [11, 12, 13, 14, 15])
+    c1.commit()
+    np.testing.assert_array_equal(c2.read(3), [1, 2, 3])
+    c2.commit()
+    del c1, c2
+
+    # 重启后从上次提交的位置继续
+    c1 = NPY8(path, 8, 4, dtype=np.uint64).load().subscribe("a")
+    c2 = NPY8(path, 8, 4, dtype=np.uint64).load().subscribe("b")
+    np.testing.assert_array_equal(c1.read(100), [16])
+    np.testing.assert_array_equal(c1.read(100), arr + 20)
+    np.testing.assert_array_equal(c2.read(1), [4])
+
+    ns.remove()
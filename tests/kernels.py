@@ -0,0 +1,70 @@
+import os
+
+import numpy as np
+import pytest
+from numba import njit
+
+from npyt import NPYT, NPYT_RB, kernels
+
+file = "tmp_kernels.npy"
+
+
+@njit
+def produce(a, t, n):
+    for i in range(n):
+        row = np.empty(1, dtype=a.dtype)
+        row[0]["a"] = i
+        row[0]["b"] = i * 0.5
+        if kernels.append(a, t, row) > 0:
+            return i
+    return n
+
+
+@njit
+def consume(a, t, tell):
+    total = 0.0
+    arr, tell = kernels.read(a, t, tell, 3)
+    while arr.shape[0] > 0:
+        for i in range(arr.shape[0]):
+            total += arr[i]["b"]
+        arr, tell = kernels.read(a, t, tell, 3)
+    return total, tell
+
+
+def test_kernels():
+    dtype = np.dtype([("a", np.int64), ("b", np.float64)], align=True)
+    nt = NPYT(file, dtype=dtype).save(capacity=10, skip_if_exists=False).load(mmap_mode="r+")
+    a, t = nt.arrays()
+
+    assert produce(a, t, 8) == 8
+    assert nt.end() == 8
+    assert produce(a, t, 8) == 2
+    assert kernels.append_row(a, t, a[0]) == 1
+
+    total, tell = consume(a, t, 0)
+    assert tell == 10
+    assert total == nt.data()["b"].sum()
+    np.testing.assert_array_equal(kernels.tail(a, t, 2), nt.tail(2))
+    assert kernels.seek(t, tell, -4, kernels.SEEK_END) == 6
+
+    del nt, a, t
+
+    os.remove(file)
+
+
+def test_kernels_hooks():
+    nt = NPYT(file, dtype=np.uint64).save(capacity=10, skip_if_exists=False).load(mmap_mode="r+")
+    nt.zonemap()
+    # kernels写入时不会更新统计
+    with pytest.raises(AssertionError):
+        nt.arrays()
+    # 读进程不写，可以取
+    a, t = NPYT(file).load(mmap_mode="r").arrays()
+    assert kernels.end(t) == 0
+    del a, t
+    nt.remove()
+
+    nt = NPYT_RB(file, dtype=np.uint64).save(capacity=10, skip_if_exists=False).load(mmap_mode="r+")
+    with pytest.raises(AssertionError):
+        nt.arrays()
+    nt.remove()
@@ -0,0 +1,33 @@
+import numpy as np
+
+from npyt import NPYT
+from npyt.loadgen import TICK_DTYPE, main, replay, run, synthetic
+
+file = "tmp_loadgen.npy"
+
+
+def test_synthetic():
+    batches = list(synthetic(10000, batch_size=1000, seed=1))
+    arr = np.concatenate(batches)
+    assert len(arr) == 10000 and arr.dtype == TICK_DTYPE
+    assert (np.diff(arr["time"]) >= 0).all()
+
+
+def test_run():
+    report = run(synthetic(20000, batch_size=500, seed=1), "tmp_loadgen", stores=3, speed=0, readers=2,
+                 capacity_per_file=2000, query_size=4)
+    assert report["rows"] == 20000
+    assert report["rotations"] > 0
+    assert report["rows_per_sec"] > 0
+    assert 0 <= report["p50_us"] <= report["p99_us"] <= report["max_us"]
+
+
+def test_replay():
+    arr = np.concatenate(list(synthetic(5000, seed=2)))
+    nt = NPYT(file).save(arr, skip_if_exists=False).load(mmap_mode="r")
+    assert sum(len(b) for b in replay(nt, batch_size=1000)) == 5000
+    # 1000倍速回放
+    report = main(["--replay", file, "--path", "tmp_loadgen", "--speed", "1000", "--stores", "2"])
+    assert report["rows"] == 5000
+    del nt
+    NPYT(file).remove()
@@ -0,0 +1,47 @@
+import shutil
+
+import numpy as np
+
+from npyt import NPYT, NPY8
+from npyt.stream import merge_sorted
+
+dtype = np.dtype([("time", np.int64), ("price", np.float64)])
+
+
+def make(n, seed):
+    rng = np.random.default_rng(seed)
+    arr = np.empty(n, dtype=dtype)
+    arr["time"] = np.sort(rng.integers(0, 100000, n))
+    arr["price"] = seed
+    return arr
+
+
+def test_merge_sorted():
+    arrays = [make(n, i) for i, n in enumerate([1000, 0, 5000, 10, 3000])]
+    batches = list(merge_sorted(arrays, chunk_rows=256, batch_size=500, with_source=True))
+    out = np.concatenate([b for b, _ in batches])
+    ids = np.concatenate([s for _, s in batches])
+
+    all_rows = np.concatenate(arrays)
+    assert len(out) == len(all_rows)
+    assert (np.diff(out["time"]) >= 0).all()
+    np.testing.assert_array_equal(np.sort(out, order=["time", "price"]), np.sort(all_rows, order=["time", "price"]))
+    # 序号与来源一致
+    np.testing.assert_array_equal(out["price"], ids)
+    assert max(len(b) for b, _ in batches) <= 500
+
+
+def test_merge_sorted_stores():
+    a, b = make(3000, 1), make(2000, 2)
+    nt = NPYT("tmp_merge_sorted.npy").save(a, skip_if_exists=False).load(mmap_mode="r")
+    ns = NPY8("tmp_merge_sorted", 500, 8, dtype=dtype).load()
+    for i in range(0, 2000, 300):
+        ns.append(b[i:i + 300])
+
+    out = np.concatenate(list(merge_sorted([nt, ns], chunk_rows=128)))
+    assert (np.diff(out["time"]) >= 0).all()
+    np.testing.assert_array_equal(np.sort(out, order=["time", "price"]), np.sort(np.concatenate([a, b]), order=["time", "price"]))
+
+    nt.remove()
+    ns.remove()
+    shutil.rmtree("tmp_merge_sorted", ignore_errors=True)
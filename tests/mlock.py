@@ -0,0 +1,53 @@
+import shutil
+
+import numpy as np
+
+from npyt import NPYT, NPY8
+from npyt._libc import PAGESIZE, mincore
+
+file = "tmp_mlock.npy"
+arr = np.arange(100000, dtype=np.uint64)
+
+
+def locked_pages(nt):
+    lo, hi = nt._locked
+    return (hi - lo) // PAGESIZE
+
+
+def test_mlock_tail():
+    nt = NPYT(file).save(arr[:0], capacity=1000000, skip_if_exists=False).load(mmap_mode="r+")
+    nt.mlock_tail(2000)
+    assert locked_pages(nt) == 0
+    for i in range(0, 100000, 1000):
+        nt.append(arr[i:i + 1000])
+        # 2000行16000字节，最多跨5页
+        assert locked_pages(nt) <= 5
+        lo, hi = nt._locked
+        assert mincore(lo, hi - lo).all()
+    assert nt._locked[1] >= nt.data()[-1:].ctypes.data
+
+    resident, total = nt.residency()
+    assert 100000 * 8 <= total <= 100000 * 8 + 2 * PAGESIZE
+    assert 0 < resident <= total
+
+    # 扩容重新映射后继续锁定
+    nt.expend(np.arange(1000000, dtype=np.uint64))
+    assert 0 < locked_pages(nt) <= 5
+    nt.mlock_tail(0)
+    assert locked_pages(nt) == 0
+
+    nt.remove()
+
+
+def test_mlock_tail_npy8():
+    path = "tmp_mlock_npy8"
+    ns = NPY8(path, 10000, 4, dtype=np.uint64).load().mlock_tail(1000)
+    for i in range(0, 50000, 1000):
+        ns.append(arr[i:i + 1000])
+    assert locked_pages(ns._writer) > 0
+    resident, total = NPY8(path, 10000, 4, dtype=np.uint64).load().residency()
+    assert 0 < resident <= total
+    assert total >= 4 * 10000 * 8
+
+    ns.remove()
+    shutil.rmtree(path, ignore_errors=True)
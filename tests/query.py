@@ -0,0 +1,72 @@
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from npyt import NPYT, NPY8
+from npyt.query import Query, _bounded_map, col
+
+file = "tmp_query.npy"
+dtype = np.dtype([("price", np.float64), ("volume", np.int64), ("side", np.int8)])
+arr = np.zeros(100000, dtype=dtype)
+arr["price"] = np.arange(100000) / 100
+arr["volume"] = np.arange(100000) % 7
+arr["side"] = np.arange(100000) % 2
+
+
+def test_query():
+    nt = NPYT(file).save(arr, skip_if_exists=False).load(mmap_mode="r")
+    turnover = col("price") * col("volume")
+    buy = col("side") == 1
+    expected = (arr["price"] * arr["volume"])[arr["side"] == 1].sum()
+
+    for max_workers in (None, 4):
+        q = Query(nt, block_bytes=4096, max_workers=max_workers)
+        np.testing.assert_allclose(q.sum(turnover, where=buy), expected)
+        assert q.count(where=buy & (col("volume") > 3)) == np.count_nonzero((arr["side"] == 1) & (arr["volume"] > 3))
+        result = q.aggregate({"high": ("max", col("price")), "low": ("min", col("price")), "avg": ("mean", col("volume"))},
+                             where=col("price") < 10)
+        assert result["high"] == 9.99 and result["low"] == 0
+        np.testing.assert_allclose(result["avg"], arr["volume"][:1000].mean())
+        assert q.max(col("price"), where=col("price") < 0) is None
+        assert q.sum(col("price"), where=col("price") < 0) == 0
+
+    batches = list(Query(nt, block_bytes=4096).select({"turnover": turnover, "neg": -col("price")}, where=col("volume") == 6))
+    out = np.concatenate(batches)
+    mask = arr["volume"] == 6
+    np.testing.assert_allclose(out["turnover"], (arr["price"] * arr["volume"])[mask])
+    np.testing.assert_allclose(out["neg"], -arr["price"][mask])
+    # 每块的结果不超过块大小
+    assert max(len(b) for b in batches) <= 4096 // dtype.itemsize
+
+    del nt
+    NPYT(file).remove()
+
+
+def test_query_npy8():
+    path = "tmp_query_npy8"
+    ns = NPY8(path, 10000, 16, dtype=dtype).load()
+    for i in range(0, 100000, 10000):
+        ns.append(arr[i:i + 10000])
+    q = Query(NPY8(path, 10000, 16, dtype=dtype).load(), max_workers=2)
+    assert q.count() == 100000
+    np.testing.assert_allclose(q.sum(col("price"), where=~(col("side") == 1)), arr["price"][arr["side"] == 0].sum())
+
+    ns.remove()
+    shutil.rmtree(path, ignore_errors=True)
+
+
+def test_bounded_map():
+    produced = []
+
+    def items():
+        for i in range(100):
+            produced.append(i)
+            yield i
+
+    with ThreadPoolExecutor(4) as executor:
+        for i, result in enumerate(_bounded_map(executor, lambda x: x * 2, items(), 8)):
+            assert result == i * 2
+            # 最多提前提交window个
+            assert len(produced) <= i + 1 + 8
+    assert len(produced) == 100
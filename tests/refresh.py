@@ -0,0 +1,94 @@
+import os
+
+import numpy as np
+
+from npyt import NPYT
+
+file = "tmp_refresh.npy"
+arr = np.array([1, 2, 3, 4, 5, 6], dtype=np.uint64)
+
+
+def test_refresh():
+    nt1 = NPYT(file).save(arr, capacity=8, skip_if_exists=False).load(mmap_mode="r+")
+    nt2 = NPYT(file).load(mmap_mode="r")
+    assert not nt2.refresh()
+
+    np.testing.assert_array_equal(nt2.read(100), arr)
+    # 空间不够，写进程扩容
+    assert nt1.expend(arr)
+    assert nt2.capacity() == 8
+    # 读到结尾时，自动重新映射
+    np.testing.assert_array_equal(nt2.read(100), arr)
+    assert nt2.capacity() == 12
+    np.testing.assert_array_equal(nt2.tail(3), arr[-3:])
+
+    # 手动refresh
+    nt1.resize(capacity=20)
+    assert nt2.refresh()
+    assert nt2.capacity() == 20
+    # 截断后先refresh再访问
+    nt1.load(mmap_mode="r+").resize(capacity=None)
+    assert nt2.refresh()
+    assert nt2.capacity() == 12
+    np.testing.assert_array_equal(nt2.data(), np.concatenate([arr, arr]))
+
+    del nt1
+    del nt2
+
+    os.remove(file)
+
+
+def test_refresh_truncate():
+    nt1 = NPYT(file).save(arr, capacity=100000, skip_if_exists=False).load(mmap_mode="r+")
+    nt2 = NPYT(file).load(mmap_mode="r")
+    nt3 = NPYT(file).load(mmap_mode="r")
+    np.testing.assert_array_equal(nt2.read(3), arr[:3])
+
+    # 截断后不手动refresh，旧尾巴已不在文件中，直接访问会SIGBUS
+    assert nt1.resize()
+    np.testing.assert_array_equal(nt2.read(100), arr[3:])
+    assert nt2.capacity() == len(arr)
+    np.testing.assert_array_equal(nt3.tail(2), arr[-2:])
+    assert not nt2.ready()
+
+    nt1.load(mmap_mode="r+").expend(arr)
+    assert nt2.ready()
+    np.testing.assert_array_equal(nt2.read(100), arr)
+
+    # 其他访问函数也不会SIGBUS
+    nt4 = NPYT(file).load(mmap_mode="r")
+    nt5 = NPYT(file).load(mmap_mode="r")
+    nt1.load(mmap_mode="r+").resize(capacity=100000)
+    nt4.load(mmap_mode="r")
+    nt5.load(mmap_mode="r")
+    nt1.load(mmap_mode="r+").resize()
+    np.testing.assert_array_equal(nt4.head(3), arr[:3])
+    np.testing.assert_array_equal(nt5.data(), np.concatenate([arr, arr]))
+    assert nt4.start() == 0 and nt4.end() == 12
+    assert nt4.seek(0, os.SEEK_END).tell() == 12
+
+    del nt1, nt2, nt3, nt4, nt5
+    os.remove(file)
+
+
+def test_refresh_resizing():
+    nt1 = NPYT(file).save(arr, capacity=8, skip_if_exists=False).load(mmap_mode="r+")
+    nt2 = NPYT(file).load(mmap_mode="r")
+    size = os.path.getsize(file)
+
+    # 写进程resize到一半：文件已扩大，头尾还没写
+    os.truncate(file, size + 4096)
+    assert not nt2.refresh()
+    assert nt2.capacity() == 8
+    np.testing.assert_array_equal(nt2.read(100), arr)
+    np.testing.assert_array_equal(nt2.tail(2), arr[-2:])
+
+    # resize完成后重新映射
+    os.truncate(file, size)
+    assert nt1.expend(arr)
+    assert nt2.refresh()
+    assert nt2.capacity() == 12
+    np.testing.assert_array_equal(nt2.read(100), arr)
+
+    del nt1, nt2
+    os.remove(file)
@@ -0,0 +1,97 @@
+import shutil
+
+import numpy as np
+import pytest
+
+from npyt import NPYT, NPY8
+from npyt.stream import ReorderBuffer
+
+dtype = np.dtype([("time", np.int64), ("price", np.float64)])
+
+
+def shuffled(n, jitter, seed):
+    """时间有序的行加上不超过jitter的乱序"""
+    rng = np.random.default_rng(seed)
+    arr = np.zeros(n, dtype=dtype)
+    arr["time"] = np.arange(n) * 10
+    arr["price"] = np.arange(n)
+    order = np.argsort(np.arange(n) * 10 + rng.integers(0, jitter, n), kind="stable")
+    return arr[order]
+
+
+def test_reorder_window():
+    arr = shuffled(5000, 200, 1)
+    nt = NPYT("tmp_reorder.npy", dtype=dtype).save(capacity=10000, skip_if_exists=False).load(mmap_mode="r+")
+    rb = ReorderBuffer(nt, "time", window=200)
+    for i in range(0, len(arr), 64):
+        rb.push(arr[i:i + 64])
+        # 已写入的总是有序
+        assert (np.diff(nt.data()["time"]) >= 0).all()
+    assert rb.counts()["buffered"] > 0
+    rb.flush()
+
+    np.testing.assert_array_equal(nt.data(), np.sort(arr, order="time"))
+    assert rb.counts() == {"released": 5000, "late": 0, "buffered": 0}
+    nt.remove()
+
+
+def test_reorder_late():
+    arr = shuffled(2000, 500, 2)
+    expected = np.sort(arr, order="time")
+
+    # 窗口太小，一部分行迟到
+    nt = NPYT("tmp_reorder.npy", dtype=dtype).save(capacity=10000, skip_if_exists=False).load(mmap_mode="r+")
+    side = NPY8("tmp_reorder_side", 256, 8, dtype=dtype).load()
+    rb = ReorderBuffer(nt, "time", max_rows=16, late="side", side=side)
+    for i in range(0, len(arr), 32):
+        rb.push(arr[i:i + 32])
+    rb.flush()
+    late = np.concatenate([NPYT(f).load(mmap_mode="r").data() for f in side.files() if f.exists()])
+    assert rb.counts()["late"] == len(late) > 0
+    assert (np.diff(nt.data()["time"]) >= 0).all()
+    np.testing.assert_array_equal(np.sort(np.concatenate([nt.data(), late]), order="time"), expected)
+    side.remove()
+    shutil.rmtree("tmp_reorder_side", ignore_errors=True)
+
+    # 丢弃
+    nt = NPYT("tmp_reorder.npy", dtype=dtype).save(capacity=10000, skip_if_exists=False).load(mmap_mode="r+")
+    rb = ReorderBuffer(nt, "time", max_rows=16, late="drop")
+    for i in range(0, len(arr), 32):
+        rb.push(arr[i:i + 32])
+    rb.flush()
+    assert nt.end() == len(arr) - rb.counts()["late"]
+    assert (np.diff(nt.data()["time"]) >= 0).all()
+
+    # 补写到尾部
+    nt = NPYT("tmp_reorder.npy", dtype=dtype).save(capacity=10000, skip_if_exists=False).load(mmap_mode="r+")
+    rb = ReorderBuffer(nt, "time", max_rows=16, late="patch")
+    for i in range(0, len(arr), 32):
+        rb.push(arr[i:i + 32])
+    rb.flush()
+    assert rb.counts()["late"] > 0
+    np.testing.assert_array_equal(nt.data()["time"], expected["time"])
+    nt.remove()
+
+
+def test_reorder_unsigned():
+    udtype = np.dtype([("time", np.uint64), ("price", np.float64)])
+    nt = NPYT("tmp_reorder.npy", dtype=udtype).save(capacity=4, skip_if_exists=False).load(mmap_mode="r+")
+    rb = ReorderBuffer(nt, "time", window=5)
+    arr = np.zeros(6, dtype=udtype)
+    arr["time"] = [3, 1, 2, 7, 4, 9]
+    # 最大时间比窗口小，不能回绕后全部写入
+    assert rb.push(arr[:3]) == 0
+    assert rb.push(arr[3:5]) == 2
+    assert rb.counts() == {"released": 2, "late": 0, "buffered": 3}
+    np.testing.assert_array_equal(nt.data()["time"], [1, 2])
+
+    # store满了，写不进去的行还在缓存中
+    assert rb.push(arr[5:]) == 2
+    with pytest.raises(AssertionError):
+        rb.flush()
+    assert rb.counts()["buffered"] == 2
+    np.testing.assert_array_equal(nt.data()["time"], [1, 2, 3, 4])
+    nt.clear()
+    assert rb.flush() == 2
+    np.testing.assert_array_equal(nt.data()["time"], [7, 9])
+    nt.remove()
@@ -0,0 +1,131 @@
+import os
+
+import numpy as np
+
+from npyt import NPY8, NPYT
+
+path = "tmp_repair"
+arr = np.array([1, 2, 3, 4, 5, 6], dtype=np.uint64)
+
+
+def test_repair():
+    ns = NPY8(path, 6, 4, dtype=np.uint64).load()
+    for i in range(6):
+        ns.append(arr + i * 10)
+    assert ns.check() == []
+    lock = ns._lock.tolist()
+    assert len(ns._manifest()) == 6
+
+    # 顺序错乱
+    ns._lock[:] = lock[::-1]
+    assert ns.check()
+    # 读进程load不修改lock，写入时才修复
+    ns = NPY8(path, 6, 4, dtype=np.uint64).load()
+    assert ns._lock.tolist() == lock[::-1]
+    ns.repair()
+    assert ns._lock.tolist() == lock
+
+    # 队列中间的文件被改名
+    os.rename(os.path.join(path, f"{lock[1]}.npy"), os.path.join(path, f"{lock[1]}.npy_"))
+    ns = NPY8(path, 6, 4, dtype=np.uint64).load().repair()
+    assert ns._lock.tolist()[-3:] == [lock[0], lock[2], lock[3]]
+    np.testing.assert_array_equal(ns.tail(1)[0], arr[-1:] + 50)
+
+    # 没有manifest的旧目录，遍历一次生成manifest
+    os.remove(os.path.join(path, ".manifest"))
+    ns._lock[:] = 0
+    ns._lock[0] = 1
+    ns = NPY8(path, 6, 4, dtype=np.uint64).load()
+    # 第一次写入时修复
+    ns.append(arr[:1])
+    assert ns.check() == []
+    assert len(ns._manifest()) == 6
+
+    ns.remove()
+
+
+def test_repair_unfinished():
+    ns = NPY8(path, 6, 4, dtype=np.uint64).load()
+    ns.append(arr)
+    ns.append(arr + 10)
+    lock = ns._lock.tolist()
+
+    # 写进程刚把新文件写入lock与manifest，文件只写了一半
+    t = max(lock) + 1
+    ns._lock[2] = t
+    with open(os.path.join(path, ".manifest"), "ab") as fp:
+        fp.write(np.array([t], dtype=np.uint64).tobytes())
+    with open(os.path.join(path, f"{t}.npy"), "wb") as fp:
+        fp.write(b"\x93NUMPY")
+
+    # 读进程打开，不认为有问题，也不修改lock
+    reader = NPY8(path, 6, 4, dtype=np.uint64).load()
+    assert reader.check() == []
+    assert reader._lock.tolist() == lock[:2] + [t, 0]
+    np.testing.assert_array_equal(reader.read(100), arr)
+    np.testing.assert_array_equal(reader.read(100), arr + 10)
+    # 新文件还没写完，之后再读
+    assert len(reader.read(100)) == 0
+
+    # 写进程重启后把这个文件移到一边，重新创建
+    writer = NPY8(path, 6, 4, dtype=np.uint64).load()
+    writer.append(arr + 20)
+    assert writer._lock.tolist() == lock[:2] + [t, 0]
+    with open(os.path.join(path, f"{t}.npy.broken"), "rb") as fp:
+        assert fp.read() == b"\x93NUMPY"
+    np.testing.assert_array_equal(reader.read(100), arr + 20)
+
+    ns.remove()
+
+
+def test_repair_manifest():
+    ns = NPY8(path, 6, 4, dtype=np.uint64).load()
+    ns.append(arr)
+    size = os.path.getsize(os.path.join(path, ".manifest"))
+    # 写了一半的记录
+    with open(os.path.join(path, ".manifest"), "ab") as fp:
+        fp.write(b"\x01\x02")
+
+    # 读进程不修改manifest
+    reader = NPY8(path, 6, 4, dtype=np.uint64).load()
+    assert reader.check() == ["manifest has a partial record"]
+    assert os.path.getsize(os.path.join(path, ".manifest")) == size + 2
+
+    # 写进程第一次写入时修复
+    writer = NPY8(path, 6, 4, dtype=np.uint64).load()
+    writer.append(arr + 10)
+    writer.append(arr + 20)
+    assert writer.check() == []
+    assert len(writer._manifest()) == 3
+
+    ns.remove()
+
+
+def test_read_retry():
+    ns = NPY8(path, 6, 4, dtype=np.uint64).load()
+    ns.append(arr)
+    ns.append(arr + 10)
+    lock = ns._lock.tolist()
+    reader = NPY8(path, 6, 4, dtype=np.uint64).load()
+    np.testing.assert_array_equal(reader.read(100), arr)
+
+    # 写进程已把新文件写入lock，还没创建。读进程不跳过，每次都重试
+    t = max(lock) + 1
+    ns._lock[2] = t
+    np.testing.assert_array_equal(reader.read(100), arr + 10)
+    for _ in range(3):
+        assert len(reader.read(100)) == 0
+    # 创建了一半，头不完整
+    with open(os.path.join(path, f"{t}.npy"), "wb") as fp:
+        fp.write(b"\x93NUMPY")
+    assert len(reader.read(100)) == 0
+    NPYT(os.path.join(path, f"{t}.npy")).save(arr + 20, capacity=6, skip_if_exists=False)
+    np.testing.assert_array_equal(reader.read(100), arr + 20)
+
+    # 旧文件没了就跳过
+    reader = NPY8(path, 6, 4, dtype=np.uint64).load()
+    os.remove(os.path.join(path, f"{lock[0]}.npy"))
+    np.testing.assert_array_equal(reader.read(100), np.empty(0, dtype=np.uint64))
+    np.testing.assert_array_equal(reader.read(100), arr + 10)
+
+    ns.remove()
@@ -0,0 +1,99 @@
+import os
+import shutil
+import socket
+import threading
+
+import numpy as np
+import pytest
+
+from npyt import NPYT, NPY8
+from npyt.replication import HEADER, Follower, Leader, send_frame
+
+arr = np.arange(10000, dtype=np.uint64)
+
+
+def replicate(store, target, after=None):
+    """复制一次，直到Leader发送完毕后断开"""
+    a, b = socket.socketpair()
+    follower = Follower(target, b.makefile("rwb"))
+    t = threading.Thread(target=follower.run)
+    t.start()
+    leader = Leader(store, a.makefile("rwb"), batch_size=7).handshake()
+    rows = leader.poll()
+    if after is not None:
+        after()
+        rows += leader.poll()
+    a.shutdown(socket.SHUT_RDWR)
+    a.close()
+    t.join()
+    b.close()
+    return rows
+
+
+def test_replication_npyt():
+    file, target = "tmp_repl_src.npy", "tmp_repl_dst.npy"
+    nt = NPYT(file).save(arr[:10], capacity=100, skip_if_exists=False).load(mmap_mode="r+")
+    assert replicate(nt, target, lambda: nt.append(arr[:20])) == 30
+    np.testing.assert_array_equal(NPYT(target).load(mmap_mode="r").data(), nt.data())
+
+    # 重连后从已有位置继续，扩容后头信息也同步
+    nt.expend(arr[:500])
+    assert replicate(nt, target) == 500
+    np.testing.assert_array_equal(np.load(target), np.load(file))
+
+    nt.remove()
+    os.remove(target)
+
+
+def test_replication_npy8():
+    src, target = "tmp_repl_src", "tmp_repl_dst"
+    ns = NPY8(src, 8, 4, dtype=np.uint64).load()
+    ns.append(arr[:6])
+    assert replicate(ns, target, lambda: [ns.append(arr[:6] + i) for i in range(3)]) == 24
+
+    ns.append(arr[:6])
+    assert replicate(ns, target) == 6
+
+    ns2 = NPY8(target, 8, 4, dtype=np.uint64).load()
+    assert ns2.check() == []
+    np.testing.assert_array_equal(np.concatenate(ns2.tail(100)), np.concatenate(ns.tail(100)))
+
+    ns.remove()
+    shutil.rmtree(target)
+
+
+def test_replication_trim():
+    file, target = "tmp_repl_src.npy", "tmp_repl_dst.npy"
+    nt = NPYT(file).save(arr[:100], capacity=10000, skip_if_exists=False).load(mmap_mode="r+")
+    nt.trim(60)
+    # 丢弃的行不发送，Follower也跳过
+    assert replicate(nt, target, lambda: nt.append(arr[:20])) == 60
+    follower = NPYT(target).load(mmap_mode="r")
+    assert follower.start() == 60 and follower.end() == 120
+    np.testing.assert_array_equal(follower.data(), nt.data())
+
+    # 重连后继续trim
+    nt.trim(110)
+    assert replicate(nt, target) == 0
+    assert follower.start() == 110
+    np.testing.assert_array_equal(follower.data(), nt.data())
+
+    del follower
+    nt.remove()
+    os.remove(target)
+
+
+def test_replication_bad_name():
+    target = "tmp_repl_dst"
+    a, b = socket.socketpair()
+    follower = Follower(target, b.makefile("rwb"))
+    stream = a.makefile("rwb")
+    send_frame(stream, HEADER, "../escape.npy", payload=b"\x93NUMPY")
+    stream.flush()
+    with pytest.raises(ValueError):
+        follower.poll()
+    assert not os.path.exists("escape.npy")
+
+    a.close()
+    b.close()
+    shutil.rmtree(target)
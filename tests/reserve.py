@@ -0,0 +1,37 @@
+import os
+
+import numpy as np
+
+from npyt import NPYT
+
+file = "tmp_reserve.npy"
+arr = np.array([1, 2, 3, 4, 5, 6], dtype=np.uint64)
+
+
+def test_reserve():
+    nt = NPYT(file).save(arr, capacity=8, skip_if_exists=False).load(mmap_mode="r+", reserve=100)
+    view = nt.data()
+    addr = nt._raw().ctypes.data
+
+    for i in range(10):
+        assert nt.expend(arr + i)
+    # 基地址不变，旧视图依然有效
+    assert nt._raw().ctypes.data == addr
+    assert nt.capacity() >= 66
+    view[0] = 100
+    assert nt.at(0) == 100
+    np.testing.assert_array_equal(nt.tail(6), arr + 9)
+
+    # 原生加载的结果一致
+    np.testing.assert_array_equal(np.load(file)[:nt.end()], nt.data())
+    np.testing.assert_array_equal(NPYT(file).load(mmap_mode="r").data(), nt.data())
+
+    # 超出预留空间，重新映射
+    assert nt.expend(np.zeros(100, dtype=np.uint64))
+    assert nt.end() == 166
+    assert view[0] == 100
+
+    del nt
+    del view
+
+    os.remove(file)
@@ -0,0 +1,71 @@
+import os
+
+import numpy as np
+import pytest
+
+from npyt import NPYT_RB
+
+file = "tmp_rb.npy"
+
+
+def test_ring_buffer():
+    dtype = np.dtype([("a", np.int64), ("b", np.float64)], align=True)
+    rb1 = NPYT_RB(file, dtype=dtype).save(capacity=100, skip_if_exists=False).load(mmap_mode="r+")
+    rb2 = NPYT_RB(file).load(mmap_mode="r")
+    capacity = rb1.capacity()
+    assert capacity >= 100
+    assert rb2.capacity() == capacity
+
+    arr = np.zeros(capacity - 10, dtype=dtype)
+    arr["a"] = np.arange(len(arr))
+    assert rb1.append(arr) == 0
+    assert rb1.append(arr) == len(arr)
+    np.testing.assert_array_equal(rb1.pop(len(arr) - 5)["a"], arr["a"][:-5])
+
+    # 跨越末尾也是连续视图
+    arr["a"] += 1000
+    assert rb1.append(arr) == 0
+    assert rb1.size() == len(arr) + 5
+    data = rb2.data()
+    assert data.base is not None
+    np.testing.assert_array_equal(data["a"][5:], arr["a"])
+    np.testing.assert_array_equal(rb2.tail(3)["a"], arr["a"][-3:])
+    np.testing.assert_array_equal(rb2.read(capacity)["a"], data["a"])
+    # start、end是不断增长的行号，绕过几圈后过滤也要按环形取数据
+    for _ in range(5):
+        rb1.pop(len(arr))
+        assert rb1.append(arr) == 0
+    assert rb1.start() > 2 * capacity
+    np.testing.assert_array_equal(rb2.filter([("a", ">=", 1000)]), rb2.data())
+    np.testing.assert_array_equal(rb2.filter([("a", "<", 1005)])["a"], arr["a"][:5])
+
+    # 原生加载，数据区是环形的
+    assert np.load(file).shape[0] == capacity
+
+    del rb1
+    del rb2
+    del data
+
+    os.remove(file)
+
+
+def test_ring_buffer_unsupported():
+    rb = NPYT_RB(file, dtype=np.int64).save(capacity=100, skip_if_exists=False)
+    with pytest.raises(AssertionError):
+        rb.load(mmap_mode="r+", reserve=1000)
+    rb.load(mmap_mode="r+")
+    # 行号绕圈后旁路文件的位置不对，不支持
+    with pytest.raises(AssertionError):
+        rb.checksum()
+    with pytest.raises(AssertionError):
+        rb.zonemap()
+    assert not os.path.exists(file + ".crc") and not os.path.exists(file + ".zone")
+
+    rb.append(np.arange(10))
+    reader = NPYT_RB(file).load(mmap_mode="r")
+    assert reader.ready()
+    np.testing.assert_array_equal(reader.read(100), np.arange(10))
+    assert not reader.ready()
+
+    del rb, reader
+    os.remove(file)
@@ -0,0 +1,55 @@
+import os
+
+import numpy as np
+import pytest
+
+from npyt import NPYT, NPY8
+
+file = "tmp_stream.npy"
+path = "tmp_stream"
+
+
+def chunks(n):
+    for i in range(n):
+        yield np.arange(i * 7, i * 7 + 7, dtype=np.int64)
+
+
+def test_save_stream():
+    nt = NPYT(file).save_stream(chunks(10), dtype=np.int64, capacity_hint=50, skip_if_exists=False).load(mmap_mode="r")
+    assert nt.capacity() == 70
+    np.testing.assert_array_equal(nt.data(), np.arange(70))
+    np.testing.assert_array_equal(np.load(file), np.arange(70))
+    del nt
+
+    nt = NPYT(file).save_stream(chunks(2), dtype=np.int64, capacity_hint=50, skip_if_exists=False).load(mmap_mode="r+")
+    assert nt.capacity() == 50
+    assert nt.append(np.arange(3)) == 0
+    assert nt.end() == 17
+    del nt
+
+    os.remove(file)
+
+
+def test_save_stream_2d():
+    arr = np.arange(40, dtype=np.float64).reshape(20, 2)
+    nt = NPYT(file).save_stream((arr[i:i + 6] for i in range(0, 20, 6)), dtype=np.float64, skip_if_exists=False)
+    nt.load(mmap_mode="r+")
+    assert nt.end() == 20
+    np.testing.assert_array_equal(nt.data(), arr)
+    np.testing.assert_array_equal(np.load(file), arr)
+    del nt
+
+    # 每块除第一维外的shape要一致
+    with pytest.raises(AssertionError, match="shape mismatch"):
+        NPYT(file).save_stream(iter([arr[:4], np.zeros((4, 3))]), dtype=np.float64, skip_if_exists=False)
+
+    os.remove(file)
+
+
+def test_save_stream_npy8():
+    ns = NPY8(path, 10, 8, dtype=np.int64).load().save_stream(chunks(10))
+    outputs = ns.tail(100)
+    assert [len(x) for x in outputs] == [10] * 7
+    np.testing.assert_array_equal(np.concatenate(outputs), np.arange(70))
+
+    ns.remove()
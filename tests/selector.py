@@ -0,0 +1,68 @@
+import os
+import shutil
+import threading
+import time
+
+import numpy as np
+
+from npyt import NPYT, NPY8
+from npyt.selector import Board, Selector
+
+board_file = "tmp_board.u32"
+arr = np.arange(100, dtype=np.uint64)
+
+
+def test_selector():
+    board = Board(board_file, slots=1024).load()
+    writers = [NPYT(f"tmp_sel_{i}.npy").save(arr[:0], capacity=100, skip_if_exists=False).load(mmap_mode="r+").notify_to(board)
+               for i in range(20)]
+    readers = [NPYT(w.filename()).load(mmap_mode="r") for w in writers]
+    selector = Selector(board)
+    for r in readers:
+        selector.register(r)
+
+    assert selector.select(timeout=0) == []
+
+    writers[3].append(arr[:5])
+    writers[7].append(arr[:5])
+    ready = selector.select(timeout=1)
+    assert ready == [readers[3], readers[7]]
+    readers[3].read(2)
+    # 没读完的还在
+    assert selector.select(timeout=0) == [readers[3], readers[7]]
+    readers[3].read()
+    readers[7].read()
+    assert selector.select(timeout=0) == []
+
+    # 另一个线程写入时唤醒
+    threading.Timer(0.05, lambda: writers[11].append(arr[:1])).start()
+    t0 = time.monotonic()
+    assert selector.select(timeout=5) == [readers[11]]
+    assert time.monotonic() - t0 < 1
+
+    for w in writers:
+        w.remove()
+    os.remove(board_file)
+
+
+def test_selector_npy8():
+    board = Board(board_file, slots=1024).load()
+    ns = NPY8("tmp_sel_npy8", 8, 4, dtype=np.uint64).load().notify_to(board)
+    reader = NPY8("tmp_sel_npy8", 8, 4, dtype=np.uint64).load()
+    selector = Selector(board).register(reader)
+
+    assert selector.select(timeout=0) == []
+    ns.append(arr[:8])
+    assert selector.select(timeout=1) == [reader]
+    assert len(reader.read()) == 8
+    assert selector.select(timeout=0) == []
+    # 切换到新文件也能发现
+    ns.append(arr[:2])
+    assert selector.select(timeout=1) == [reader]
+    assert len(reader.read()) == 2
+    assert selector.select(timeout=0) == []
+    assert selector.select(timeout=0) == []
+
+    ns.remove()
+    shutil.rmtree("tmp_sel_npy8", ignore_errors=True)
+    os.remove(board_file)
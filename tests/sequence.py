@@ -0,0 +1,68 @@
+import shutil
+
+import numpy as np
+
+from npyt import NPYT, NPY8
+
+dtype = np.dtype([("seq", np.uint64), ("price", np.float64)])
+
+
+def make(first, last):
+    arr = np.zeros(last - first + 1, dtype=dtype)
+    arr["seq"] = np.arange(first, last + 1)
+    arr["price"] = arr["seq"] * 0.5
+    return arr
+
+
+def test_sequence():
+    nt = NPYT("tmp_sequence.npy", dtype=dtype).save(capacity=100, skip_if_exists=False).load(mmap_mode="r+")
+    seq = nt.sequence("seq")
+    assert seq.last() is None
+
+    assert nt.append(make(1, 10)) == 0
+    # 重连后重发了一部分
+    assert nt.append(make(6, 15)) == 0
+    np.testing.assert_array_equal(nt.data()["seq"], np.arange(1, 16))
+    # 全部重复
+    assert nt.append(make(3, 8)) == 0
+    assert nt.end() == 15
+    assert seq.gaps() == []
+
+    # 批次内重复、回退，以及缺口
+    batch = np.concatenate([make(16, 18), make(17, 19), make(25, 26), make(30, 30)])
+    assert nt.append(batch) == 0
+    np.testing.assert_array_equal(nt.data()["seq"][15:], [16, 17, 18, 19, 25, 26, 30])
+    assert seq.gaps() == [(20, 24), (27, 29)]
+    assert seq.gaps() == []
+
+    nt.append_columns({"seq": np.array([29, 30, 31], dtype=np.uint64), "price": np.zeros(3)})
+    assert nt.tail(1)["seq"][0] == 31
+
+    # 重新打开后从最后一行恢复
+    nt2 = NPYT("tmp_sequence.npy").load(mmap_mode="r+")
+    assert nt2.sequence("seq").last() == 31
+    assert nt2.expend(make(1, 40)) is True
+    np.testing.assert_array_equal(nt2.tail(9)["seq"], np.arange(32, 41))
+
+    nt.remove()
+
+
+def test_sequence_npy8():
+    ns = NPY8("tmp_sequence", 8, 8, dtype=dtype).load()
+    seq = ns.sequence("seq")
+    for first in range(1, 50, 5):
+        # 每批与上一批重叠5行
+        assert ns.append(make(max(first - 5, 1), first + 4)) == 0
+    ns.append_columns({"seq": np.array([48, 49, 50, 52], dtype=np.uint64), "price": np.zeros(4)})
+
+    out = np.concatenate([NPYT(f).load(mmap_mode="r").data() for f in ns.files() if f.exists()])
+    # 旧文件已出队列，只比较剩下的
+    np.testing.assert_array_equal(out["seq"], np.append(np.arange(1, 51), 52)[-len(out):])
+    assert seq.last() == 52
+    assert seq.gaps() == [(51, 51)]
+
+    ns2 = NPY8("tmp_sequence", 8, 8).load()
+    assert ns2.sequence("seq").last() == 52
+
+    ns.remove()
+    shutil.rmtree("tmp_sequence", ignore_errors=True)
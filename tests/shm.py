@@ -0,0 +1,72 @@
+import mmap
+import os
+import shutil
+
+import numpy as np
+
+from npyt import NPYT, NPY8
+from npyt.shm import shm_path
+
+file = "tmp_shm.npy"
+path = "tmp_shm"
+arr = np.array([1, 2, 3, 4, 5, 6], dtype=np.uint64)
+
+
+def test_shm_npyt():
+    nt = NPYT(shm_path(file)).save(arr, capacity=100, skip_if_exists=False).load(mmap_mode="r+")
+    nt.madvise(mmap.MADV_WILLNEED)
+    nt.append(arr)
+
+    nt.persist(file)
+    nt2 = NPYT(file).load(mmap_mode="r")
+    np.testing.assert_array_equal(nt2.data(), nt.data())
+    assert nt2.capacity() == 12
+
+    nt.remove()
+    nt2.remove()
+
+
+def test_shm_npy8():
+    ns = NPY8(shm_path(path), 4, 3, dtype=np.uint64).load()
+    for i in range(5):
+        ns.append(arr + i)
+    ns.persist(path)
+
+    ns2 = NPY8(path, 4, 3, dtype=np.uint64).load()
+    np.testing.assert_array_equal(np.concatenate(ns2.tail(100)), np.concatenate(ns.tail(100)))
+
+    ns.remove()
+    shutil.rmtree(path)
+    assert not os.path.exists(shm_path(path))
+
+
+def test_shm_persist_trim():
+    nt = NPYT(shm_path(file)).save(np.arange(10000, dtype=np.uint64), capacity=20000,
+                                   skip_if_exists=False).load(mmap_mode="r+")
+    nt.trim(6000)
+    nt.persist(file, capacity=15000)
+    nt2 = NPYT(file).load(mmap_mode="r")
+    # 行号不变，丢弃的行是空洞
+    assert (nt2.start(), nt2.end(), nt2.capacity()) == (6000, 10000, 15000)
+    np.testing.assert_array_equal(nt2.data(), nt.data())
+    assert os.stat(file).st_blocks * 512 < 10000 * 8
+
+    nt.remove()
+    nt2.remove()
+
+
+def test_shm_persist_npy8():
+    ns = NPY8(shm_path(path), 4, 3, dtype=np.uint64).load().subscribe("g")
+    for i in range(5):
+        ns.append(arr + i)
+    ns.read(3)
+    ns.commit()
+    ns.persist(path)
+
+    ns2 = NPY8(path, 4, 3, dtype=np.uint64).load()
+    assert ns2.check() == []
+    # 游标也复制了，从上次提交的位置继续读
+    np.testing.assert_array_equal(ns2.subscribe("g").read(100), ns.read(100))
+
+    ns.remove()
+    shutil.rmtree(path)
@@ -0,0 +1,111 @@
+import shutil
+import threading
+
+import numpy as np
+
+from npyt import NPYT, NPY8
+from npyt.snapshot import Snapshot
+
+dtype = np.dtype([("time", np.int64), ("symbol", "S8"), ("bid", np.float64), ("ask", np.float64)])
+symbols = [b"IF", b"IH", b"IC", b"IM"]
+
+
+def quotes(n, seed):
+    rng = np.random.default_rng(seed)
+    arr = np.zeros(n, dtype=dtype)
+    arr["time"] = np.arange(n)
+    arr["symbol"] = rng.choice(symbols, n)
+    arr["bid"] = rng.random(n)
+    arr["ask"] = arr["bid"] + 1
+    return arr
+
+
+def last_rows(arr):
+    return {s: arr[arr["symbol"] == s][-1] for s in symbols if (arr["symbol"] == s).any()}
+
+
+def test_snapshot():
+    snap = Snapshot("tmp_snapshot.npy", key="symbol").save(symbols, dtype, skip_if_exists=False).load()
+    nt = NPYT("tmp_snapshot_data.npy", dtype=dtype).save(capacity=1000, skip_if_exists=False).load(mmap_mode="r+")
+    nt.snapshot_to(snap)
+
+    arr = quotes(300, 1)
+    for i in range(0, 300, 17):
+        nt.append(arr[i:i + 17])
+    extra = quotes(1, 2)
+    extra["symbol"] = b"XX"
+    nt.append(extra)
+
+    reader = Snapshot("tmp_snapshot.npy", key="symbol").load("r")
+    table = reader.snapshot()
+    assert table.dtype.names == ("symbol", "version", "time", "bid", "ask")
+    assert (table["version"] % 2 == 0).all()
+    for s, row in last_rows(arr).items():
+        got = reader.get(s)[0]
+        assert got["time"] == row["time"] and got["bid"] == row["bid"]
+        assert table[table["symbol"] == s][0]["time"] == row["time"]
+    np.testing.assert_array_equal(reader.rows(np.array([b"IC", b"XX"], dtype="S8")), [2, -1])
+
+    nt.remove()
+    NPYT("tmp_snapshot.npy").load(mmap_mode="r").remove()
+
+
+def test_snapshot_npy8():
+    snap = Snapshot("tmp_snapshot.npy", key="symbol").save(symbols, dtype, skip_if_exists=False).load()
+    ns = NPY8("tmp_snapshot", 50, 4, dtype=dtype).load().snapshot_to(snap)
+    arr = quotes(500, 3)
+    for i in range(0, 500, 30):
+        ns.append(arr[i:i + 30])
+        table = snap.snapshot()
+        for s, row in last_rows(arr[:i + 30]).items():
+            assert table[table["symbol"] == s][0]["time"] == row["time"]
+
+    ns.remove()
+    shutil.rmtree("tmp_snapshot", ignore_errors=True)
+    NPYT("tmp_snapshot.npy").load(mmap_mode="r").remove()
+
+
+def test_snapshot_consistent():
+    snap = Snapshot("tmp_snapshot.npy", key="symbol").save(symbols, dtype, skip_if_exists=False).load()
+    reader = Snapshot("tmp_snapshot.npy", key="symbol").load("r")
+    stop = threading.Event()
+
+    def write():
+        for k in range(2000):
+            arr = quotes(64, k)
+            snap.update(arr)
+        stop.set()
+
+    t = threading.Thread(target=write)
+    t.start()
+    while not stop.is_set():
+        table = reader.snapshot()
+        written = table["version"] > 0
+        # 买卖价总是同一行写入的
+        np.testing.assert_array_equal(table["ask"][written], table["bid"][written] + 1)
+    t.join()
+
+    NPYT("tmp_snapshot.npy").load(mmap_mode="r").remove()
+
+
+def test_snapshot_dead_writer():
+    snap = Snapshot("tmp_snapshot.npy", key="symbol").save(symbols, dtype, skip_if_exists=False).load()
+    arr = quotes(100, 4)
+    snap.update(arr)
+    # 写进程更新到一半退出，版本号停在奇数
+    snap._a["version"][1] += 1
+
+    reader = Snapshot("tmp_snapshot.npy", key="symbol").load("r")
+    table = reader.snapshot(timeout=0.05)
+    np.testing.assert_array_equal(table["version"] % 2, [0, 1, 0, 0])
+    assert reader.get(b"IH", timeout=0.05)["version"][0] % 2 == 1
+
+    # 新的写进程更新后恢复
+    row = arr[arr["symbol"] == b"IH"][-1:].copy()
+    row["bid"] = 100
+    snap.update(row)
+    table = reader.snapshot(timeout=0.05)
+    assert (table["version"] % 2 == 0).all()
+    assert reader.get(b"IH")["bid"][0] == 100
+
+    NPYT("tmp_snapshot.npy").load(mmap_mode="r").remove()
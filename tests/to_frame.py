@@ -0,0 +1,31 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from npyt import NPYT
+
+file = "tmp_frame.npy"
+
+
+def test_to_frame():
+    dtype = np.dtype([("a", np.int32), ("b", np.float64), ("c", "U4")], align=True)
+    arr = np.zeros(5, dtype=dtype)
+    arr["a"] = np.arange(5)
+    arr["b"] = np.arange(5) * 0.5
+    arr["c"] = "abc"
+    nt = NPYT(file).save(arr, capacity=10, skip_if_exists=False).load(mmap_mode="r+")
+
+    columns = nt.to_columns()
+    assert list(columns) == ["a", "b", "c"]
+    assert np.shares_memory(columns["b"], nt._raw())
+
+    df = nt.to_frame()
+    assert np.shares_memory(df["a"].to_numpy(), nt._raw())
+    assert np.shares_memory(df["b"].to_numpy(), nt._raw())
+    pd.testing.assert_frame_equal(df, pd.DataFrame(arr))
+    assert not np.shares_memory(nt.to_frame(copy=True)["b"].to_numpy(), nt._raw())
+
+    del nt, df, columns
+
+    os.remove(file)
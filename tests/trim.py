@@ -0,0 +1,38 @@
+import os
+
+import numpy as np
+
+from npyt import NPYT
+
+file = "tmp_trim.npy"
+arr = np.arange(100000, dtype=np.uint64)
+
+
+def test_trim():
+    nt = NPYT(file).save(arr, capacity=100000, skip_if_exists=False).load(mmap_mode="r+")
+    blocks = os.stat(file).st_blocks
+
+    nt.read(50000)
+    assert nt.trim(nt.tell()) > 0
+    assert nt.start() == 50000
+    assert os.stat(file).st_blocks < blocks
+    # 行号不变
+    assert nt.at(50000) == 50000
+    np.testing.assert_array_equal(nt.data(), arr[50000:])
+    np.testing.assert_array_equal(nt.head(2), [50000, 50001])
+
+    # 只能前进
+    nt.trim(10)
+    assert nt.start() == 50000
+
+    nt2 = NPYT(file).load(mmap_mode="r")
+    np.testing.assert_array_equal(nt2.read(2), [50000, 50001])
+
+    # 数据不移动，trim后写满的文件仍然是满的
+    assert nt.full()
+    assert nt.append(arr[:1]) == 1
+
+    del nt
+    del nt2
+
+    os.remove(file)
@@ -0,0 +1,68 @@
+import shutil
+
+import numpy as np
+
+from npyt import NPYT, NPY8
+from npyt.zonemap import zone_path
+
+file = "tmp_zonemap.npy"
+dtype = np.dtype([("price", np.float64), ("volume", np.int64)])
+arr = np.zeros(10000, dtype=dtype)
+arr["price"] = np.arange(10000) / 10
+arr["volume"] = np.arange(10000) % 100
+
+
+def test_zonemap():
+    nt = NPYT(file).save(arr[:1000], capacity=20000, skip_if_exists=False).load(mmap_mode="r+")
+    zm = nt.zonemap(["price"], block_size=1000)
+    assert len(zm.entries()) == 1
+    for i in range(1000, 10000, 300):
+        nt.append(arr[i:i + 300])
+    entries = zm.entries()
+    assert len(entries) == 10
+    np.testing.assert_array_equal(entries["price_min"], arr["price"][::1000])
+    np.testing.assert_array_equal(entries["price_max"], arr["price"][999::1000])
+
+    # 只有最后一块可能满足
+    assert zm.blocks([("price", ">", 950)]) == [(9000, 10000)]
+    # 没统计的字段不能排除
+    assert zm.blocks([("volume", "==", 5)]) == [(0, 10000)]
+    conditions = [("price", ">", 950), ("volume", ">=", 90)]
+    expected = arr[(arr["price"] > 950) & (arr["volume"] >= 90)]
+    np.testing.assert_array_equal(nt.filter(conditions), expected)
+
+    # 读进程使用旁路文件
+    reader = NPYT(file).load(mmap_mode="r")
+    np.testing.assert_array_equal(reader.filter(conditions), expected)
+    assert len(reader.filter([("price", "<", 0)])) == 0
+
+    # 重新打开时补上没统计的行，扩容后也继续统计
+    nt.expend(arr[:15000].copy())
+    NPYT(file).load(mmap_mode="r+").zonemap(["price"], block_size=1000)
+    assert len(NPYT(file).load(mmap_mode="r").filter([("price", "==", 999.9)])) == 2
+
+    nt.remove()
+    assert not zone_path(file).exists()
+
+
+def test_zonemap_npy8():
+    path = "tmp_zonemap_npy8"
+    ns = NPY8(path, 1000, 4, dtype=dtype).load().zonemap(["price"], block_size=100)
+    for i in range(0, 4000, 500):
+        ns.append(arr[i:i + 500])
+    reader = NPY8(path, 1000, 4, dtype=dtype).load()
+    outputs = reader.filter([("price", ">=", 350), ("price", "<", 350.5)])
+    assert len(outputs) == 1
+    np.testing.assert_array_equal(outputs[0], arr[3500:3505])
+
+    ns.remove()
+    shutil.rmtree(path, ignore_errors=True)
+
+
+def test_zonemap_scalar_type():
+    # dtype传入的是标量类型，不是np.dtype
+    nt = NPYT("tmp_zone_type.npy", dtype=np.uint64).save(np.arange(100, dtype=np.uint64), capacity=1000,
+                                                         skip_if_exists=False).load(mmap_mode="r+")
+    nt.zonemap(block_size=16)
+    np.testing.assert_array_equal(nt.filter([(None, ">=", 95)]), np.arange(95, 100))
+    nt.remove()